@@ -5,7 +5,7 @@ import pandas as pd
 
 from dvidutils import LabelMapper
 
-from neuclease.dvid.labelmap import fetch_labelindex, fetch_labelarray_voxels, decode_labelindex_blocks
+from neuclease.dvid.labelmap import fetch_labelindex, fetch_labelarray_voxels, decode_labelindex_blocks, decode_labelindex_arrays
 from neuclease.util.graph import connected_components, connected_components_nonconsecutive
 from neuclease.dvid.labelmap._labelmap import fetch_supervoxels
 
@@ -102,9 +102,10 @@ def find_missing_adjacencies(server, uuid, instance, body, known_edges, svs=None
     if orig_num_cc == 1:
         return np.zeros((0,2), np.uint64), orig_num_cc, final_num_cc, pd.DataFrame(columns=BLOCK_TABLE_COLS)
 
-    labelindex = fetch_labelindex(server, uuid, instance, body, format='protobuf')
-    encoded_block_coords = np.fromiter(labelindex.blocks.keys(), np.uint64, len(labelindex.blocks))
-    coords_zyx = decode_labelindex_blocks(encoded_block_coords)
+    labelindex = decode_labelindex_arrays(fetch_labelindex(server, uuid, instance, body, format='raw'))
+    coords_zyx = decode_labelindex_blocks(labelindex.block_ids)
+    block_starts = labelindex.block_offsets[:-1]
+    block_stops = labelindex.block_offsets[1:]
 
     cc_mapper = LabelMapper(svs, cc)
     svs_set = set(svs)
@@ -115,10 +116,10 @@ def find_missing_adjacencies(server, uuid, instance, body, known_edges, svs=None
     
     searched_block_svs = {}
     
-    for coord_zyx, sv_counts in zip(coords_zyx, labelindex.blocks.values()):
+    for coord_zyx, start, stop in zip(coords_zyx, block_starts, block_stops):
         # Given the supervoxels in this block, what CC adjacencies
         # MIGHT we find if we were to inspect the segmentation?
-        block_svs = np.fromiter(sv_counts.counts.keys(), np.uint64)
+        block_svs = labelindex.svs[start:stop]
         block_ccs = cc_mapper.apply(block_svs)
         possible_cc_adjacencies = set(combinations( set(block_ccs), 2 ))
         
@@ -5,7 +5,6 @@ import argparse
 from datetime import datetime
 
 import ujson
-import requests
 import numpy as np
 import pandas as pd
 import networkx as nx
@@ -105,15 +104,8 @@ def copy_splits_exact(src_server, src_uuid, src_instance, dest_server, dest_uuid
 
 
 def fetch_and_combine_sparsevols(server, uuid, instance, labels, supervoxels=False):
-    sparsevols = []
-    for label in labels:
-        try:
-            sparsevol = fetch_sparsevol_rles(server, uuid, instance, label, supervoxels=supervoxels)
-            sparsevols.append(sparsevol)
-        except requests.RequestException as ex:
-            if ex.response.status_code != 404:
-                raise
-    
+    sparsevols = iter_sparsevols(server, uuid, instance, labels, supervoxels, format='rle-bytes', threads=4)
+    sparsevols = [sparsevol for _label, sparsevol in sparsevols if sparsevol is not None]
     combined_payload = combine_sparsevol_rle_responses(sparsevols)
     return combined_payload
 
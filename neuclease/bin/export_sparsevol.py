@@ -37,13 +37,14 @@ See below for option/parameter reference.
 """
 
 
-def export_sparsevol(server, uuid, instance, neurons_df, scale=5, format='tiff', output_dir='.'):
+def export_sparsevol(server, uuid, instance, neurons_df, scale=5, format='tiff', output_dir='.', threads=8):
     import os
     import vigra
     import numpy as np
 
     from neuclease.util import round_box, tqdm_proxy
-    from neuclease.dvid import fetch_sparsevol, resolve_ref, fetch_volume_box, box_to_slicing
+    from neuclease.dvid import iter_sparsevols, resolve_ref, fetch_volume_box, box_to_slicing
+    from neuclease.dvid.rle import runlength_decode_from_ranges_to_mask
 
     uuid = resolve_ref(server, uuid)
 
@@ -67,8 +68,11 @@ def export_sparsevol(server, uuid, instance, neurons_df, scale=5, format='tiff',
         group_mask = vigra.taggedView(group_mask, 'zyx')
 
         # Overlay each body mask in the current group
-        for body in tqdm_proxy(df['body'], leave=False):
-            body_mask, mask_box = fetch_sparsevol(*seg, body, scale=scale, format='mask')
+        body_ranges = iter_sparsevols(*seg, df['body'], scale=scale, threads=threads)
+        for body, ranges in tqdm_proxy(body_ranges, total=df['body'].nunique(), leave=False):
+            if ranges is None:
+                raise RuntimeError(f"Body {body} does not exist")
+            body_mask, mask_box = runlength_decode_from_ranges_to_mask(ranges)
             group_mask[box_to_slicing(*mask_box)] |= body_mask
 
         # Write out the slice files
@@ -90,6 +94,8 @@ def main(raw_args=None):
                              'regardless of the "group" column in the input (if any).')
     parser.add_argument('--format', '-f', default='tiff',
                         help='Slice file format in the output, e.g. "tiff" or "png"')
+    parser.add_argument('--threads', '-t', type=int, default=8,
+                        help='How many sparsevols to fetch from DVID concurrently.')
     parser.add_argument('server',
                         help='dvid server, e.g. "http://emdata4.int.janelia.org:8900"')
     parser.add_argument('uuid',
@@ -135,7 +141,7 @@ def main(raw_args=None):
     if args.combine_all:
         neurons_df['group'] = 'all'
 
-    export_sparsevol(args.server, args.uuid, args.labelmap_instance, neurons_df, args.scale, args.format)
+    export_sparsevol(args.server, args.uuid, args.labelmap_instance, neurons_df, args.scale, args.format, threads=args.threads)
 
 
 if __name__ == "__main__":
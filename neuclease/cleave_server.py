@@ -1,6 +1,7 @@
 import os
 import sys
 import copy
+import base64
 import signal
 import logging
 import argparse
@@ -10,8 +11,15 @@ from http import HTTPStatus
 from datetime import datetime
 
 import ujson
+import numpy as np
 import pandas as pd
 
+try:
+    import orjson
+    _have_orjson = True
+except ImportError:
+    _have_orjson = False
+
 import requests
 from flask import Flask, request, abort, redirect, url_for, jsonify, Response, make_response
 
@@ -19,7 +27,7 @@ from .logging_setup import init_logging, log_exceptions, PrefixedLogger
 from .merge_table import MERGE_TABLE_DTYPE
 from .merge_graph import LabelmapMergeGraph
 from .cleave import cleave, InvalidCleaveMethodError
-from .dvid import DvidInstanceInfo
+from .dvid import DvidInstanceInfo, MutationLog
 from .util import Timer
 from neuclease.dvid._dvid import default_dvid_session
 
@@ -61,10 +69,22 @@ def main(debug_mode=False, stdout_logging=False):
     parser.add_argument('--initialization-labelmap-instance')
     parser.add_argument('--primary-kafka-log', required=False,
                         help="Normally the startup procedure involves reading the entire kafka log for the primary dvid instance. "
-                        "But if you supply one here in 'jsonl' format, it will be used instead of downloading the log from kafka.")
+                        "But if you supply one here in 'jsonl' format, it will be used instead of downloading the log from kafka. "
+                        "A MutationLog saved in '.npz' format (see neuclease.dvid.MutationLog.save()) is also accepted, and loads much faster.")
+
+    parser.add_argument('--mapping-cache-dir', required=False,
+                        help="Keep a local copy of the primary instance's mapping (and kafka log) in the given directory, "
+                        "so subsequent launches only need to fetch the changes since the last launch.")
 
     parser.add_argument('--skip-focused-merge-update', action='store_true')
     parser.add_argument('--skip-split-sv-update', action='store_true')
+
+    parser.add_argument('--publish-shared-graph', required=False,
+                        help="After loading the merge graph, publish it to the given directory (e.g. /dev/shm/hemibrain-graph), "
+                        "so that other cleave server processes can attach to it via --attach-shared-graph.")
+    parser.add_argument('--attach-shared-graph', required=False,
+                        help="Instead of loading the merge graph, attach (read-only) to a graph which was published "
+                        "by another cleave server process via --publish-shared-graph.")
     args = parser.parse_args()
 
     # By default, initialization is same as primary unless otherwise specified
@@ -84,7 +104,7 @@ def main(debug_mode=False, stdout_logging=False):
                 "If you don't supply a merge-table, please provide an explicit --log-dir"
             args.log_dir = os.path.dirname(args.merge_table)
 
-        LOGFILE = init_logging(logger, args.log_dir, args.merge_table or 'no-merge-table', stdout_logging)
+        LOGFILE = init_logging(logger, args.log_dir, args.merge_table or args.attach_shared_graph or 'no-merge-table', stdout_logging)
         logger.info("Server started with command: " + ' '.join(sys.argv))
     
         ##
@@ -99,38 +119,44 @@ def main(debug_mode=False, stdout_logging=False):
 
         kafka_msgs = None
         if args.primary_kafka_log:
-            assert args.primary_kafka_log.endswith('.jsonl'), \
-                "Supply the kafka log in .jsonl format"
-            kafka_msgs = []
-            for line in open(args.primary_kafka_log, 'r'):
-                kafka_msgs.append(ujson.loads(line))
-
-        print("Loading merge table...")
-        with Timer(f"Loading merge table from: {args.merge_table or 'NONE'}", logger):
-            MERGE_GRAPH = LabelmapMergeGraph(args.merge_table, primary_instance_info.uuid, args.debug_export_dir, no_kafka=args.testing)
-
-        if not args.skip_focused_merge_update:
-            with Timer(f"Loading focused merge decisions", logger):
-                num_focused_merges = MERGE_GRAPH.append_edges_for_focused_merges(*initialization_instance_info[:2], 'segmentation_merged')
-            logger.info(f"Loaded {num_focused_merges} merge decisions.")
-
-        # Apply splits first
-        if all(primary_instance_info) and not args.skip_split_sv_update:
-            with Timer(f"Appending split supervoxel edges for supervoxels in", logger):
-                bad_edges = MERGE_GRAPH.append_edges_for_split_supervoxels( initialization_instance_info, read_from='dvid', kafka_msgs=kafka_msgs )
-
-                if len(bad_edges) > 0:
-                    bad_edges_name = f'BAD-SPLIT-EDGES-{args.primary_uuid[:4]}.csv'
-                    bad_edges_filepath = args.log_dir + '/' + bad_edges_name
-                    bad_edges.to_csv(bad_edges_filepath, index=False, header=True)
-                    logger.error(f"Some edges belonging to split supervoxels could not be preserved, due to {len(bad_edges)} bad representative points.")
-                    logger.error(f"See {bad_edges_filepath}")
-
-        # Apply mapping (after splits), either from file or from DVID.
-        if args.mapping_file:
-            MERGE_GRAPH.apply_mapping(args.mapping_file)
-        elif all(primary_instance_info):
-            MERGE_GRAPH.fetch_and_apply_mapping(*primary_instance_info, kafka_msgs)
+            assert os.path.splitext(args.primary_kafka_log)[1] in ('.jsonl', '.npz'), \
+                "Supply the kafka log in .jsonl or .npz format"
+            with Timer(f"Loading kafka log from {args.primary_kafka_log}", logger):
+                kafka_msgs = MutationLog.load(args.primary_kafka_log)
+
+        if args.attach_shared_graph:
+            print("Attaching to shared merge graph...")
+            MERGE_GRAPH = LabelmapMergeGraph.attach_shared(args.attach_shared_graph, primary_instance_info.uuid, args.debug_export_dir)
+        else:
+            print("Loading merge table...")
+            with Timer(f"Loading merge table from: {args.merge_table or 'NONE'}", logger):
+                MERGE_GRAPH = LabelmapMergeGraph(args.merge_table, primary_instance_info.uuid, args.debug_export_dir, no_kafka=args.testing)
+
+            if not args.skip_focused_merge_update:
+                with Timer(f"Loading focused merge decisions", logger):
+                    num_focused_merges = MERGE_GRAPH.append_edges_for_focused_merges(*initialization_instance_info[:2], 'segmentation_merged')
+                logger.info(f"Loaded {num_focused_merges} merge decisions.")
+
+            # Apply splits first
+            if all(primary_instance_info) and not args.skip_split_sv_update:
+                with Timer(f"Appending split supervoxel edges for supervoxels in", logger):
+                    bad_edges = MERGE_GRAPH.append_edges_for_split_supervoxels( initialization_instance_info, read_from='dvid', kafka_msgs=kafka_msgs )
+
+                    if len(bad_edges) > 0:
+                        bad_edges_name = f'BAD-SPLIT-EDGES-{args.primary_uuid[:4]}.csv'
+                        bad_edges_filepath = args.log_dir + '/' + bad_edges_name
+                        bad_edges.to_csv(bad_edges_filepath, index=False, header=True)
+                        logger.error(f"Some edges belonging to split supervoxels could not be preserved, due to {len(bad_edges)} bad representative points.")
+                        logger.error(f"See {bad_edges_filepath}")
+
+            # Apply mapping (after splits), either from file or from DVID.
+            if args.mapping_file:
+                MERGE_GRAPH.apply_mapping(args.mapping_file)
+            elif all(primary_instance_info):
+                MERGE_GRAPH.fetch_and_apply_mapping(*primary_instance_info, kafka_msgs, mapping_cache_dir=args.mapping_cache_dir)
+
+            if args.publish_shared_graph:
+                MERGE_GRAPH.publish_shared(args.publish_shared_graph)
 
         if args.suspend_before_launch:
             pid = os.getpid()
@@ -196,8 +222,16 @@ def compute_cleave():
         "port": 8700,
         "uuid": "f73ce97d08064bcba34f2637c356e490",
         "segmentation-instance": "segmentation",
-        "mesh-instance": "segmentation_meshes_tars"
+        "mesh-instance": "segmentation_meshes_tars",
+        "assignments-format": "json"
     }
+
+    The optional "assignments-format" field controls how the assigned
+    supervoxels for each label are encoded in the response:
+
+        - "json" (default): a list of ints
+        - "base64-uint64": a base64-encoded string of little-endian uint64 values,
+          which is much more compact for large bodies.
     """
     with Timer() as timer:
         data = request.json
@@ -220,7 +254,7 @@ def compute_cleave():
         body_logger.info(f"Received cleave request: {req_string}")
         cleave_results, status_code = _run_cleave(data)
 
-        json_response = jsonify(cleave_results)
+        json_response = Response(_encode_json(cleave_results), mimetype='application/json')
     
     body_logger.info(f"Total time: {timer.timedelta}")
     return json_response, status_code
@@ -244,6 +278,7 @@ def _run_cleave(data):
     uuid = data["uuid"]
     segmentation_instance = data["segmentation-instance"]
     find_missing_edges = data.get("find-missing-edges", True)
+    assignments_format = data.get("assignments-format", "json")
 
     body_logger = PrefixedLogger(logger, f"User {user}: Body {body_id}: ")
 
@@ -267,6 +302,13 @@ def _run_cleave(data):
         cleave_response.setdefault("errors", []).append(msg)
         return cleave_response, HTTPStatus.PRECONDITION_FAILED # code 412
 
+    if assignments_format not in ASSIGNMENTS_FORMATS:
+        msg = f"Invalid assignments-format: '{assignments_format}'. Choices are: {ASSIGNMENTS_FORMATS}"
+        body_logger.error(msg)
+        body_logger.info("Responding with error BAD_REQUEST.")
+        cleave_response.setdefault("errors", []).append(msg)
+        return cleave_response, HTTPStatus.BAD_REQUEST # code 400
+
     # Extract this body's edges from the complete merge graph
     with Timer() as timer:
         try:
@@ -305,11 +347,9 @@ def _run_cleave(data):
         
     body_logger.info(f"Computing cleave took {timer.timedelta}")
 
-    # Convert assignments to JSON
-    df = pd.DataFrame({'node': supervoxels, 'label': results.output_labels})
-    df.sort_values('node', inplace=True)
-    for label, group in df.groupby('label'):
-        cleave_response["assignments"][str(label)] = group['node'].tolist()
+    assignments = assignments_by_label(supervoxels, results.output_labels)
+    num_unlabeled = len(assignments.get(0, []))
+    cleave_response["assignments"] = encode_assignments(assignments, assignments_format)
 
     if results.disconnected_components:
         msg = (f"Cleave result contains non-contiguous objects for seeds: "
@@ -318,7 +358,6 @@ def _run_cleave(data):
         cleave_response["info"].append(msg)
 
     if results.contains_unlabeled_components:
-        num_unlabeled = len(cleave_response["assignments"]["0"])
         msg = f"Cleave result is not complete. {num_unlabeled} supervoxels remain unassigned."
         body_logger.error(msg)
         body_logger.warning(msg)
@@ -328,6 +367,76 @@ def _run_cleave(data):
     return ( cleave_response, HTTPStatus.OK )
 
 
+def assignments_by_label(supervoxels, labels):
+    """
+    Group the given supervoxels by their assigned cleave label.
+
+    Returns:
+        dict of { label: ndarray of supervoxels (sorted) }, ordered by label.
+    """
+    supervoxels = np.asarray(supervoxels, np.uint64)
+    labels = np.asarray(labels)
+
+    # Sort by label, then by supervoxel
+    order = np.lexsort((supervoxels, labels))
+    sorted_svs = supervoxels[order]
+    sorted_labels = labels[order]
+
+    splits = np.flatnonzero(sorted_labels[1:] != sorted_labels[:-1]) + 1
+    unique_labels = sorted_labels[np.concatenate(([0], splits))] if len(sorted_labels) else []
+    return dict(zip(map(int, unique_labels), np.split(sorted_svs, splits)))
+
+
+ASSIGNMENTS_FORMATS = ('json', 'base64-uint64')
+
+def encode_assignments(assignments, assignments_format='json'):
+    """
+    Prepare the output of assignments_by_label() for the JSON response.
+
+    Args:
+        assignments:
+            dict of { label: ndarray of supervoxels }
+
+        assignments_format:
+            Either 'json', in which case the supervoxel arrays are left as-is
+            (to be encoded as lists of ints by _encode_json()), or 'base64-uint64',
+            in which case each array is encoded as a base64 string of little-endian uint64 values.
+
+    Returns:
+        dict of { str(label): ndarray or str }
+    """
+    assert assignments_format in ASSIGNMENTS_FORMATS
+    if assignments_format == 'json':
+        return { str(label): svs for label, svs in assignments.items() }
+
+    encoded = {}
+    for label, svs in assignments.items():
+        svs = np.ascontiguousarray(svs, dtype='<u8')
+        encoded[str(label)] = base64.b64encode(svs.tobytes()).decode('ascii')
+    return encoded
+
+
+def _encode_json(obj):
+    """
+    Encode the given object (which may contain numpy arrays) as JSON bytes.
+    Uses orjson (which encodes numpy arrays natively) if it's available,
+    otherwise converts arrays to lists and uses ujson.
+    """
+    if _have_orjson:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return ujson.dumps(_arrays_to_lists(obj)).encode('utf-8')
+
+
+def _arrays_to_lists(obj):
+    if isinstance(obj, dict):
+        return { k: _arrays_to_lists(v) for k,v in obj.items() }
+    if isinstance(obj, (list, tuple)):
+        return [ _arrays_to_lists(v) for v in obj ]
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    return obj
+
+
 @app.route('/primary-uuid')
 def get_primary_uuid():
     global MERGE_GRAPH
@@ -344,6 +453,58 @@ def set_primary_uuid():
     return response, HTTPStatus.OK
 
 
+@app.route('/new-node', methods=['POST'])
+def new_node():
+    """
+    Notify the server that a new DVID node was created (e.g. via commit or branch),
+    so the cached repo DAG info is refreshed before the node is used in a cleave request.
+
+    Example body json:
+
+    {
+        "server": "emdata2.int.janelia.org",
+        "port": 8700,
+        "uuid": "f73ce97d08064bcba34f2637c356e490"
+    }
+    """
+    global MERGE_GRAPH
+    data = request.json
+    server = data["server"] + ':' + str(data["port"])
+    repo_uuid = MERGE_GRAPH.notify_new_node(server, data["uuid"])
+    logger.info(f"Refreshed repo info for new node {data['uuid']} (repo {repo_uuid})")
+    response = jsonify( { "uuid": data["uuid"], "repo-uuid": repo_uuid } )
+    return response, HTTPStatus.OK
+
+
+@app.route('/add-edges', methods=['POST'])
+def add_edges():
+    """
+    Add edges to the merge graph while the server is running,
+    e.g. for new focused merge decisions or split supervoxels.
+
+    Example body json:
+
+    {
+        "edges": [
+            {"id_a": 123, "id_b": 456, "score": 0.01,
+             "xa": 10, "ya": 20, "za": 30, "xb": 11, "yb": 20, "zb": 30},
+            {"id_a": 789, "id_b": 1011, "score": 0.2}
+        ]
+    }
+
+    Coordinates are optional.
+    """
+    global MERGE_GRAPH
+    data = request.json
+    edges_df = pd.DataFrame(data["edges"])
+    if len(edges_df) > 0 and not {'id_a', 'id_b', 'score'} <= set(edges_df.columns):
+        abort(Response('Edges must include id_a, id_b, and score', status=400))
+
+    num_edges = MERGE_GRAPH.add_edges(edges_df)
+    logger.info(f"Added {num_edges} edges to the merge graph")
+    return jsonify( { "added": num_edges } ), HTTPStatus.OK
+
+
 @app.route('/body-edge-table', methods=['POST'])
 def body_edge_table():
     """
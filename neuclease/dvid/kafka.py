@@ -192,7 +192,7 @@ def kafka_info_for_dvid_instance(server, uuid, instance, kafka_servers=None, top
     return kafka_servers, topic, dag
 
 
-def _read_complete_kafka_log(topic_name, kafka_servers, group_id=None, timeout_seconds=2.0):
+def _read_complete_kafka_log(topic_name, kafka_servers, group_id=None, timeout_seconds=2.0, start_offsets=None):
     """
     Helper function.
     Read the complete kafka log for the given topic.
@@ -200,14 +200,29 @@ def _read_complete_kafka_log(topic_name, kafka_servers, group_id=None, timeout_s
 
     Special care is taken to ensure that the complete log was read.
     An error is raised if it appears that the log was terminated early.
+
+    If start_offsets is given, it must be a dict of {partition_id: offset},
+    indicating the last record that was already read from each partition.
+    In that case, only the subsequent records are returned.
+    If there are no such records, the topic isn't consumed at all
+    (so there's no need to wait for the consumer timeout).
     """
     from pykafka import KafkaClient
     client = KafkaClient(hosts=','.join(kafka_servers))
     topic = client.topics[topic_name.encode('utf-8')]
+
+    if start_offsets is not None:
+        latest_offsets = {pid: val.offset[0] for pid, val in topic.latest_available_offsets().items()}
+        if all(latest - 1 <= start_offsets.get(pid, -1) for pid, latest in latest_offsets.items()):
+            return []
+
     consumer = topic.get_simple_consumer( consumer_group=group_id,
                                           consumer_timeout_ms=int(1000*timeout_seconds),
                                           auto_commit_enable=(group_id is not None) )
 
+    if start_offsets:
+        consumer.reset_offsets([(consumer.partitions[pid], offset) for pid, offset in start_offsets.items()])
+
     try:
         # Consumer isn't fully initialized until the first message is fetched.
         # (For example, consumer.assignment() can't be used until we fetch a message first.)
@@ -246,6 +261,9 @@ def _read_complete_kafka_log(topic_name, kafka_servers, group_id=None, timeout_s
     consumer.stop()
     time.sleep(0.1)
 
+    if start_offsets:
+        records = [rec for rec in records if rec.offset > start_offsets.get(rec.partition_id, -1)]
+
     return records
 
 
@@ -333,33 +351,36 @@ def kafka_msgs_to_df(msgs, drop_duplicates=False, default_timestamp=DEFAULT_TIME
         msgs = msg_strings.values
 
     # Parse JSON if necessary
-    if isinstance(msgs[0], str):
-        msgs = [ujson.loads(msg) for msg in msgs]
+    if isinstance(msgs[0], (str, bytes)):
+        msgs = [*map(ujson.loads, msgs)]
 
-    timestamps = np.repeat(None, len(msgs))
-    timestamps[:] = default_timestamp
+    # Extract all columns in a single pass over the messages.
+    has_mutid = 'MutationID' in msgs[0]
+    has_key = 'Key' in msgs[0]
+    timestamps = [None]*len(msgs)
+    uuids = [None]*len(msgs)
+    mutids = np.zeros(len(msgs), np.int64)
+    keys = [None]*len(msgs)
 
     for i, msg in enumerate(msgs):
-        if 'Timestamp' in msg:
-            timestamps[i] = msg['Timestamp'][:len('2018-01-01 00:00:00.000')]
+        ts = msg.get('Timestamp')
+        if ts:
+            timestamps[i] = ts[:len('2018-01-01 00:00:00.000')]
+        uuids[i] = msg['UUID']
+        if has_mutid:
+            mutids[i] = msg.get('MutationID', 0)
+        if has_key:
+            keys[i] = msg['Key']
 
     msgs_df = pd.DataFrame({'msg': msgs})
-    msgs_df['timestamp'] = timestamps
-    msgs_df['timestamp'] = pd.to_datetime(msgs_df['timestamp'])
-    msgs_df['uuid'] = [msg['UUID'] for msg in msgs_df['msg']]
-    msgs_df['uuid'] = msgs_df['uuid'].astype('category')
-
-    if 'MutationID' in msgs[0]:
-        mutids = []
-        for msg in msgs_df['msg']:
-            try:
-                mutids.append( msg['MutationID'] )
-            except KeyError:
-                mutids.append( 0 )
+    msgs_df['timestamp'] = pd.to_datetime(pd.Series(timestamps, dtype=object)).fillna(pd.Timestamp(default_timestamp))
+    msgs_df['uuid'] = pd.Categorical(uuids)
+
+    if has_mutid:
         msgs_df['mutid'] = mutids
 
-    if 'Key' in msgs[0]:
-        msgs_df['key'] = [msg['Key'] for msg in msgs_df['msg']]
+    if has_key:
+        msgs_df['key'] = keys
 
     columns = ['timestamp', 'uuid', 'mutid', 'key', 'msg']
 
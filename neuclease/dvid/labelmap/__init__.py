@@ -1,4 +1,9 @@
 from ._labelmap import *
 from ._split import *
 from ._labelindex import *
+from ._mutationlog import *
 
+from ._labelblocks import *
+from ._sparsevols import *
+from ._sparsevolcache import *
+from ._mappingcache import *
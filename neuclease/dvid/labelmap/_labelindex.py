@@ -1,4 +1,5 @@
 from functools import partial
+from itertools import chain
 from collections import namedtuple
 from collections.abc import Iterable, Sequence
 
@@ -41,7 +42,9 @@ def fetch_labelindex(server, uuid, instance, label, format='protobuf', *, sessio
               - ``protobuf`` (A ``LabelIndex`` protobuf structure.)
               - ``pandas`` (See description in ``convert_labelindex_to_pandas()``)
 
-            The 'pandas' format is slowest, but is most convenient to analyze.
+            The 'pandas' format is decoded directly from the raw bytes,
+            without constructing the protobuf structure.
+            (See ``decode_labelindex_bytes()``.)
     
     Returns:
         See 'format' description.
@@ -54,13 +57,14 @@ def fetch_labelindex(server, uuid, instance, label, format='protobuf', *, sessio
     if format == 'raw':
         return r.content
 
+    if format == 'pandas':
+        return decode_labelindex_bytes(r.content)
+
     labelindex = LabelIndex()
     labelindex.ParseFromString(r.content)
 
     if format == 'protobuf':
         return labelindex
-    elif format == 'pandas':
-        return convert_labelindex_to_pandas(labelindex)
 
 @dvid_api_wrapper
 def fetch_labelindices(server, uuid, instance, labels, *, format='protobuf', session=None): # @ReservedAssignment
@@ -101,6 +105,15 @@ def fetch_labelindices(server, uuid, instance, labels, *, format='protobuf', ses
     if format == 'raw':
         return r.content
 
+    if format == 'pandas':
+        return decode_labelindices_bytes(r.content)
+    if format == 'single-dataframe':
+        dfs = []
+        for pli in decode_labelindices_bytes(r.content):
+            pli.blocks['label'] = np.uint64(pli.label)
+            dfs.append(pli.blocks)
+        return pd.concat(dfs, ignore_index=True)
+
     labelindices = LabelIndices()
     labelindices.ParseFromString(r.content)
 
@@ -108,15 +121,6 @@ def fetch_labelindices(server, uuid, instance, labels, *, format='protobuf', ses
         return labelindices
     if format == 'list-of-protobuf':
         return list(labelindices.indices)
-    if format == 'pandas':
-        return list(map(convert_labelindex_to_pandas, labelindices.indices))
-    if format == 'single-dataframe':
-        dfs = []
-        for idx in labelindices.indices:
-            df = convert_labelindex_to_pandas(idx)
-            df.blocks['label'] = idx.label
-            dfs.append(df.blocks)
-        return pd.concat(dfs, ignore_index=True)
 
 
 @dvid_api_wrapper
@@ -131,13 +135,18 @@ def post_labelindex(server, uuid, instance, label, proto_index, *, session=None)
             Must match the internal label field within the proto_index structure.
         proto_index:
             A protobuf labelops_pb2.LabelIndex
-            Optionally, you may pre-serialize it and provide it as bytes instead.
+            Optionally, you may pre-serialize it and provide it as bytes instead,
+            or provide a PandasLabelIndex, which will be encoded via
+            ``encode_labelindex_bytes()`` (without constructing the protobuf structure).
     """
     payload = None
-    assert isinstance(proto_index, (bytes, LabelIndex))
+    assert isinstance(proto_index, (bytes, LabelIndex, PandasLabelIndex))
     if isinstance(proto_index, LabelIndex):
         assert proto_index.label == label
         payload = proto_index.SerializeToString()
+    elif isinstance(proto_index, PandasLabelIndex):
+        assert proto_index.label == label
+        payload = encode_labelindex_bytes(proto_index)
     elif isinstance(proto_index, bytes):
         payload = proto_index
 
@@ -154,37 +163,37 @@ def post_labelindices(server, uuid, instance, indices, *, session=None):
         indices:
             One of the following:
               - A list of LabelIndex (protobuf) objects
+              - A list of PandasLabelIndex tuples
               - A pre-loaded LabelIndices protobuf object
               - A list of pre-serialized LabelIndex objects (as bytes)
               - A single pre-serializsed LabelIndices object (as bytes)
+              - A non-list iterable (e.g. a generator) of any of the above list item types.
+                In that case, each index is encoded as it is consumed and
+                the request body is streamed to DVID (via chunked transfer encoding),
+                so the full batch is never held in memory at once.
     """
-    if isinstance(indices, Sequence) and len(indices) == 0:
-        # This can happen when tombstone_mode == 'only'
-        # and a label contained only one supervoxel.
-        return
-
-    if not isinstance(indices, (LabelIndices, Sequence)):
-        assert isinstance(indices, Iterable)
-        indices = list(indices)
-
-    payload = None
     if isinstance(indices, bytes):
         payload = indices
-    elif isinstance(indices, Sequence) and isinstance(indices[0], bytes):
-        payload = b''.join(indices)
-    elif isinstance(indices, Sequence) and isinstance(indices[0], LabelIndex):
-        label_indices = LabelIndices()
-        label_indices.indices.extend(indices)
-        payload = label_indices.SerializeToString()
     elif isinstance(indices, LabelIndices):
         if len(indices.indices) == 0:
             # This can happen when tombstone_mode == 'only'
             # and a label contained only one supervoxel.
             return
         payload = indices.SerializeToString()
+    elif isinstance(indices, Sequence):
+        if len(indices) == 0:
+            # This can happen when tombstone_mode == 'only'
+            # and a label contained only one supervoxel.
+            return
+        payload = encode_labelindices_bytes(indices)
     else:
-        msg = f"Unhandled input type for posting label indices: {type(indices)}"
-        raise AssertionError(msg)
+        assert isinstance(indices, Iterable), \
+            f"Unhandled input type for posting label indices: {type(indices)}"
+        indices = iter(indices)
+        first = next(indices, None)
+        if first is None:
+            return
+        payload = map(_encode_labelindices_item, chain([first], indices))
 
     endpoint = f'{server}/api/node/{uuid}/{instance}/indices'
     r = session.post(endpoint, data=payload)
@@ -247,7 +256,8 @@ def _copy_labelindex_batch(src_triple, dest_triple, labels_batch):
     Defined here at the module top-level to allow it to be
     pickled when using multiprocessing.
     """
-    indexes_batch = fetch_labelindices(*src_triple, labels_batch)
+    # No need to parse the indexes; just pass the serialized LabelIndices along.
+    indexes_batch = fetch_labelindices(*src_triple, labels_batch, format='raw')
     post_labelindices(*dest_triple, indexes_batch)
 
 
@@ -266,42 +276,233 @@ def convert_labelindex_to_pandas(labelindex):
         with the following columns: ['z', 'y', 'x', 'sv', 'count'].
         Note that the block coordinates are given in VOXEL units.
         That is, all coordinates in the table are multiples of 64.
+
+    Note:
+        If you are fetching the labelindex from DVID, it's faster to skip
+        the protobuf structure entirely and use ``decode_labelindex_bytes()``,
+        e.g. via ``fetch_labelindex(..., format='pandas')``.
     """
-    encoded_block_coords = np.fromiter(labelindex.blocks.keys(), np.uint64, len(labelindex.blocks))
-    coords_zyx = decode_labelindex_blocks(encoded_block_coords)
+    return decode_labelindex_bytes(labelindex.SerializeToString())
+
+
+LabelIndexArrays = namedtuple("LabelIndexArrays", "block_ids block_offsets svs counts label last_mutid last_mod_time last_mod_user")
+def decode_labelindex_arrays(data):
+    """
+    Parse a serialized LabelIndex (e.g. as returned by ``fetch_labelindex(..., format='raw')``)
+    directly into columnar arrays, without constructing the protobuf structure.
+
+    Returns:
+        LabelIndexArrays (a namedtuple) with the following array members:
+
+        - ``block_ids``: The encoded block IDs (uint64), one per block in the index.
+          See ``decode_labelindex_blocks()``.
+        - ``block_offsets``: The start of each block's entries within ``svs`` and ``counts``,
+          plus a final entry for the total length.
+          That is, block ``i`` owns entries ``block_offsets[i]:block_offsets[i+1]``.
+        - ``svs``: The supervoxel ID of each entry (uint64)
+        - ``counts``: The voxel count of each entry (uint32)
+
+        ...along with the scalar fields of the LabelIndex
+        (label, last_mutid, last_mod_time, last_mod_user).
+    """
+    buf = np.frombuffer(data, np.uint8)
+    return _decode_labelindex_arrays(buf, 0, len(buf))
+
+
+def decode_labelindex_bytes(data):
+    """
+    Parse a serialized LabelIndex (e.g. as returned by ``fetch_labelindex(..., format='raw')``)
+    directly into a PandasLabelIndex.  Equivalent to (but much faster than)
+    parsing the protobuf structure and calling ``convert_labelindex_to_pandas()``.
+    """
+    return _arrays_to_pandas_labelindex(decode_labelindex_arrays(data))
+
+
+def decode_labelindices_bytes(data):
+    """
+    Parse a serialized LabelIndices message (e.g. as returned by
+    ``fetch_labelindices(..., format='raw')``) into a list of PandasLabelIndex.
+    """
+    buf = np.frombuffer(data, np.uint8)
+    ranges = _labelindices_ranges(buf)
+    return [_arrays_to_pandas_labelindex(_decode_labelindex_arrays(buf, start, stop))
+            for (start, stop) in ranges]
+
+
+def _decode_labelindex_arrays(buf, start, stop):
+    # The first pass counts the entries; the second pass fills them in.
+    num_blocks, num_entries, *_ = _parse_labelindex(buf, start, stop, np.zeros(0, np.uint64), np.zeros(0, np.int64),
+                                                     np.zeros(0, np.uint64), np.zeros(0, np.uint32), False)
+
+    block_ids = np.empty(num_blocks, np.uint64)
+    block_offsets = np.empty(num_blocks+1, np.int64)
+    svs = np.empty(num_entries, np.uint64)
+    counts = np.empty(num_entries, np.uint32)
+    _nb, _ne, label, last_mutid, time_start, time_stop, user_start, user_stop = \
+        _parse_labelindex(buf, start, stop, block_ids, block_offsets, svs, counts, True)
+
+    last_mod_time = bytes(buf[time_start:time_stop]).decode('utf-8')
+    last_mod_user = bytes(buf[user_start:user_stop]).decode('utf-8')
+    return LabelIndexArrays(block_ids, block_offsets, svs, counts, label, last_mutid, last_mod_time, last_mod_user)
+
+
+def _arrays_to_pandas_labelindex(lia):
+    coords_zyx = decode_labelindex_blocks(lia.block_ids)
+    coords_zyx = np.repeat(coords_zyx, np.diff(lia.block_offsets), axis=0)
+
+    blocks_df = pd.DataFrame( coords_zyx, columns=['z', 'y', 'x'] )
+    blocks_df['sv'] = lia.svs
+    blocks_df['count'] = lia.counts
 
-    block_svs = []
-    block_counts = []
-    block_coords = []
-    
-    # Convert each block's data into arrays
-    for coord_zyx, sv_counts in zip(coords_zyx, labelindex.blocks.values()):
-        svs = np.fromiter(sv_counts.counts.keys(), np.uint64, count=len(sv_counts.counts))
-        counts = np.fromiter(sv_counts.counts.values(), np.uint32, count=len(sv_counts.counts))
-
-        coord_zyx = np.array(coord_zyx, np.int32)
-        coords = np.repeat(coord_zyx[None], len(svs), axis=0)
-        #coords = np.lib.stride_tricks.as_strided(coord_zyx, shape=(len(svs), 3), strides=(0,4))
-        #coords = np.broadcast_to(coord_zyx, (len(svs),3))
-        
-        block_svs.append(svs)
-        block_counts.append(counts)
-        block_coords.append(coords)
-
-    # Concatenate all block data and load into one big DataFrame
-    all_coords = np.concatenate(block_coords)
-    all_svs = np.concatenate(block_svs)
-    all_counts = np.concatenate(block_counts)
-    
-    blocks_df = pd.DataFrame( all_coords, columns=['z', 'y', 'x'] )
-    blocks_df['sv'] = all_svs
-    blocks_df['count'] = all_counts
-    
     return PandasLabelIndex( blocks_df,
-                             labelindex.label,
-                             labelindex.last_mutid,
-                             labelindex.last_mod_time,
-                             labelindex.last_mod_user )
+                             lia.label,
+                             lia.last_mutid,
+                             lia.last_mod_time,
+                             lia.last_mod_user )
+
+
+##
+## Protobuf wire-format parsing, specialized for LabelIndex.
+## See labelops.proto and https://developers.google.com/protocol-buffers/docs/encoding
+##
+
+@jit(nopython=True, nogil=True)
+def _read_varint(buf, pos):
+    result = np.uint64(0)
+    shift = np.uint64(0)
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= np.uint64(b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += np.uint64(7)
+
+
+@jit(nopython=True, nogil=True)
+def _skip_field(buf, pos, wire_type):
+    if wire_type == 0:
+        _, pos = _read_varint(buf, pos)
+    elif wire_type == 1:
+        pos += 8
+    elif wire_type == 2:
+        length, pos = _read_varint(buf, pos)
+        pos += int(length)
+    elif wire_type == 5:
+        pos += 4
+    else:
+        raise RuntimeError("Unsupported protobuf wire type")
+    return pos
+
+
+@jit(nopython=True, nogil=True)
+def _parse_labelindex(buf, start, stop, block_ids, block_offsets, svs, counts, fill):
+    """
+    Parse a LabelIndex message in buf[start:stop].
+    If fill=False, only count the blocks and entries.
+    If fill=True, the given arrays must be large enough to hold the results.
+
+    Returns:
+        (num_blocks, num_entries, label, last_mutid,
+         time_start, time_stop, user_start, user_stop)
+    """
+    num_blocks = 0
+    num_entries = 0
+    label = np.uint64(0)
+    last_mutid = np.uint64(0)
+    time_start = time_stop = user_start = user_stop = 0
+
+    pos = start
+    while pos < stop:
+        tag, pos = _read_varint(buf, pos)
+        field = tag >> np.uint64(3)
+        wire_type = tag & np.uint64(7)
+
+        if field == 1 and wire_type == 2:
+            # blocks: map<uint64, SVCount>
+            length, pos = _read_varint(buf, pos)
+            entry_stop = pos + int(length)
+            block_id = np.uint64(0)
+            if fill:
+                block_offsets[num_blocks] = num_entries
+
+            while pos < entry_stop:
+                tag, pos = _read_varint(buf, pos)
+                entry_field = tag >> np.uint64(3)
+                entry_wire_type = tag & np.uint64(7)
+                if entry_field == 1 and entry_wire_type == 0:
+                    block_id, pos = _read_varint(buf, pos)
+                elif entry_field == 2 and entry_wire_type == 2:
+                    # SVCount: map<uint64, uint32> counts = 1
+                    length, pos = _read_varint(buf, pos)
+                    svcount_stop = pos + int(length)
+                    while pos < svcount_stop:
+                        tag, pos = _read_varint(buf, pos)
+                        if tag != 0x0A: # field 1, wire type 2
+                            pos = _skip_field(buf, pos, tag & np.uint64(7))
+                            continue
+                        length, pos = _read_varint(buf, pos)
+                        count_stop = pos + int(length)
+                        sv = np.uint64(0)
+                        count = np.uint64(0)
+                        while pos < count_stop:
+                            tag, pos = _read_varint(buf, pos)
+                            if tag == 0x08:
+                                sv, pos = _read_varint(buf, pos)
+                            elif tag == 0x10:
+                                count, pos = _read_varint(buf, pos)
+                            else:
+                                pos = _skip_field(buf, pos, tag & np.uint64(7))
+                        if fill:
+                            svs[num_entries] = sv
+                            counts[num_entries] = np.uint32(count)
+                        num_entries += 1
+                else:
+                    pos = _skip_field(buf, pos, entry_wire_type)
+
+            if fill:
+                block_ids[num_blocks] = block_id
+            num_blocks += 1
+
+        elif field == 2 and wire_type == 0:
+            label, pos = _read_varint(buf, pos)
+        elif field == 3 and wire_type == 0:
+            last_mutid, pos = _read_varint(buf, pos)
+        elif field == 4 and wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            time_start = pos
+            time_stop = pos = pos + int(length)
+        elif field == 5 and wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            user_start = pos
+            user_stop = pos = pos + int(length)
+        else:
+            pos = _skip_field(buf, pos, wire_type)
+
+    if fill:
+        block_offsets[num_blocks] = num_entries
+
+    return (num_blocks, num_entries, label, last_mutid,
+            time_start, time_stop, user_start, user_stop)
+
+
+@jit(nopython=True, nogil=True)
+def _labelindices_ranges(buf):
+    """
+    Return the (start, stop) byte range of each
+    LabelIndex within a serialized LabelIndices message.
+    """
+    ranges = []
+    pos = 0
+    while pos < len(buf):
+        tag, pos = _read_varint(buf, pos)
+        if tag == 0x0A: # field 1, wire type 2
+            length, pos = _read_varint(buf, pos)
+            ranges.append((pos, pos + int(length)))
+            pos += int(length)
+        else:
+            pos = _skip_field(buf, pos, tag & np.uint64(7))
+    return ranges
 
 
 def create_labelindex(pandas_labelindex):
@@ -323,25 +524,165 @@ def create_labelindex(pandas_labelindex):
     Returns:
         neuclease.dvid.labelmap.labelops_pb2.LabelIndex
         (a protobuf structure), suitable for ``post_labelindex()``
+
+    Note:
+        If you just intend to post the index to DVID,
+        it's faster to skip the protobuf structure entirely
+        and use ``encode_labelindex_bytes()``.
+    """
+    labelindex = LabelIndex()
+    labelindex.ParseFromString(encode_labelindex_bytes(pandas_labelindex))
+    return labelindex
+
+
+def encode_labelindex_bytes(pandas_labelindex):
+    """
+    Serialize a PandasLabelIndex tuple directly into LabelIndex protobuf
+    wire bytes, without constructing the protobuf structure.
+    The inverse of ``decode_labelindex_bytes()``.
+
+    The ``blocks`` DataFrame need not be sorted, and it is not modified.
+    (As with protobuf maps, if a supervoxel is listed more than once
+    in the same block, the last entry wins.)
+
+    Returns:
+        bytes, suitable for ``post_labelindex()``
     """
     pli = pandas_labelindex
     assert isinstance(pli, PandasLabelIndex)
-    labelindex = LabelIndex()
-    labelindex.label = pli.label
-    labelindex.last_mutid = pli.last_mutid
-    labelindex.last_mod_time = pli.last_mod_time
-    labelindex.last_mod_user = pli.last_mod_user
-    
     assert (pli.blocks.columns == ['z', 'y', 'x', 'sv', 'count']).all()
 
     block_ids = encode_block_coords(pli.blocks[['z', 'y', 'x']].values)
-    pli.blocks['block_id'] = block_ids
-    
-    for block_id, df in pli.blocks.groupby('block_id'):
-        labelindex.blocks[block_id].counts.update( zip(df['sv'].values, df['count'].values) )
-    
-    del pli.blocks['block_id']
-    return labelindex
+    svs = pli.blocks['sv'].values.astype(np.uint64, copy=False)
+    counts = pli.blocks['count'].values.astype(np.uint64, copy=False)
+
+    # Group the entries by block
+    order = np.argsort(block_ids, kind='stable')
+    block_ids = block_ids[order]
+    svs = svs[order]
+    counts = counts[order]
+
+    block_starts = np.flatnonzero(block_ids[1:] != block_ids[:-1]) + 1
+    block_offsets = np.concatenate(([0], block_starts, [len(block_ids)])).astype(np.int64)
+    if len(block_ids) == 0:
+        block_offsets = np.zeros(1, np.int64)
+
+    payload = _encode_labelindex_blocks(block_ids[block_offsets[:-1]], block_offsets, svs, counts).tobytes()
+
+    # Scalar fields (omitted when they have default values, as protobuf does)
+    if pli.label:
+        payload += b'\x10' + _varint_bytes(pli.label)
+    if pli.last_mutid:
+        payload += b'\x18' + _varint_bytes(pli.last_mutid)
+    if pli.last_mod_time:
+        last_mod_time = pli.last_mod_time.encode('utf-8')
+        payload += b'\x22' + _varint_bytes(len(last_mod_time)) + last_mod_time
+    if pli.last_mod_user:
+        last_mod_user = pli.last_mod_user.encode('utf-8')
+        payload += b'\x2A' + _varint_bytes(len(last_mod_user)) + last_mod_user
+    return payload
+
+
+def encode_labelindices_bytes(indices):
+    """
+    Serialize a list of LabelIndex objects, PandasLabelIndex tuples,
+    or pre-serialized LabelIndex bytes (or any mix thereof)
+    into a LabelIndices protobuf message, suitable for ``post_labelindices()``.
+    The PandasLabelIndex tuples are encoded via ``encode_labelindex_bytes()``.
+    """
+    return b''.join(map(_encode_labelindices_item, indices))
+
+
+def _encode_labelindices_item(index):
+    """
+    Encode a single index as an entry in the
+    'indices' field of a LabelIndices message.
+    """
+    if isinstance(index, PandasLabelIndex):
+        index = encode_labelindex_bytes(index)
+    elif isinstance(index, LabelIndex):
+        index = index.SerializeToString()
+    else:
+        assert isinstance(index, bytes), \
+            f"Unhandled input type for posting label indices: {type(index)}"
+    return b'\x0A' + _varint_bytes(len(index)) + index
+
+
+def _varint_bytes(value):
+    value = int(value)
+    assert value >= 0
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+@jit(nopython=True, nogil=True)
+def _varint_size(value):
+    value = np.uint64(value)
+    size = 1
+    while value >= 0x80:
+        value >>= np.uint64(7)
+        size += 1
+    return size
+
+
+@jit(nopython=True, nogil=True)
+def _write_varint(buf, pos, value):
+    value = np.uint64(value)
+    while value >= 0x80:
+        buf[pos] = np.uint8((value & np.uint64(0x7F)) | np.uint64(0x80))
+        value >>= np.uint64(7)
+        pos += 1
+    buf[pos] = np.uint8(value)
+    return pos + 1
+
+
+@jit(nopython=True, nogil=True)
+def _encode_labelindex_blocks(block_ids, block_offsets, svs, counts):
+    """
+    Encode the 'blocks' field of a LabelIndex message (map<uint64, SVCount>),
+    given the (unique) block IDs and the start of each block's entries in svs/counts.
+    The first pass computes the message sizes; the second pass writes the bytes.
+    """
+    num_blocks = len(block_ids)
+    svcount_sizes = np.zeros(num_blocks, np.int64)
+    total_size = 0
+    for i in range(num_blocks):
+        svcount_size = 0
+        for j in range(block_offsets[i], block_offsets[i+1]):
+            count_size = 2 + _varint_size(svs[j]) + _varint_size(counts[j])
+            svcount_size += 1 + _varint_size(count_size) + count_size
+        svcount_sizes[i] = svcount_size
+        block_size = 2 + _varint_size(block_ids[i]) + _varint_size(svcount_size) + svcount_size
+        total_size += 1 + _varint_size(block_size) + block_size
+
+    buf = np.empty(total_size, np.uint8)
+    pos = 0
+    for i in range(num_blocks):
+        svcount_size = svcount_sizes[i]
+        block_size = 2 + _varint_size(block_ids[i]) + _varint_size(svcount_size) + svcount_size
+
+        buf[pos] = 0x0A # LabelIndex.blocks: field 1, wire type 2
+        pos = _write_varint(buf, pos+1, block_size)
+        buf[pos] = 0x08 # key: field 1, wire type 0
+        pos = _write_varint(buf, pos+1, block_ids[i])
+        buf[pos] = 0x12 # value (SVCount): field 2, wire type 2
+        pos = _write_varint(buf, pos+1, svcount_size)
+
+        for j in range(block_offsets[i], block_offsets[i+1]):
+            count_size = 2 + _varint_size(svs[j]) + _varint_size(counts[j])
+            buf[pos] = 0x0A # SVCount.counts: field 1, wire type 2
+            pos = _write_varint(buf, pos+1, count_size)
+            buf[pos] = 0x08 # key: field 1, wire type 0
+            pos = _write_varint(buf, pos+1, svs[j])
+            buf[pos] = 0x10 # value: field 2, wire type 0
+            pos = _write_varint(buf, pos+1, counts[j])
+
+    assert pos == total_size
+    return buf
 
 
 @dvid_api_wrapper
@@ -426,15 +767,13 @@ def _fetch_sizes_via_labelindex(server, uuid, instance, labels, supervoxels=Fals
         sizes.name = 'size'
         return sizes
     else:
-        labelindices = fetch_labelindices(server, uuid, instance, labels, format='protobuf')
+        labelindices = fetch_labelindices(server, uuid, instance, labels, format='pandas')
 
         bodies = []
         sizes = []
-        for index in labelindices.indices:
+        for index in labelindices:
             bodies.append(index.label)
-            block_sums = (sum(block_svs.counts.values()) for block_svs in index.blocks.values())
-            total_sum = sum(block_sums)
-            sizes.append(total_sum)
+            sizes.append(index.blocks['count'].sum())
         
         bodies = np.fromiter(bodies, np.uint64)
         sizes = pd.Series(sizes, index=bodies, dtype=np.uint32, name='size')
@@ -554,13 +893,16 @@ def encode_block_coords(coords):
     Returns:
         1D array, dtype uint64, shape (N,)
     """
-    coords = np.asarray(coords, np.int32, 'C')
+    coords = np.asarray(coords, np.int32).reshape(-1, 3)
     assert (coords % 64 == 0).all(), \
         "Block coordinates are not 64-px aligned!"
 
-    record_dtype = [('z', np.int32), ('y', np.int32), ('x', np.int32)]
-    coord_records = coords.view(record_dtype).reshape(-1)
-    return encode_labelindex_block_ids(coord_records)
+    # Each block coordinate is stored as a signed 21-bit integer.
+    block_coords = ((coords // 64).astype(np.int64) & 0x1F_FFFF).astype(np.uint64)
+    encoded_blocks = block_coords[:, 0] << np.uint64(2*21)
+    encoded_blocks |= block_coords[:, 1] << np.uint64(21)
+    encoded_blocks |= block_coords[:, 2]
+    return encoded_blocks
 
 
 @jit(nopython=True)
@@ -584,22 +926,25 @@ def encode_labelindex_block_id(coord_record):
     into a uint64, in the format DVID expects.
     """
     encoded_block_id = np.uint64(0)
-    encoded_block_id |= np.uint64(coord_record.z // 64) << 42
-    encoded_block_id |= np.uint64(coord_record.y // 64) << 21
-    encoded_block_id |= np.uint64(coord_record.x // 64)
+    encoded_block_id |= np.uint64((coord_record.z // 64) & 0x1F_FFFF) << 42
+    encoded_block_id |= np.uint64((coord_record.y // 64) & 0x1F_FFFF) << 21
+    encoded_block_id |= np.uint64((coord_record.x // 64) & 0x1F_FFFF)
     return encoded_block_id
 
 
-@jit(nopython=True, nogil=True)
 def decode_labelindex_blocks(encoded_blocks):
     """
-    Calls decode_labelindex_block() on a 1-D array of encoded coordinates.
+    Decodes a 1-D array of encoded block coordinates (as stored in a LabelIndex)
+    into an array of VOXEL coordinates, shape (N,3), in ZYX order.
+    Equivalent to calling decode_labelindex_block() on each element, but vectorized.
     """
-    decoded_blocks = np.zeros((len(encoded_blocks), 3), dtype=np.int32)
-    for i in range(len(encoded_blocks)):
-        encoded = encoded_blocks[i]
-        decoded_blocks[i,:] = decode_labelindex_block(encoded)
-    return decoded_blocks
+    encoded_blocks = np.asarray(encoded_blocks, np.uint64)
+    shifts = np.array([2*21, 21, 0], np.uint64)
+    coords = ((encoded_blocks[:, None] >> shifts) & np.uint64(0x1F_FFFF)).astype(np.int32)
+
+    # Sign-extend the 21-bit values
+    coords[coords >= (1 << 20)] -= (1 << 21)
+    return 64*coords
 
 
 @jit(nopython=True, nogil=True)
@@ -4,28 +4,36 @@ import logging
 from io import BytesIO
 from functools import partial, lru_cache, wraps
 from itertools import starmap
-from multiprocessing.pool import ThreadPool
-from collections import defaultdict
 
 import numpy as np
 import pandas as pd
 import networkx as nx
+from numba import jit
 from requests import HTTPError
 
+try:
+    import orjson
+    _have_orjson = True
+except ImportError:
+    import ujson
+    _have_orjson = False
+
 from libdvid import DVIDNodeService, encode_label_block
 from dvidutils import LabelMapper
 from vigra.analysis import labelMultiArrayWithBackground
 
 from ...util import (Timer, round_box, extract_subvol, DEFAULT_TIMESTAMP, tqdm_proxy,
                      ndrange, ndrange_array, box_to_slicing, compute_parallel, boxes_from_grid, box_shape,
-                     overwrite_subvol, iter_batches, extract_labels_from_volume, box_intersection, downsample_mask)
+                     overwrite_subvol, iter_batches, extract_labels_from_volume, box_intersection, downsample_mask,
+                     SparseBlockMask, SparseBlockVolume)
 
 from .. import dvid_api_wrapper, fetch_generic_json, fetch_repo_info
 from ..repo import create_voxel_instance, fetch_repo_dag, resolve_ref, expand_uuid
-from ..kafka import read_kafka_messages, kafka_msgs_to_df
-from ..rle import parse_rle_response, runlength_decode_from_ranges_to_mask
+from ..kafka import read_kafka_messages
+from ..rle import parse_rle_response, runlength_decode_from_ranges_to_mask, parse_rle_stream_to_blocks
 
-from ._split import SplitEvent, fetch_supervoxel_splits_from_kafka
+from ._split import fetch_supervoxel_splits_from_kafka, split_events_to_table
+from ._mutationlog import MutationLog, read_labelmap_mutation_log
 from .labelops_pb2 import MappingOps, MappingOp
 from neuclease.dvid.server import fetch_server_info
 
@@ -718,7 +726,7 @@ fetch_label_for_coordinate = fetch_label
 
 
 @dvid_api_wrapper
-def fetch_labels(server, uuid, instance, coordinates_zyx, scale=0, supervoxels=False, *, session=None):
+def fetch_labels(server, uuid, instance, coordinates_zyx, scale=0, supervoxels=False, *, presort=True, session=None):
     """
     Fetch the labels at a list of coordinates.
 
@@ -743,6 +751,11 @@ def fetch_labels(server, uuid, instance, coordinates_zyx, scale=0, supervoxels=F
             Which scale of the data to read from.
             (Your coordinates must be correspondingly scaled.)
 
+        presort:
+            If True, send the coordinates to DVID in block order,
+            which allows DVID to service the request faster.
+            (The results are returned in the original order regardless.)
+
     Returns:
         ndarray of N labels
 
@@ -763,65 +776,159 @@ def fetch_labels(server, uuid, instance, coordinates_zyx, scale=0, supervoxels=F
     if scale != 0:
         params['scale'] = str(scale)
 
-    coords_xyz = np.array(coordinates_zyx)[:, ::-1].tolist()
-    r = session.get(f'{server}/api/node/{uuid}/{instance}/labels', json=coords_xyz, params=params)
+    order = None
+    if presort:
+        order = block_sorted_order(coordinates_zyx)
+        coordinates_zyx = coordinates_zyx[order]
+
+    payload = encode_coords_json(coordinates_zyx[:, ::-1])
+    r = session.get(f'{server}/api/node/{uuid}/{instance}/labels', data=payload, params=params,
+                    headers={'Content-Type': 'application/json'})
     r.raise_for_status()
 
-    labels = np.array(r.json(), np.uint64)
+    labels = parse_json_uint64_list(r.content)
+    assert len(labels) == len(coordinates_zyx), \
+        f"DVID returned {len(labels)} labels for {len(coordinates_zyx)} coordinates"
+
+    if order is not None:
+        sorted_labels = labels
+        labels = np.empty_like(sorted_labels)
+        labels[order] = sorted_labels
     return labels
 
 
-def fetch_labels_batched(server, uuid, instance, coordinates_zyx, supervoxels=False, scale=0, batch_size=10_000, threads=0, processes=0, presort=True):
+def fetch_labels_batched(server, uuid, instance, coordinates_zyx, supervoxels=False, scale=0, batch_size=10_000, threads=0, processes=0, presort=True,
+                         *, engine='labels', block_cache=None):
     """
     Like fetch_labels, but fetches in batches, optionally multithreaded or multiprocessed.
 
+    If presort=True, the coordinates are sorted by block index before they are
+    divided into batches, so DVID can service each batch with fewer block reads.
+    (The results are returned in the original order regardless.)
+
+    If engine='blocks', fetch the blocks that contain the points instead,
+    and sample the labels on the client via ``fetch_labels_via_blocks()``,
+    optionally using the given ``LabelBlockCache``.
+    That's faster when there are many points per block.
+
     See also: ``fetch_label()``, ``fectch_labels()``
     """
     assert not threads or not processes, "Choose either threads or processes (not both)"
-    coordinates_zyx = np.asarray(coordinates_zyx)
-    coords_df = pd.DataFrame(coordinates_zyx, columns=['z', 'y', 'x'], dtype=np.int32)
-    coords_df['label'] = np.uint64(0)
+    assert engine in ('labels', 'blocks')
+    coordinates_zyx = np.asarray(coordinates_zyx, np.int32)
+    assert coordinates_zyx.ndim == 2 and coordinates_zyx.shape[1] == 3
+
+    if engine == 'blocks':
+        from . import fetch_labels_via_blocks # late import to avoid recursive import
+        assert not processes, "The 'blocks' engine supports threads, not processes."
+        return fetch_labels_via_blocks(server, uuid, instance, coordinates_zyx, scale, supervoxels,
+                                       cache=block_cache, threads=threads)
 
     if presort:
-        with Timer(f"Pre-sorting {len(coords_df)} coordinates by block index", logger):
-            # Sort coordinates by their block index,
-            # so DVID will be able to service the requests faster.
-            coords_df['bz'] = coords_df['z'] // 64
-            coords_df['by'] = coords_df['y'] // 64
-            coords_df['bx'] = coords_df['x'] // 64
-            coords_df.sort_values(['bz', 'by', 'bx'], inplace=True)
-            del coords_df['bz']
-            del coords_df['by']
-            del coords_df['bx']
+        with Timer(f"Pre-sorting {len(coordinates_zyx)} coordinates by block index", logger):
+            order = block_sorted_order(coordinates_zyx)
+    else:
+        order = np.arange(len(coordinates_zyx))
 
-    fetch_batch = partial(_fetch_labels_batch, server, uuid, instance, scale, supervoxels)
+    batches = []
+    for batch_start in range(0, len(coordinates_zyx), batch_size):
+        batch_order = order[batch_start:batch_start+batch_size]
+        batches.append((batch_order, coordinates_zyx[batch_order]))
 
-    batch_dfs = []
-    for batch_start in range(0, len(coords_df), batch_size):
-        batch_stop = min(batch_start+batch_size, len(coords_df))
-        batch_df = coords_df.iloc[batch_start:batch_stop].copy()
-        batch_dfs.append(batch_df)
+    fetch_batch = partial(_fetch_labels_batch, server, uuid, instance, scale, supervoxels)
 
     with Timer("Fetching labels from DVID", logger):
-        batch_starts = list(range(0, len(coords_df), batch_size))
         if threads <= 1 and processes <= 1:
-            batch_result_dfs = map(fetch_batch, batch_dfs)
-            batch_result_dfs = tqdm_proxy(batch_result_dfs, total=len(batch_starts), leave=False, logger=logger)
-            batch_result_dfs = list(batch_result_dfs)
+            batch_results = starmap(fetch_batch, batches)
+            batch_results = tqdm_proxy(batch_results, total=len(batches), leave=False, logger=logger)
+            batch_results = list(batch_results)
         else:
-            batch_result_dfs = compute_parallel(fetch_batch, batch_dfs, 1, threads, processes, ordered=False, leave_progress=False)
+            batch_results = compute_parallel(fetch_batch, batches, 1, threads, processes, ordered=False, leave_progress=False, starmap=True)
 
-    return pd.concat(batch_result_dfs).sort_index()['label'].values
+    labels = np.zeros(len(coordinates_zyx), np.uint64)
+    for batch_order, batch_labels in batch_results:
+        labels[batch_order] = batch_labels
+    return labels
 
 
-def _fetch_labels_batch(server, uuid, instance, scale, supervoxels, batch_df):
+def _fetch_labels_batch(server, uuid, instance, scale, supervoxels, batch_order, batch_coords):
     """
     Helper for fetch_labels_batched(), defined at top-level so it can be pickled.
     """
-    batch_coords = batch_df[['z', 'y', 'x']].values
     # don't pass session: We want a unique session per thread
-    batch_df.loc[:, 'label'] = fetch_labels(server, uuid, instance, batch_coords, scale, supervoxels)
-    return batch_df
+    # The batch is already sorted by block, so no need to presort again.
+    batch_labels = fetch_labels(server, uuid, instance, batch_coords, scale, supervoxels, presort=False)
+    return batch_order, batch_labels
+
+
+def block_sorted_order(coordinates_zyx, block_width=64):
+    """
+    Return the permutation that sorts the given coordinates by block,
+    i.e. by (bz, by, bx), where each block coordinate is ``coord // block_width``.
+    Within each block, the points retain their original relative order.
+
+    Labels can be fetched faster when the points
+    from each block are requested together.
+    """
+    coordinates_zyx = np.asarray(coordinates_zyx)
+    assert coordinates_zyx.ndim == 2 and coordinates_zyx.shape[1] == 3
+
+    # Pack the block coordinates into a single sort key (21 bits per axis).
+    # The offset makes negative coordinates sort before positive ones.
+    block_coords = coordinates_zyx.astype(np.int64) // block_width + (1 << 20)
+    block_coords = (block_coords & 0x1F_FFFF).astype(np.uint64)
+    keys = block_coords[:, 0] << np.uint64(42)
+    keys |= block_coords[:, 1] << np.uint64(21)
+    keys |= block_coords[:, 2]
+    return np.argsort(keys, kind='stable')
+
+
+def encode_coords_json(coords):
+    """
+    Encode an integer array of shape (N,3) as a JSON list of lists,
+    e.g. ``b'[[1,2,3],[4,5,6]]'``.
+    Uses orjson (which encodes numpy arrays natively) if it's available.
+    """
+    coords = np.ascontiguousarray(coords, np.int32)
+    if _have_orjson:
+        return orjson.dumps(coords, option=orjson.OPT_SERIALIZE_NUMPY)
+    return ujson.dumps(coords.tolist()).encode('utf-8')
+
+
+def parse_json_uint64_list(data):
+    """
+    Parse a JSON list of non-negative integers (e.g. ``b'[1,2,3]'``)
+    directly into a uint64 array, without creating Python int objects.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    buf = np.frombuffer(data, np.uint8)
+    values = np.empty(len(buf) // 2 + 1, np.uint64)
+    count = _parse_json_uint64_list(buf, values)
+    return values[:count].copy()
+
+
+@jit(nopython=True, nogil=True)
+def _parse_json_uint64_list(buf, values):
+    count = 0
+    in_number = False
+    value = np.uint64(0)
+    for c in buf:
+        if 48 <= c <= 57: # '0'-'9'
+            value = value * np.uint64(10) + np.uint64(c - 48)
+            in_number = True
+        elif c in (44, 93, 32, 9, 10, 13, 91): # ',' ']' ' ' '\t' '\n' '\r' '['
+            if in_number:
+                values[count] = value
+                count += 1
+                value = np.uint64(0)
+                in_number = False
+        else:
+            raise RuntimeError("Unexpected character in JSON list of integers")
+    if in_number:
+        values[count] = value
+        count += 1
+    return count
 
 
 @dvid_api_wrapper
@@ -893,18 +1000,65 @@ split_supervoxel = post_split_supervoxel
 
 
 @dvid_api_wrapper
-def fetch_mapping(server, uuid, instance, supervoxel_ids, *, session=None, as_series=False):
+def fetch_mapping(server, uuid, instance, supervoxel_ids, *, session=None, as_series=False,
+                  batch_size=100_000, threads=0, cache=None):
     """
     For each of the given supervoxels, ask DVID what body they belong to.
     If the supervoxel no longer exists, it will map to label 0.
 
+    Duplicate supervoxel IDs are only requested once, and large lists of
+    supervoxels are requested in batches (optionally in parallel).
+
+    Args:
+        supervoxel_ids:
+            The supervoxels to map.
+
+        batch_size:
+            How many (unique) supervoxels to send to DVID in each request.
+
+        threads:
+            If non-zero, send the batches to DVID in parallel using this many threads.
+
+        cache:
+            Optional local sv-to-body mapping to consult before asking DVID,
+            given as a pd.Series (indexed by sv) or an array of (sv, body) rows,
+            e.g. the result of ``fetch_complete_mappings()`` or ``fetch_mappings()``,
+            or the mapping of an in-process ``LabelmapMergeGraph``.
+            Supervoxels which aren't listed in the cache are fetched from DVID.
+            It's up to the caller to make sure the cache isn't out-of-date.
+            (For repeated calls, pass a pd.Series, whose index lookup table is only built once.)
+
     Returns:
         If as_series=True, return pd.Series, with index named 'sv' and values named 'body'.
         Otherwise, return the bodies as an array, in the same order in which the supervoxels were given.
     """
-    supervoxel_ids = list(map(int, supervoxel_ids))
-    body_ids = fetch_generic_json(f'{server}/api/node/{uuid}/{instance}/mapping', json=supervoxel_ids, session=session)
-    mapping = pd.Series(body_ids, index=np.asarray(supervoxel_ids, np.uint64), dtype=np.uint64, name='body')
+    supervoxel_ids = np.asarray(supervoxel_ids, np.uint64).reshape(-1)
+    codes, unique_svs = pd.factorize(supervoxel_ids)
+    unique_svs = np.asarray(unique_svs, np.uint64)
+    unique_bodies = np.zeros(len(unique_svs), np.uint64)
+
+    missing = np.ones(len(unique_svs), bool)
+    if cache is not None and len(unique_svs) > 0:
+        if not isinstance(cache, pd.Series):
+            cache = np.asarray(cache)
+            cache = pd.Series(cache[:, 1], index=cache[:, 0])
+        positions = cache.index.get_indexer(unique_svs)
+        missing = (positions == -1)
+        unique_bodies[~missing] = cache.values[positions[~missing]]
+
+    missing_svs = unique_svs[missing]
+    if len(missing_svs) > 0:
+        batches = [missing_svs[i:i+batch_size] for i in range(0, len(missing_svs), batch_size)]
+        if threads and len(batches) > 1:
+            # Don't pass session: We want a unique session per thread
+            fn = partial(_fetch_mapping_batch, server, uuid, instance)
+            batch_bodies = compute_parallel(fn, batches, threads=threads, ordered=True, show_progress=False)
+        else:
+            fn = partial(_fetch_mapping_batch, server, uuid, instance, session=session)
+            batch_bodies = [*map(fn, batches)]
+        unique_bodies[missing] = np.concatenate(batch_bodies)
+
+    mapping = pd.Series(unique_bodies[codes], index=supervoxel_ids, dtype=np.uint64, name='body')
     mapping.index.name = 'sv'
 
     if as_series:
@@ -913,8 +1067,16 @@ def fetch_mapping(server, uuid, instance, supervoxel_ids, *, session=None, as_se
         return mapping.values
 
 
+def _fetch_mapping_batch(server, uuid, instance, supervoxel_ids, *, session=None):
+    """
+    Helper for fetch_mapping(), defined at top-level so it can be pickled.
+    """
+    body_ids = fetch_generic_json(f'{server}/api/node/{uuid}/{instance}/mapping', json=supervoxel_ids.tolist(), session=session)
+    return np.asarray(body_ids, np.uint64)
+
+
 @dvid_api_wrapper
-def fetch_mappings(server, uuid, instance, as_array=False, *, format=None, session=None): # @ReservedAssignment
+def fetch_mappings(server, uuid, instance, as_array=False, *, format=None, cache_dir=None, session=None): # @ReservedAssignment
     """
     Fetch the complete sv-to-label in-memory mapping table
     from DVID and return it as a numpy array or a pandas Series (indexed by sv).
@@ -938,9 +1100,22 @@ def fetch_mappings(server, uuid, instance, as_array=False, *, format=None, sessi
             and 'binary' is used if possible.  (The 'binary' format saves some time,
             since there is no need to parse CSV.)
 
+        cache_dir:
+            If provided, use a local on-disk cache of the mapping,
+            which is downloaded once and then updated incrementally using the
+            mutation log.  See ``fetch_cached_mappings()``.
+            (In that case, the array is returned as a read-only np.memmap.)
+
     Returns:
         pd.Series(index=sv, data=body), unless as_array is True
     """
+    if cache_dir is not None:
+        from . import fetch_cached_mappings # late import to avoid recursive import
+        a = fetch_cached_mappings(server, uuid, instance, cache_dir, session=session)
+        if as_array:
+            return a
+        return pd.Series(a[:, 1], index=pd.Index(a[:, 0], name='sv'), name='body')
+
     if format is None:
         # The first DVID version to support the 'binary' format is v0.8.24-15-g40b8b77
         dvid_version = fetch_server_info(server)["DVID Version"]
@@ -957,10 +1132,7 @@ def fetch_mappings(server, uuid, instance, as_array=False, *, format=None, sessi
         # This takes ~30 seconds so it's nice to log it.
         uri = f"{server}/api/node/{uuid}/{instance}/mappings?format=binary"
         with Timer(f"Fetching {uri}", logger):
-            r = session.get(uri)
-            r.raise_for_status()
-
-        a = np.frombuffer(r.content, np.uint64).reshape(-1,2)
+            a = _stream_binary_mappings(uri, session)
         if as_array:
             return a
 
@@ -985,8 +1157,31 @@ def fetch_mappings(server, uuid, instance, as_array=False, *, format=None, sessi
     return df['body']
 
 
+def _stream_binary_mappings(uri, session):
+    """
+    Stream the binary /mappings response directly into a (writeable) array,
+    rather than holding the entire response in memory and then copying it.
+    """
+    with session.get(uri, stream=True) as r:
+        r.raise_for_status()
+
+        # If the response is compressed (e.g. gzip), Content-Length is the size
+        # of the encoded body, not the decoded bytes we get from iter_content().
+        encoding = r.headers.get('Content-Encoding', 'identity')
+        if 'Content-Length' not in r.headers or encoding.lower() != 'identity':
+            return np.frombuffer(r.content, np.uint64).reshape(-1,2).copy()
+
+        buf = np.empty(int(r.headers['Content-Length']), np.uint8)
+        pos = 0
+        for chunk in r.iter_content(2**24):
+            buf[pos:pos+len(chunk)] = np.frombuffer(chunk, np.uint8)
+            pos += len(chunk)
+        assert pos == len(buf), "Mapping response was truncated"
+    return buf.view(np.uint64).reshape(-1,2)
+
+
 @dvid_api_wrapper
-def fetch_complete_mappings(server, uuid, instance, include_retired=True, kafka_msgs=None, sort=None, *, session=None):
+def fetch_complete_mappings(server, uuid, instance, include_retired=True, kafka_msgs=None, sort=None, *, chunk_size=None, cache_dir=None, session=None):
     """
     Fetch the complete mapping from DVID for all agglomerated bodies,
     including 'identity' mappings (for agglomerated bodies only)
@@ -1017,101 +1212,311 @@ def fetch_complete_mappings(server, uuid, instance, include_retired=True, kafka_
         kafka_msgs:
             Optionally provide the complete labelmap kafka log if you've got it,
             in which case this function doesn't need to re-fetch it.
+            (Either a list of JSON messages or a ``MutationLog``.)
 
         sort:
             Optional.
             If 'sv', sort by supervoxel column.
             If 'body', sort by body. Otherwise, don't sort.
 
+        chunk_size:
+            If provided, don't construct the complete mapping all at once.
+            Instead, return an iterator of pd.Series chunks (each with at most
+            chunk_size rows, in supervoxel order), so that only the base mapping
+            and one chunk of the result need to be held in RAM at a time.
+            Not compatible with sort='body'.
+
+        cache_dir:
+            If provided, obtain the base mapping from a local on-disk cache,
+            which is updated incrementally using the mutation log.
+            See ``fetch_cached_mappings()``.
+            The kafka log (if it must be read) is also cached in this directory,
+            so only new kafka messages are read.  See ``read_labelmap_mutation_log()``.
+
     Returns:
-        pd.Series(index=sv, data=body)
+        pd.Series(index=sv, data=body),
+        or an iterator of such Series if chunk_size was given.
     """
     assert sort in (None, 'sv', 'body')
+    assert chunk_size is None or sort != 'body', \
+        "Can't sort by body when returning the mapping in chunks."
 
     # Read complete kafka log; we need both split and cleave info
     if kafka_msgs is None:
         try:
-            kafka_msgs = read_kafka_messages(server, uuid, instance)
+            kafka_msgs = read_labelmap_mutation_log(server, uuid, instance, keep_msgs=False, cache_dir=cache_dir, session=session)
         except Exception:
-            kafka_msgs = fetch_mutations(server, uuid, instance, dag_filter='leaf-and-parents', format='json')
-    split_events = fetch_supervoxel_splits_from_kafka(server, uuid, instance, kafka_msgs=kafka_msgs, session=session)
-    split_tables = list(map(lambda t: np.asarray([row[:-1] for row in t], np.uint64), split_events.values()))
-    if split_tables:
-        split_table = np.concatenate(split_tables)
-        retired_svs = split_table[:, SplitEvent._fields.index('old')] #@UndefinedVariable
-        retired_svs = set(retired_svs)
+            kafka_msgs = fetch_mutations(server, uuid, instance, dag_filter='leaf-and-parents', format='mutation-log')
+    if isinstance(kafka_msgs, MutationLog):
+        split_table = split_events_to_table(kafka_msgs)
     else:
-        retired_svs = set()
-
-    def extract_cleave_fragments():
-        for msg in kafka_msgs:
-            if msg["Action"] == "cleave":
-                yield msg["CleavedLabel"]
+        split_events = fetch_supervoxel_splits_from_kafka(server, uuid, instance, kafka_msgs=kafka_msgs, session=session)
+        split_table = split_events_to_table(split_events)
+    retired_svs = split_table['old']
 
     # Cleave fragment IDs (i.e. bodies that were created via a cleave)
     # should not be included in the set of 'identity' rows.
     # (These IDs are guaranteed to be disjoint from supervoxel IDs.)
-    cleave_fragments = set(extract_cleave_fragments())
+    if isinstance(kafka_msgs, MutationLog):
+        cleave_fragments = kafka_msgs.new_body[kafka_msgs.action_mask('cleave')]
+    else:
+        cleave_fragments = [msg["CleavedLabel"] for msg in kafka_msgs if msg["Action"] == "cleave"]
+    cleave_fragments = np.array(cleave_fragments, np.uint64)
 
     # Fetch base mapping
-    base_mapping = fetch_mappings(server, uuid, instance, as_array=True, session=session)
-    base_svs = base_mapping[:,0]
-    base_bodies = base_mapping[:,1]
+    if cache_dir is None:
+        base_mapping = fetch_mappings(server, uuid, instance, as_array=True, session=session)
+    else:
+        from . import fetch_cached_mappings # late import to avoid recursive import
+        base_mapping = fetch_cached_mappings(server, uuid, instance, cache_dir, kafka_msgs=kafka_msgs, session=session)
 
-    # Augment with identity rows, which aren't included in the base.
-    with Timer(f"Constructing missing identity-mappings", logger):
-        missing_idents = set(base_bodies) - set(base_svs) - retired_svs - cleave_fragments
-        missing_idents = np.fromiter(missing_idents, np.uint64)
-        missing_idents_mapping = np.array((missing_idents, missing_idents)).transpose()
+    if chunk_size is not None:
+        return iter_complete_mapping_chunks(base_mapping, retired_svs, cleave_fragments, include_retired, chunk_size)
+    return complete_mapping_from_arrays(base_mapping, retired_svs, cleave_fragments, include_retired, sort)
 
-    parts = [base_mapping, missing_idents_mapping]
 
-    # Optionally include 'retired' supervoxels -- mapped to 0
-    if include_retired:
-        retired_svs_array = np.fromiter(retired_svs, np.uint64)
-        retired_mapping = np.zeros((len(retired_svs_array), 2), np.uint64)
-        retired_mapping[:, 0] = retired_svs_array
-        parts.append(retired_mapping)
+def complete_mapping_from_arrays(base_mapping, retired_svs, cleave_fragments, include_retired=True, sort=None):
+    """
+    Construct the complete mapping (as returned by ``fetch_complete_mappings()``)
+    from DVID's base mapping and the supervoxels/bodies listed in the mutation log.
 
-    # Combine into a single table
-    full_mapping = np.concatenate(parts)
-    full_mapping = np.asarray(full_mapping, order='C')
+    The result is assembled from sorted numpy arrays (no Python sets),
+    and aside from the result itself (and an int64 index for sorting the
+    base mapping, if it isn't sorted already), the temporary storage required
+    is proportional to the number of bodies and retired supervoxels,
+    not the number of rows in the mapping.
 
-    # Drop duplicates that may have been introduced via retired svs
-    # (if DVID didn't filter them out)
-    dupes = pd.Series(full_mapping[:,0]).duplicated(keep='last')
-    full_mapping = full_mapping[(~dupes).values]
+    Args:
+        base_mapping:
+            uint64 array (N,2) of sv, body, as returned by ``fetch_mappings(..., as_array=True)``.
+            Note: If this array is writeable, it will be sorted in-place.
+            If a supervoxel is listed more than once, its last row is used.
 
-    # View as 1D buffer of structured dtype to sort in-place.
-    # (Sorted index is more efficient with speed and RAM in pandas)
-    mapping_view = memoryview(full_mapping.reshape(-1))
-    np.frombuffer(mapping_view, dtype=[('sv', np.uint64), ('body', np.uint64)]).sort()
+        retired_svs:
+            Supervoxel IDs that no longer exist due to splits.
 
-    # Construct pd.Series for fast querying
-    s = pd.Series(index=full_mapping[:,0], data=full_mapping[:,1])
+        cleave_fragments:
+            Body IDs that were created via cleaves (excluded from identity rows).
 
-    if not include_retired:
-        # Drop all rows with retired supervoxels, including:
-        # identities we may have added that are now retired
-        # any retired SVs erroneously included by DVID itself in the fetched mapping
-        s.drop(retired_svs, inplace=True, errors='ignore')
+        include_retired:
+            If True, include rows for the retired supervoxels, which all map to 0.
 
-    # Reload index to ensure most RAM-efficient implementation.
-    # (This seems to make a big difference in RAM usage!)
-    s.index = s.index.values
+        sort:
+            Optional. If 'body', sort the result by body.
+            Otherwise, the result is sorted by sv.
 
-    s.index.name = 'sv'
-    s.name = 'body'
+    Returns:
+        pd.Series(index=sv, data=body)
+    """
+    assert sort in (None, 'sv', 'body')
+    chunks = iter_complete_mapping_chunks(base_mapping, retired_svs, cleave_fragments, include_retired, chunk_size=None)
+    s = next(chunks)
 
-    if sort == 'sv':
-        s.sort_index(inplace=True)
-    elif sort == 'body':
+    if sort == 'body':
         s.sort_values(inplace=True)
+    return s
 
-    assert s.index.dtype == np.uint64
-    assert s.dtype == np.uint64
 
-    return s
+def iter_complete_mapping_chunks(base_mapping, retired_svs, cleave_fragments, include_retired=True, chunk_size=10_000_000):
+    """
+    Like ``complete_mapping_from_arrays()``, but yields the complete mapping
+    in chunks of at most ``chunk_size`` rows (in supervoxel order),
+    so the complete result need not be held in RAM all at once.
+    If chunk_size is None, the whole mapping is yielded as a single chunk.
+
+    Yields:
+        pd.Series(index=sv, data=body)
+    """
+    base_mapping = np.asarray(base_mapping)
+    assert base_mapping.dtype == np.uint64
+    assert base_mapping.ndim == 2 and base_mapping.shape[1] == 2
+    if not base_mapping.flags.writeable or not base_mapping.flags.c_contiguous:
+        base_mapping = np.array(base_mapping, order='C')
+
+    with Timer(f"Sorting {len(base_mapping)} base mapping rows", logger):
+        _sort_rows_inplace(base_mapping)
+
+    base_svs = base_mapping[:, 0]
+    retired_svs = np.unique(np.asarray(retired_svs, np.uint64))
+    cleave_fragments = np.asarray(cleave_fragments, np.uint64)
+
+    # Augment with identity rows, which aren't included in the base.
+    with Timer("Constructing missing identity-mappings", logger):
+        missing_idents = _unique_in_chunks(base_mapping[:, 1])
+        missing_idents = np.setdiff1d(missing_idents, retired_svs, assume_unique=True)
+        missing_idents = np.setdiff1d(missing_idents, cleave_fragments)
+        missing_idents = missing_idents[~_sorted_contains(base_svs, missing_idents)]
+
+    # Retired supervoxels that DVID included in the base mapping
+    # are mapped to 0 (or dropped, if include_retired=False).
+    retired_in_base = _sorted_contains(base_svs, retired_svs)
+
+    extra_svs = missing_idents
+    extra_bodies = missing_idents
+    if include_retired:
+        new_retired = retired_svs[~retired_in_base]
+        extra_svs = np.concatenate((missing_idents, new_retired))
+        extra_bodies = np.concatenate((missing_idents, np.zeros(len(new_retired), np.uint64)))
+        order = np.argsort(extra_svs, kind='stable')
+        extra_svs = extra_svs[order]
+        extra_bodies = extra_bodies[order]
+
+    # Duplicate supervoxels are dropped (the last row for each sv is kept).
+    num_rows = len(base_mapping) - _count_sorted_duplicates(base_svs) + len(extra_svs)
+    if not include_retired:
+        num_rows -= retired_in_base.sum()
+
+    if chunk_size is None:
+        chunk_size = max(num_rows, 1)
+
+    # Merge position in (base_mapping, extra_svs, retired_svs)
+    positions = np.zeros(3, np.int64)
+    for chunk_start in range(0, max(num_rows, 1), chunk_size):
+        chunk_rows = min(chunk_size, num_rows - chunk_start)
+        svs = np.empty(chunk_rows, np.uint64)
+        bodies = np.empty(chunk_rows, np.uint64)
+        count = _merge_complete_mapping(base_mapping, extra_svs, extra_bodies, retired_svs,
+                                        not include_retired, positions, svs, bodies)
+        assert count == chunk_rows
+
+        s = pd.Series(bodies, index=pd.Index(svs, name='sv', copy=False), name='body', copy=False)
+        assert s.index.dtype == np.uint64
+        assert s.dtype == np.uint64
+        yield s
+
+
+def _unique_in_chunks(values, chunk_size=10_000_000):
+    """
+    Sorted unique values of a (possibly strided) array,
+    without copying the whole array at once.
+    """
+    uniques = [pd.unique(values[start:start+chunk_size]) for start in range(0, len(values), chunk_size)]
+    return np.unique(np.concatenate([np.zeros(0, values.dtype), *uniques]))
+
+
+@jit(nopython=True, nogil=True)
+def _sorted_contains(sorted_values, values):
+    """
+    For each item in values, determine whether or not it is present in sorted_values.
+    Like ``np.isin()``, but sorted_values may be a strided view, and it is not copied.
+    """
+    result = np.zeros(len(values), np.bool_)
+    n = len(sorted_values)
+    for k in range(len(values)):
+        v = values[k]
+        lo = 0
+        hi = n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if sorted_values[mid] < v:
+                lo = mid + 1
+            else:
+                hi = mid
+        result[k] = (lo < n and sorted_values[lo] == v)
+    return result
+
+
+@jit(nopython=True, nogil=True)
+def _count_sorted_duplicates(sorted_values):
+    count = 0
+    for i in range(1, len(sorted_values)):
+        if sorted_values[i] == sorted_values[i-1]:
+            count += 1
+    return count
+
+
+@jit(nopython=True, nogil=True)
+def _merge_complete_mapping(base_mapping, extra_svs, extra_bodies, retired_svs, drop_retired, positions, out_svs, out_bodies):
+    """
+    Helper for iter_complete_mapping_chunks().
+    Merge the sorted base mapping with the sorted extra rows, into out_svs/out_bodies,
+    starting from (and then updating) the given positions, until the output is full.
+
+    Returns the number of rows written.
+    """
+    num_base = len(base_mapping)
+    num_extra = len(extra_svs)
+    num_retired = len(retired_svs)
+    i = positions[0]
+    j = positions[1]
+    r = positions[2]
+
+    count = 0
+    while count < len(out_svs) and (i < num_base or j < num_extra):
+        if i < num_base and (j >= num_extra or base_mapping[i, 0] < extra_svs[j]):
+            sv = base_mapping[i, 0]
+            body = base_mapping[i, 1]
+            i += 1
+            if i < num_base and base_mapping[i, 0] == sv:
+                # Duplicate sv: keep only the last row.
+                continue
+
+            while r < num_retired and retired_svs[r] < sv:
+                r += 1
+            if r < num_retired and retired_svs[r] == sv:
+                if drop_retired:
+                    continue
+                body = np.uint64(0)
+        else:
+            sv = extra_svs[j]
+            body = extra_bodies[j]
+            j += 1
+
+        out_svs[count] = sv
+        out_bodies[count] = body
+        count += 1
+
+    positions[0] = i
+    positions[1] = j
+    positions[2] = r
+    return count
+
+
+def _sort_rows_inplace(a):
+    """
+    Sort the rows of a 2D array in-place, by the first column.
+    The sort is stable, so rows with equal keys retain their original
+    relative order (e.g. the last row for a duplicated sv remains last).
+    Unlike a[np.argsort(a[:, 0])], this requires no complete copy of the
+    array; only the index array (one int64 per row) is allocated.
+    """
+    if _is_sorted(a[:, 0]):
+        return
+    order = np.argsort(a[:, 0], kind='stable')
+    _permute_rows_inplace(a, order)
+
+
+@jit(nopython=True, nogil=True)
+def _is_sorted(values):
+    for i in range(1, len(values)):
+        if values[i] < values[i-1]:
+            return False
+    return True
+
+
+@jit(nopython=True, nogil=True)
+def _permute_rows_inplace(a, order):
+    """
+    Equivalent to a[:] = a[order], but without a temporary copy of a.
+    Each permutation cycle is followed in turn.
+    Overwrites order (visited entries are marked with -1).
+    """
+    for start in range(len(order)):
+        if order[start] < 0:
+            continue
+        t0 = a[start, 0]
+        t1 = a[start, 1]
+        i = start
+        while True:
+            src = order[i]
+            order[i] = -1
+            if src == start:
+                a[i, 0] = t0
+                a[i, 1] = t1
+                break
+            a[i, 0] = a[src, 0]
+            a[i, 1] = a[src, 1]
+            i = src
 
 
 @dvid_api_wrapper
@@ -1262,6 +1667,9 @@ def _fetch_sparsevol_coarse_impl(server, uuid, instance, label_id, supervoxels=F
 
         cache:
             If True, the results will be stored in a ``lru_cache``.
+            Alternatively, pass a ``SparsevolCoarseCache`` to use a persistent
+            on-disk cache, which is shared between processes and is
+            invalidated when the body is modified.
 
     Returns:
 
@@ -1329,6 +1737,10 @@ def fetch_sparsevol_coarse(*args, mask_box=None, cache=False, **kwargs):
     if not cache:
         return _fetch_sparsevol_coarse_impl(*args, mask_box=mask_box, **kwargs)
 
+    from ._sparsevolcache import SparsevolCoarseCache # late import to avoid recursive import
+    if isinstance(cache, SparsevolCoarseCache):
+        return cache.fetch(*args, mask_box=mask_box, **kwargs)
+
     # Convert to mask_box to tuple so it can be hashed for the cache
     if mask_box is not None:
         ((z0, y0, x0), (z1, y1, x1)) = mask_box
@@ -1339,26 +1751,19 @@ def fetch_sparsevol_coarse(*args, mask_box=None, cache=False, **kwargs):
 
 def fetch_sparsevol_coarse_threaded(server, uuid, instance, labels, supervoxels=False, num_threads=2):
     """
-    Call fetch_sparsevol_coarse() for a list of labels using a ThreadPool.
+    Call fetch_sparsevol_coarse() for a list of labels using several threads.
+
+    See also: ``iter_sparsevols()``, which doesn't require
+    all of the results to be held in RAM at once.
 
     Returns:
         dict of { label: coords }
         If any of the sparsevols can't be found due to error 404,
         'coords' for that label will be None.
     """
-    def fetch_coords(label_id):
-        try:
-            coords = fetch_sparsevol_coarse(server, uuid, instance, label_id, supervoxels)
-            return (label_id, coords)
-        except HTTPError as ex:
-            if (ex.response is not None and ex.response.status_code == 404):
-                return (label_id, None)
-            raise
-
-    with ThreadPool(num_threads) as pool:
-        labels_coords = pool.imap_unordered(fetch_coords, labels)
-        labels_coords = list(tqdm_proxy(labels_coords, total=len(labels)), logger=logger)
-
+    from ._sparsevols import iter_sparsevols # late import to avoid recursive import
+    labels_coords = iter_sparsevols(server, uuid, instance, labels, supervoxels, coarse=True, format='coords', threads=num_threads)
+    labels_coords = tqdm_proxy(labels_coords, total=len(pd.unique(np.asarray(labels, np.uint64))), logger=logger)
     return dict(labels_coords)
 
 
@@ -1392,13 +1797,13 @@ def fetch_sparsevol(server, uuid, instance, label, supervoxels=False, scale=0,
             since the downsampled segmentation is used to construct the sparsevol.
 
         dtype:
-            (Not used when format='mask'.)
+            (Not used when format='mask' or format='blocks'.)
             The dtype of the returned coords/ranges/rles.
             If you know the sparsevol coordinates will not exceed 65535,
             you can set this to np.int16 to save RAM.
 
         format:
-            Either 'rle', 'ranges', 'coords', or 'mask'.
+            Either 'rle', 'ranges', 'coords', 'mask', or 'blocks'.
             See return value details below.
 
         mask_box:
@@ -1447,8 +1852,30 @@ def fetch_sparsevol(server, uuid, instance, label, supervoxels=False, scale=0,
             cropped to the bounding box of the body. The mask's bounding box
             is also returned. (If you passed in a custom ``mask_box``, it
             will be unchanged.)
-    """
-    assert format in ('coords', 'rle', 'ranges', 'mask')
+
+        If format == 'blocks':
+            (sbm, block_masks)
+            Return a SparseBlockMask (with resolution 64) indicating which blocks
+            the body touches, and a dict of ``{corner_zyx: packed_mask}``
+            holding the body's mask within each of those blocks,
+            packed into bits (see ``neuclease.dvid.rle.unpack_block_mask()``).
+            Both are given in scale-N coordinates.
+            The response is decoded as it is streamed from DVID, so neither the
+            voxel coordinates nor a dense mask of the whole body is ever constructed.
+            This is the most RAM-efficient choice for large bodies at scale 0.
+    """
+    assert format in ('coords', 'rle', 'ranges', 'mask', 'blocks')
+
+    if format == 'blocks':
+        supervoxels = str(bool(supervoxels)).lower()
+        url = f'{server}/api/node/{uuid}/{instance}/sparsevol/{label}?supervoxels={supervoxels}&scale={scale}'
+        with session.get(url, stream=True) as r:
+            r.raise_for_status()
+            block_masks = parse_rle_stream_to_blocks(r.iter_content(2**20), 64)
+
+        corners = np.array([*block_masks.keys()], np.int32).reshape(-1, 3)
+        sbm = SparseBlockMask.create_from_lowres_coords(corners // 64, 64)
+        return sbm, block_masks
 
     rles = fetch_sparsevol_rles(server, uuid, instance, label, supervoxels, scale, session=session)
 
@@ -1655,7 +2082,7 @@ fetch_labelarray_voxels = fetch_labelmap_voxels
 
 @dvid_api_wrapper
 def fetch_labelmap_specificblocks(server, uuid, instance, corners_zyx, scale=0, supervoxels=False, format='array',
-                                  *, map_on_client=False, threads=0, session=None):
+                                  *, map_on_client=False, threads=0, mapping_cache=None, session=None):
     """
     Fetch a set of blocks from a labelmap instance.
 
@@ -1681,14 +2108,20 @@ def fetch_labelmap_specificblocks(server, uuid, instance, corners_zyx, scale=0,
 
         format:
             One of the following:
-                ('array', 'lazy-array', 'raw-response', 'blocks', 'lazy-blocks', 'raw-blocks')
+                ('array', 'lazy-array', 'sparse', 'raw-response', 'blocks', 'lazy-blocks', 'raw-blocks')
 
             If 'array', inflate the compressed voxels from DVID into a single combined array, and return it.
             (Omitted or empty blocks will be filled with zeros in the result.)
+            If 'sparse', return a ``SparseBlockVolume``, which stores only the returned blocks
+            (in a single preallocated array), but can produce dense subvolumes on demand.
+            For scattered blocks, this avoids allocating a huge, mostly empty array.
             If 'lazy-array', return a callable proxy that stores the compressed data internally,
             and that will inflate the data into a single combined array when called.
             If 'raw-response', return DVID's raw /blocks response buffer without inflating it.
             If 'blocks', return a dict of {corner: block}
+            Note: The blocks are views into a single shared (N,64,64,64) array,
+            so keeping any one of them alive keeps the whole array alive.
+            Use ``block.copy()`` if you intend to keep only a few of them.
             If 'lazy-blocks': return a callable proxy that stores the compressed data internally,
             and that will inflate the data into a blocks dict when called.
             If 'raw-blocks', return a dict {corner: compressed_block}, in which each compressed
@@ -1716,10 +2149,14 @@ def fetch_labelmap_specificblocks(server, uuid, instance, corners_zyx, scale=0,
             This only has a modest effect on performance (e.g. ~20%), unless using
             map_on_client=True, in which case the improvement is non-trivial (~50%).
 
+        mapping_cache:
+            If map_on_client=True, an optional local sv-to-body mapping to consult
+            before fetching the mapping from DVID.  See ``fetch_mapping()``.
+
     Returns:
         See ``format`` argument.
     """
-    assert format in ('array', 'lazy-array', 'raw-response', 'blocks', 'lazy-blocks', 'raw-blocks', 'callable-blocks')
+    assert format in ('array', 'lazy-array', 'sparse', 'raw-response', 'blocks', 'lazy-blocks', 'raw-blocks', 'callable-blocks')
     corners_zyx = np.asarray(corners_zyx)
     assert corners_zyx.ndim == 2
     assert corners_zyx.shape[1] == 3
@@ -1759,7 +2196,6 @@ def fetch_labelmap_specificblocks(server, uuid, instance, corners_zyx, scale=0,
 
     min_corner = corners_zyx.min(axis=0)
     max_corner = corners_zyx.max(axis=0) + 64
-    full_shape = max_corner - min_corner
 
     blocks = {}
     start = 0
@@ -1774,21 +2210,23 @@ def fetch_labelmap_specificblocks(server, uuid, instance, corners_zyx, scale=0,
         for vol in block_vols:
             svs.append(pd.unique(vol.ravel()))
         svs = pd.unique(np.concatenate(svs))
-        bodies = fetch_mapping(server, uuid, instance, svs)
+        bodies = fetch_mapping(server, uuid, instance, svs, threads=threads, cache=mapping_cache)
         assert svs.dtype == bodies.dtype == np.uint64
         mapper = LabelMapper(svs, bodies)
         for vol in block_vols:
             mapper.apply_inplace(vol)
 
     def inflate_blocks(threads=threads):
+        # Inflate each block directly into its slot of a preallocated block array.
+        block_corners = np.array([*blocks.keys()], np.int64).reshape(-1, 3)
+        block_vols = np.empty((len(blocks), 64, 64, 64), np.uint64)
+        args = [(block_vols, i, corner, buf) for i, (corner, buf) in enumerate(blocks.items())]
         if threads == 0:
-            inflated_blocks = [*starmap(_inflate_block, blocks.items())]
+            [*starmap(_inflate_block_into, args)]
         else:
-            inflated_blocks = compute_parallel(
-                _inflate_block, blocks.items(), starmap=True, threads=threads, show_progress=False)
+            compute_parallel(_inflate_block_into, args, starmap=True, threads=threads, show_progress=False)
 
-        if map_on_client:
-            _corners, block_vols = zip(*inflated_blocks)
+        if map_on_client and len(block_vols) > 0:
             if threads == 0:
                 map_blocks_inplace(block_vols)
             else:
@@ -1796,21 +2234,20 @@ def fetch_labelmap_specificblocks(server, uuid, instance, corners_zyx, scale=0,
                 compute_parallel(map_blocks_inplace, block_batches, ordered=False, threads=threads, show_progress=False)
 
         if format in ('blocks', 'lazy-blocks'):
-            return dict(inflated_blocks)
+            # (Views into block_vols -- see docstring.)
+            return dict(zip(blocks.keys(), block_vols))
+
+        sparse_vol = SparseBlockVolume(block_corners, block_vols, (min_corner, max_corner))
+        if format == 'sparse':
+            return sparse_vol
         elif format in ('array', 'lazy-array'):
-            vol = np.zeros(full_shape, np.uint64)
-            for corner, block in inflated_blocks:
-                z,y,x = corner - min_corner
-                vol[z:z+64, y:y+64, x:x+64] = block
-            return vol
+            return sparse_vol.to_dense()
 
     if format == 'raw-blocks':
         return blocks
     elif format == 'lazy-blocks':
         return inflate_blocks
-    elif format == 'blocks':
-        return inflate_blocks()
-    elif format == 'array':
+    elif format in ('blocks', 'array', 'sparse'):
         return inflate_blocks()
     elif format == 'lazy-array':
         return inflate_blocks
@@ -1822,9 +2259,8 @@ def fetch_labelmap_specificblocks(server, uuid, instance, corners_zyx, scale=0,
         return blocks
 
 
-def _inflate_block(corner, buf):
-    block = DVIDNodeService.inflate_labelarray_blocks3D_from_raw(buf, (64,64,64), corner)
-    return (corner, block)
+def _inflate_block_into(block_vols, i, corner, buf):
+    block_vols[i] = DVIDNodeService.inflate_labelarray_blocks3D_from_raw(buf, (64,64,64), corner)
 
 
 def fetch_labelmap_voxels_chunkwise(server, uuid, instance, box_zyx, scale=0, throttle=False, supervoxels=False,
@@ -1960,6 +2396,7 @@ def fetch_seg_around_point(server, uuid, instance, point_zyx, radius, scale=0, s
             That way, you can call this function repeatedly for different points
             without hitting DVID every time, or parsing the sparsevol-coarse
             response every time.
+            A ``SparsevolCoarseCache`` may also be given, for a persistent cache.
         map_on_client:
             Whether or not to use map_on_client when calling fetch_labelmap_specificblocks().
             See that function for details.
@@ -2688,16 +3125,16 @@ def fetch_mutations(server, uuid, instance, userid=None, *, action_filter=None,
             python function by calling the /mutations endpoint for multiple UUIDs.)
 
         format:
-            How to return the data. Either 'pandas' or 'json'.
+            How to return the data. Either 'pandas', 'json', or 'mutation-log'.
 
     Returns:
-        Either a DataFrame or list of parsed json values, depending
-        on what you passed as 'format'.
+        Either a DataFrame, list of parsed json values, or ``MutationLog``,
+        depending on what you passed as 'format'.
     """
     assert dag_filter in ('leaf-only', 'leaf-and-parents', None)
 
     # json-values is a synonym, for compatibility with read_kafka_messages
-    assert format in ('pandas', 'json', 'json-values')
+    assert format in ('pandas', 'json', 'json-values', 'mutation-log')
 
     uuid = resolve_ref(server, uuid)
 
@@ -2732,6 +3169,8 @@ def fetch_mutations(server, uuid, instance, userid=None, *, action_filter=None,
 
     if format == 'pandas':
         return labelmap_kafka_msgs_to_df(msgs)
+    elif format == 'mutation-log':
+        return MutationLog.from_msgs(msgs)
     else:
         return msgs
 
@@ -2784,7 +3223,8 @@ def labelmap_kafka_msgs_to_df(kafka_msgs, default_timestamp=DEFAULT_TIMESTAMP, d
 
     Args:
         kafka_msgs:
-            A list of JSON messages from the kafka log emitted by a labelmap instance.
+            A list of JSON messages from the kafka log emitted by a labelmap instance,
+            or a ``MutationLog``.
 
         default_timestamp:
             Old versions of DVID did not emit a timestamp with each message.
@@ -2801,68 +3241,25 @@ def labelmap_kafka_msgs_to_df(kafka_msgs, default_timestamp=DEFAULT_TIMESTAMP, d
 
     """
     FINAL_COLUMNS = ['timestamp', 'uuid', 'mutid', 'action', 'target_body', 'target_sv', 'user', 'msg']
-    df = kafka_msgs_to_df(kafka_msgs, drop_duplicates=False, default_timestamp=default_timestamp)
-
-    if len(df) == 0:
-        return pd.DataFrame([], columns=FINAL_COLUMNS)
-
-    # Append action
-    df['action'] = [msg['Action'] for msg in df['msg']]
-    df['user'] = [msg['User'] if 'User' in msg else '' for msg in df['msg']]
-
-    if drop_completes:
-        completes = df['action'].map(lambda s: s.endswith('-complete'))
-        df = df[~completes].copy()
+    if isinstance(kafka_msgs, MutationLog):
+        return kafka_msgs.to_dataframe(default_timestamp, drop_completes)
 
-    if len(df) == 0:
+    if len(kafka_msgs) == 0:
         return pd.DataFrame([], columns=FINAL_COLUMNS)
 
-    mutation_bodies = defaultdict(lambda: 0)
-    mutation_svs = defaultdict(lambda: 0)
+    # Parse JSON if necessary
+    if isinstance(kafka_msgs[0], (str, bytes)):
+        loads = orjson.loads if _have_orjson else ujson.loads
+        kafka_msgs = [*map(loads, kafka_msgs)]
 
-    target_bodies = []
-    target_svs = []
+    # The DataFrame columns are computed from the columnar representation of the log,
+    # but the 'msg' column holds the original message dicts.
+    log = MutationLog.from_msgs(kafka_msgs, keep_msgs=False)
+    df = log.to_dataframe(default_timestamp, drop_completes=False)
+    df['msg'] = kafka_msgs
 
-    # This logic is somewhat more complex than you might think is necessary,
-    # but that's because the kafka logs (sadly) contain duplicate mutation IDs,
-    # i.e. the mutation ID was not unique in our earlier logs.
-    for msg in df['msg'].values:
-        action = msg['Action']
-        try:
-            mutid = msg['MutationID']
-        except KeyError:
-            mutid = 0
-
-        if not action.endswith('complete'):
-            target_body = 0
-            target_sv = 0
-
-            if action == 'cleave':
-                target_body = msg['OrigLabel']
-            elif action in ('merge', 'split'):
-                target_body = msg['Target']
-            elif action == 'split-supervoxel':
-                target_sv = msg['Supervoxel']
-
-            target_bodies.append(target_body)
-            target_svs.append(target_sv)
-
-            mutation_bodies[mutid] = target_body
-            mutation_svs[mutid] = target_sv
-
-        else:
-            # The ...-complete messages contain nothing but the action, uuid, and mutation ID,
-            # but as a convenience we will match them with the target_body or target_sv,
-            # based on the most recent message with a matching mutation ID.
-            target_bodies.append( mutation_bodies[mutid] )
-            target_svs.append( mutation_svs[mutid] )
-
-    df['target_body'] = target_bodies
-    df['target_sv'] = target_svs
-
-    for col in FINAL_COLUMNS:
-        if col not in df:
-            df[col] = np.nan
+    if drop_completes:
+        df = df.loc[~df['action'].str.endswith('complete')]
 
     return df[FINAL_COLUMNS]
 
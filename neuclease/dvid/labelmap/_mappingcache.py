@@ -0,0 +1,260 @@
+"""
+A local, on-disk cache of the raw sv-to-body mapping of a labelmap instance.
+
+Downloading the complete mapping from DVID takes 30-60 seconds for a large volume.
+The cache stores the downloaded mapping in a file (streamed directly to disk),
+tagged with the repo's mutation ID at the time of the download.
+On later calls, only the mutations that were performed since then are read from
+the mutation log, and the (relatively few) affected supervoxels are re-fetched
+from DVID to bring the cached mapping up-to-date.
+
+Cache layout:
+
+    <cache_dir>/<server>/<repo-root-uuid>/<instance>/mapping.bin
+    <cache_dir>/<server>/<repo-root-uuid>/<instance>/mapping.json
+
+The .bin file holds (sv, body) uint64 pairs.  The first ``sorted_rows`` rows
+are sorted by sv; any rows after that were appended by incremental updates.
+When the appended rows become numerous, the file is re-sorted.
+"""
+import os
+import re
+import logging
+
+import ujson
+import numpy as np
+import pandas as pd
+import networkx as nx
+from numba import jit
+
+from ...util import Timer, file_lock
+from .. import dvid_api_wrapper, fetch_repo_info
+from ..repo import fetch_repo_dag, resolve_ref
+from ._labelmap import fetch_mapping, fetch_mutations, _sorted_contains, _sort_rows_inplace
+from ._mutationlog import MutationLog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAPPING_CACHE_DIR = os.environ.get('NEUCLEASE_MAPPING_CACHE_DIR', os.path.expanduser('~/.cache/neuclease/mappings'))
+
+# Mutation log actions that incremental updates know how to handle.
+# Any other action forces a full download.
+MAPPING_UPDATE_ACTIONS = {'merge', 'cleave', 'split', 'split-supervoxel', 'renumber'}
+
+# Re-sort the cache file when the unsorted (appended) rows exceed this fraction of the file.
+MAX_UNSORTED_FRACTION = 0.05
+
+
+@dvid_api_wrapper
+def fetch_cached_mappings(server, uuid, instance, cache_dir=None, *, kafka_msgs=None, session=None):
+    """
+    Return the raw sv-to-body mapping (as in ``fetch_mappings(..., as_array=True)``),
+    from a local on-disk cache if possible.
+
+    If the cache holds the mapping for the given UUID (or one of its ancestors),
+    it is brought up-to-date by re-fetching only the supervoxels affected by
+    mutations that were performed after the cached copy was downloaded.
+    Otherwise, the mapping is downloaded from DVID and streamed into the cache.
+
+    Note:
+        As with the raw mapping from DVID, the result is not guaranteed to
+        exclude retired supervoxels or identity rows.  (Supervoxels which have
+        been retired since the download are listed with an identity mapping.)
+        See ``fetch_complete_mappings()``.
+
+    Args:
+        server, uuid, instance:
+            A labelmap instance
+        cache_dir:
+            Where to store the cache.
+            Defaults to DEFAULT_MAPPING_CACHE_DIR (``$NEUCLEASE_MAPPING_CACHE_DIR``).
+        kafka_msgs:
+            Optionally provide the labelmap mutation log (for the given uuid and its
+            ancestors) if you've already got it, to avoid re-fetching it.
+            (Either a list of JSON messages or a ``MutationLog``.)
+
+    Returns:
+        Read-only np.memmap, uint64, shape (N,2)
+    """
+    cache_dir = cache_dir or DEFAULT_MAPPING_CACHE_DIR
+    uuid = resolve_ref(server, uuid)
+    repo_info = fetch_repo_info(server, uuid, session=session)
+    dag = fetch_repo_dag(server, uuid, repo_info=repo_info, session=session)
+    uuid = next(u for u in dag.nodes() if u.startswith(uuid))
+
+    # Any mutation after this one might not be reflected in a download that starts now.
+    mutid = repo_info["MutationID"]
+
+    server_name = re.sub(r'[^\w.-]', '_', server.split('://')[-1])
+    path = os.path.join(cache_dir, server_name, repo_info["Root"], instance)
+    os.makedirs(path, exist_ok=True)
+
+    with file_lock(f'{path}/mapping.lock'):
+        meta = _read_meta(path)
+        if meta is not None and (meta['uuid'] == uuid or meta['uuid'] in nx.ancestors(dag, uuid)):
+            if meta['uuid'] == uuid and meta['mutid'] == mutid:
+                return _open_mapping(path, meta)
+
+            meta = _update_cached_mapping(server, uuid, instance, path, meta, mutid, dag, kafka_msgs, session)
+            if meta is not None:
+                return _open_mapping(path, meta)
+
+        meta = _download_mapping(server, uuid, instance, path, mutid, session)
+        return _open_mapping(path, meta)
+
+
+def _download_mapping(server, uuid, instance, path, mutid, session):
+    uri = f"{server}/api/node/{uuid}/{instance}/mappings?format=binary"
+    with Timer(f"Streaming {uri} to {path}", logger):
+        with session.get(uri, stream=True) as r, open(f'{path}/mapping.bin.tmp', 'wb') as f:
+            r.raise_for_status()
+            for chunk in r.iter_content(2**24):
+                f.write(chunk)
+
+    num_rows = os.path.getsize(f'{path}/mapping.bin.tmp') // 16
+    if num_rows > 0:
+        with Timer(f"Sorting {num_rows} cached mapping rows", logger):
+            mapping = np.memmap(f'{path}/mapping.bin.tmp', np.uint64, 'r+', shape=(num_rows, 2))
+            _sort_rows_inplace(np.asarray(mapping))
+            mapping.flush()
+            del mapping
+
+    os.rename(f'{path}/mapping.bin.tmp', f'{path}/mapping.bin')
+    meta = {'uuid': uuid, 'mutid': mutid, 'rows': num_rows, 'sorted_rows': num_rows}
+    _write_meta(path, meta)
+    return meta
+
+
+def _update_cached_mapping(server, uuid, instance, path, meta, mutid, dag, kafka_msgs, session):
+    """
+    Apply the mutations since the cached copy was downloaded.
+    Returns the new metadata, or None if a full download is required.
+    """
+    if kafka_msgs is None:
+        kafka_msgs = fetch_mutations(server, uuid, instance, dag_filter='leaf-and-parents', format='mutation-log', session=session)
+    elif not isinstance(kafka_msgs, MutationLog):
+        kafka_msgs = MutationLog.from_msgs(kafka_msgs, keep_msgs=False)
+
+    # Mutation IDs are assigned server-wide, so mutations in UUIDs that
+    # were created after the cached UUID must be applied regardless of their IDs.
+    cached_lineage = {meta['uuid']} | nx.ancestors(dag, meta['uuid'])
+    msgs = kafka_msgs.filter(drop_completes=True)
+    msgs = msgs.take(~msgs.uuid_mask(cached_lineage) | (msgs.mutid > meta['mutid']))
+
+    unknown_actions = set(np.asarray(msgs.action_names)[np.unique(msgs.action_codes)]) - MAPPING_UPDATE_ACTIONS
+    if unknown_actions:
+        logger.info(f"Can't update cached mapping incrementally due to actions: {unknown_actions}")
+        return None
+
+    if len(msgs) == 0:
+        meta = {**meta, 'uuid': uuid, 'mutid': mutid}
+        _write_meta(path, meta)
+        return meta
+
+    labels, new_svs = _mutated_ids(msgs)
+    mapping = _open_mapping(path, meta, 'r+')
+
+    # Every supervoxel whose mapping may have changed is either new,
+    # or belonged to (or was identical to) one of the mutated labels.
+    with Timer(f"Updating cached mapping with {len(msgs)} mutations", logger):
+        affected_svs = [labels, new_svs]
+        for start in range(0, len(mapping), 10_000_000):
+            chunk = mapping[start:start+10_000_000]
+            affected_svs.append(chunk[_sorted_contains(labels, np.asarray(chunk[:, 1])), 0])
+        affected_svs = pd.unique(np.concatenate(affected_svs))
+
+        bodies = fetch_mapping(server, uuid, instance, affected_svs, session=session)
+
+        # DVID returns 0 for retired supervoxels and the sv itself for identity mappings.
+        # In the cache, both are stored as identity rows (or omitted, if not already present).
+        bodies = np.where(bodies == 0, affected_svs, bodies)
+
+        sorted_rows = meta['sorted_rows']
+        positions = _sorted_positions(np.asarray(mapping[:sorted_rows, 0]), affected_svs)
+        tail = pd.Series(np.arange(sorted_rows, len(mapping)), index=np.array(mapping[sorted_rows:, 0]))
+        tail_positions = tail.reindex(affected_svs, fill_value=-1).values
+        positions = np.where(positions >= 0, positions, tail_positions)
+
+        present = positions >= 0
+        mapping[positions[present], 1] = bodies[present]
+
+        appended = ~present & (bodies != affected_svs)
+        new_rows = np.array((affected_svs[appended], bodies[appended]), np.uint64).transpose()
+        new_rows = new_rows[np.argsort(new_rows[:, 0])]
+        mapping.flush()
+        del mapping
+
+        num_rows = meta['rows']
+        with open(f'{path}/mapping.bin', 'r+b') as f:
+            # Discard any rows left behind by an interrupted update.
+            f.truncate(16*num_rows)
+            f.seek(16*num_rows)
+            f.write(new_rows.tobytes())
+        num_rows += len(new_rows)
+
+    meta = {'uuid': uuid, 'mutid': mutid, 'rows': num_rows, 'sorted_rows': sorted_rows}
+    if num_rows - sorted_rows > MAX_UNSORTED_FRACTION * num_rows:
+        with Timer(f"Re-sorting {num_rows} cached mapping rows", logger):
+            mapping = _open_mapping(path, meta, 'r+')
+            _sort_rows_inplace(np.asarray(mapping))
+            mapping.flush()
+            del mapping
+        meta['sorted_rows'] = num_rows
+
+    _write_meta(path, meta)
+    return meta
+
+
+def _mutated_ids(log):
+    """
+    Return the labels (bodies or supervoxels) named in the
+    given MutationLog (sorted), and the newly created supervoxel IDs.
+    """
+    merged = log.labels[log.action_mask('merge')[log.label_rows()]]
+    labels = np.concatenate((log.body, log.new_body, merged, log.sv_splits[:, 0]))
+    labels = np.unique(labels[labels != 0])
+    new_svs = np.unique(log.sv_splits[:, 1:])
+    return labels, new_svs
+
+
+@jit(nopython=True, nogil=True)
+def _sorted_positions(sorted_values, values):
+    """
+    Return the position of each item of values within sorted_values, or -1 if not present.
+    (sorted_values may be a strided view, and it is not copied.)
+    """
+    positions = np.full(len(values), -1, np.int64)
+    n = len(sorted_values)
+    for k in range(len(values)):
+        v = values[k]
+        lo = 0
+        hi = n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if sorted_values[mid] < v:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < n and sorted_values[lo] == v:
+            positions[k] = lo
+    return positions
+
+
+def _open_mapping(path, meta, mode='r'):
+    if meta['rows'] == 0:
+        return np.zeros((0, 2), np.uint64)
+    return np.memmap(f'{path}/mapping.bin', np.uint64, mode, shape=(meta['rows'], 2))
+
+
+def _read_meta(path):
+    if not os.path.exists(f'{path}/mapping.json') or not os.path.exists(f'{path}/mapping.bin'):
+        return None
+    with open(f'{path}/mapping.json', 'r') as f:
+        return ujson.load(f)
+
+
+def _write_meta(path, meta):
+    with open(f'{path}/mapping.json.tmp', 'w') as f:
+        ujson.dump(meta, f)
+    os.rename(f'{path}/mapping.json.tmp', f'{path}/mapping.json')
+
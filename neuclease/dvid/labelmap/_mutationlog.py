@@ -0,0 +1,554 @@
+"""
+A columnar representation of a labelmap instance's mutation log.
+
+The kafka log (or the /mutations log) of a large labelmap instance may contain
+millions of messages.  Holding them as a list of dicts is slow to parse and
+memory-heavy, and every consumer (split tracking, cleave bookkeeping, etc.)
+must iterate over all of them in Python.  ``MutationLog`` parses the messages
+in a single pass into typed arrays, which can be saved to (and loaded from)
+a single ``.npz`` file.
+"""
+import os
+import logging
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+import ujson
+try:
+    import orjson
+    _loads = orjson.loads
+    _have_orjson = True
+except ImportError:
+    _loads = ujson.loads
+    _have_orjson = False
+
+from ...util import Timer, DEFAULT_TIMESTAMP, file_lock
+from .. import dvid_api_wrapper
+from ..kafka import kafka_info_for_dvid_instance, _read_complete_kafka_log
+from ..repo import resolve_ref
+
+logger = logging.getLogger(__name__)
+
+
+class MutationLog:
+    """
+    Columnar mutation log for a labelmap instance.
+
+    Each message occupies one row in the following arrays:
+
+        mutid:
+            int64 mutation ID (0 if the message has none)
+        action_codes, uuid_codes, user_codes:
+            Indexes into action_names, uuid_names, and user_names.
+            (See the ``action``, ``uuid``, and ``user`` properties.)
+        timestamp:
+            datetime64[ns] (NaT if the message has none)
+        body:
+            The primary body of the mutation: the merge/split 'Target',
+            the cleave/renumber 'OrigLabel', or the split-supervoxel 'Body'.
+        new_body:
+            The body created by the mutation: the cleave 'CleavedLabel',
+            or the split/renumber 'NewLabel'.
+
+    Variable-length fields are stored as flat arrays, with offsets
+    (of length N+1) indicating each message's portion of the array:
+
+        labels, label_offsets:
+            The merged 'Labels' or the 'CleavedSupervoxels'
+        sv_splits, sv_split_offsets:
+            Supervoxel splits as rows of (old, remain, split), from either
+            a 'split' (via 'SVSplits') or a 'split-supervoxel' message.
+        msg_bytes, msg_offsets:
+            The original JSON text of each message.
+            (Omitted if the log was constructed with keep_msgs=False.)
+
+    Iterating over a MutationLog yields the original messages (parsed as dicts),
+    so it can be passed to functions that expect a list of kafka messages.
+    """
+    ARRAYS = ('mutid', 'action_codes', 'uuid_codes', 'user_codes', 'timestamp', 'body', 'new_body',
+              'labels', 'label_offsets', 'sv_splits', 'sv_split_offsets', 'msg_bytes', 'msg_offsets')
+    NAMES = ('action_names', 'uuid_names', 'user_names')
+
+    def __init__(self, **arrays):
+        for name in self.ARRAYS + self.NAMES:
+            setattr(self, name, arrays.get(name))
+
+    def __len__(self):
+        return len(self.mutid)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.msg(i)
+
+    def __repr__(self):
+        return f"MutationLog({len(self)} messages)"
+
+    @property
+    def has_msgs(self):
+        return self.msg_offsets is not None
+
+    def msg(self, i):
+        """
+        Return the original message for the given row, as a dict.
+        """
+        assert self.has_msgs, "This MutationLog was constructed without the original messages."
+        return _loads(self.msg_bytes[self.msg_offsets[i]:self.msg_offsets[i+1]].tobytes())
+
+    @property
+    def action(self):
+        return pd.Categorical.from_codes(self.action_codes, self.action_names)
+
+    @property
+    def uuid(self):
+        return pd.Categorical.from_codes(self.uuid_codes, self.uuid_names)
+
+    @property
+    def user(self):
+        return pd.Categorical.from_codes(self.user_codes, self.user_names)
+
+    def action_mask(self, actions):
+        """
+        Return a boolean mask of the rows whose action is one of the given actions.
+        """
+        if isinstance(actions, str):
+            actions = [actions]
+        codes = [i for i, a in enumerate(self.action_names) if a in set(actions)]
+        return np.isin(self.action_codes, codes)
+
+    def uuid_mask(self, uuids):
+        """
+        Return a boolean mask of the rows whose UUID is one of the given UUIDs.
+        """
+        if isinstance(uuids, str):
+            uuids = [uuids]
+        codes = [i for i, u in enumerate(self.uuid_names) if u in set(uuids)]
+        return np.isin(self.uuid_codes, codes)
+
+    def label_rows(self):
+        """
+        For each item in ``labels``, the row of the message it belongs to.
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.label_offsets))
+
+    def sv_split_rows(self):
+        """
+        For each row of ``sv_splits``, the row of the message it belongs to.
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.sv_split_offsets))
+
+    def take(self, rows):
+        """
+        Return a new MutationLog with only the given rows (indexes or a boolean mask).
+        """
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+
+        arrays = {name: getattr(self, name) for name in self.NAMES}
+        for name in ('mutid', 'action_codes', 'uuid_codes', 'user_codes', 'timestamp', 'body', 'new_body'):
+            arrays[name] = np.asarray(getattr(self, name))[rows]
+
+        ragged = [('labels', 'label_offsets'), ('sv_splits', 'sv_split_offsets')]
+        if self.has_msgs:
+            ragged.append(('msg_bytes', 'msg_offsets'))
+
+        for values_name, offsets_name in ragged:
+            values = getattr(self, values_name)
+            offsets = getattr(self, offsets_name)
+            starts = offsets[rows]
+            lengths = offsets[rows+1] - starts
+            new_offsets = np.zeros(len(rows)+1, np.int64)
+            new_offsets[1:] = np.cumsum(lengths)
+            src = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+            arrays[values_name] = values[src]
+            arrays[offsets_name] = new_offsets
+
+        return MutationLog(**arrays)
+
+    def filter(self, actions=None, uuids=None, drop_completes=False):
+        """
+        Return a new MutationLog containing only the messages
+        with the given actions and/or UUIDs.
+        """
+        mask = np.ones(len(self), bool)
+        if actions is not None:
+            mask &= self.action_mask(actions)
+        if uuids is not None:
+            mask &= self.uuid_mask(uuids)
+        if drop_completes:
+            mask &= ~self.action_mask([a for a in self.action_names if a.endswith('complete')])
+        return self.take(mask)
+
+    def to_dataframe(self, default_timestamp=DEFAULT_TIMESTAMP, drop_completes=True, include_msgs=None):
+        """
+        Return the log as a DataFrame, in the format produced by ``labelmap_kafka_msgs_to_df()``.
+
+        Args:
+            default_timestamp:
+                The timestamp to use for messages that lack one.
+            drop_completes:
+                If True, omit the '*-complete' messages.
+            include_msgs:
+                Whether or not to include the 'msg' column (the original messages as dicts).
+                By default, it is included if the original messages are available.
+        """
+        FINAL_COLUMNS = ['timestamp', 'uuid', 'mutid', 'action', 'target_body', 'target_sv', 'user', 'msg']
+        if include_msgs is None:
+            include_msgs = self.has_msgs
+        if not include_msgs:
+            FINAL_COLUMNS.remove('msg')
+
+        action_names = np.asarray(self.action_names, object)
+        is_complete = np.array([a.endswith('complete') for a in action_names], bool)[self.action_codes]
+
+        # The ...-complete messages contain nothing but the action, uuid, and mutation ID,
+        # but as a convenience we match them with the target_body or target_sv,
+        # based on the most recent message with a matching mutation ID.
+        target_body = np.where(self.action_mask(['merge', 'cleave', 'split']), self.body, 0).astype(np.int64)
+        target_sv = np.zeros(len(self), np.int64)
+        svs = self.action_mask('split-supervoxel')
+        target_sv[svs] = self.sv_splits[self.sv_split_offsets[:-1][svs], 0]
+
+        if is_complete.any():
+            targets = pd.DataFrame({'mutid': self.mutid, 'target_body': target_body, 'target_sv': target_sv})
+            targets.loc[is_complete, ['target_body', 'target_sv']] = np.nan
+            targets = targets.groupby('mutid')[['target_body', 'target_sv']].ffill().fillna(0)
+            target_body = targets['target_body'].values.astype(np.int64)
+            target_sv = targets['target_sv'].values.astype(np.int64)
+
+        uuid_order = np.argsort(self.uuid_names)
+        uuid_remap = np.empty(len(uuid_order), np.int64)
+        uuid_remap[uuid_order] = np.arange(len(uuid_order))
+        uuids = pd.Categorical.from_codes(uuid_remap[self.uuid_codes], np.asarray(self.uuid_names)[uuid_order])
+
+        timestamps = pd.Series(self.timestamp).fillna(pd.Timestamp(default_timestamp))
+
+        df = pd.DataFrame({
+            'timestamp': timestamps.values,
+            'uuid': uuids,
+            'mutid': np.asarray(self.mutid, np.int64),
+            'action': action_names[self.action_codes],
+            'target_body': target_body,
+            'target_sv': target_sv,
+            'user': np.asarray(self.user_names, object)[self.user_codes],
+        })
+        if include_msgs:
+            df['msg'] = list(self)
+
+        if drop_completes:
+            df = df.loc[~is_complete]
+        return df[FINAL_COLUMNS]
+
+    @classmethod
+    def from_msgs(cls, msgs, keep_msgs=True):
+        """
+        Parse a list of labelmap kafka messages, in a single pass.
+
+        Args:
+            msgs:
+                Either JSON text (str or bytes) for each message,
+                or messages that have already been parsed into dicts.
+            keep_msgs:
+                If True, retain the original JSON text of each message.
+        """
+        return cls(**_parse_msgs(msgs, keep_msgs))
+
+    @classmethod
+    def concatenate(cls, logs):
+        """
+        Concatenate several MutationLogs into one.
+        """
+        logs = [*logs]
+        assert len({log.has_msgs for log in logs}) == 1, \
+            "Can't concatenate logs with and without the original messages"
+
+        arrays = {}
+        for names_name, codes_name in zip(cls.NAMES, ('action_codes', 'uuid_codes', 'user_codes')):
+            names = {}
+            codes = []
+            for log in logs:
+                remap = np.array([names.setdefault(n, len(names)) for n in getattr(log, names_name)], np.int64)
+                log_codes = getattr(log, codes_name)
+                codes.append(remap[log_codes].astype(log_codes.dtype))
+            arrays[names_name] = [*names.keys()]
+            arrays[codes_name] = np.concatenate(codes)
+
+        for name in ('mutid', 'timestamp', 'body', 'new_body'):
+            arrays[name] = np.concatenate([getattr(log, name) for log in logs])
+
+        ragged = [('labels', 'label_offsets'), ('sv_splits', 'sv_split_offsets')]
+        if logs[0].has_msgs:
+            ragged.append(('msg_bytes', 'msg_offsets'))
+
+        for values_name, offsets_name in ragged:
+            values = [getattr(log, values_name) for log in logs]
+            offsets = [getattr(log, offsets_name) for log in logs]
+            bases = np.cumsum([0] + [len(v) for v in values])
+            arrays[values_name] = np.concatenate(values)
+            arrays[offsets_name] = np.concatenate([o[:-1] + b for o, b in zip(offsets, bases)] + [bases[-1:]])
+
+        return cls(**arrays)
+
+    @classmethod
+    def from_jsonl(cls, path, keep_msgs=True):
+        """
+        Parse the mutation log from a file with one JSON message per line.
+        """
+        with open(path, 'rb') as f:
+            lines = f.read().splitlines()
+        return cls.from_msgs([line for line in lines if line.strip()], keep_msgs)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a MutationLog from a file written via ``save()``,
+        or parse it from a .jsonl file.
+        """
+        if path.endswith('.jsonl'):
+            with Timer(f"Parsing mutation log from {path}", logger):
+                return cls.from_jsonl(path)
+
+        arrays = {}
+        with np.load(path) as npz:
+            for name in npz.files:
+                arrays[name] = npz[name]
+        for name in cls.NAMES:
+            arrays[name] = arrays[name].tolist()
+        return cls(**arrays)
+
+    def save(self, path, include_msgs=True):
+        """
+        Write the log to a single (uncompressed) .npz file.
+
+        Args:
+            include_msgs:
+                If False, omit the original JSON messages, which make up most
+                of the file size, but aren't needed by the columnar consumers
+                of the log (e.g. ``fetch_complete_mappings()``).
+        """
+        arrays = {name: getattr(self, name) for name in self.ARRAYS if getattr(self, name) is not None}
+        if not include_msgs:
+            arrays.pop('msg_bytes', None)
+            arrays.pop('msg_offsets', None)
+        for name in self.NAMES:
+            arrays[name] = np.array(getattr(self, name), dtype=str)
+        with open(f'{path}.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(f'{path}.tmp', path)
+
+
+def _parse_msgs(msgs, keep_msgs):
+    """
+    Helper for MutationLog.from_msgs()
+    """
+    action_names = {}
+    uuid_names = {}
+    user_names = {}
+
+    n = len(msgs)
+    mutids = np.zeros(n, np.int64)
+    action_codes = np.zeros(n, np.int16)
+    uuid_codes = np.zeros(n, np.int32)
+    user_codes = np.zeros(n, np.int32)
+    timestamps = [None]*n
+    bodies = np.zeros(n, np.uint64)
+    new_bodies = np.zeros(n, np.uint64)
+
+    labels = []
+    label_counts = np.zeros(n, np.int64)
+    sv_splits = []
+    sv_split_counts = np.zeros(n, np.int64)
+    raw_msgs = []
+
+    for i, msg in enumerate(msgs):
+        if isinstance(msg, (str, bytes)):
+            if keep_msgs:
+                raw_msgs.append(msg.encode('utf-8') if isinstance(msg, str) else msg)
+            msg = _loads(msg)
+        elif keep_msgs:
+            raw_msgs.append(_dumps(msg))
+
+        action = msg['Action']
+        action_codes[i] = action_names.setdefault(action, len(action_names))
+        uuid_codes[i] = uuid_names.setdefault(msg['UUID'], len(uuid_names))
+        user_codes[i] = user_names.setdefault(msg.get('User', ''), len(user_names))
+        mutids[i] = msg.get('MutationID', 0)
+
+        ts = msg.get('Timestamp')
+        if ts:
+            timestamps[i] = ts[:len('2018-01-01 00:00:00.000')]
+
+        if action == 'merge':
+            bodies[i] = msg['Target']
+            labels.extend(msg['Labels'])
+            label_counts[i] = len(msg['Labels'])
+        elif action == 'cleave':
+            bodies[i] = msg['OrigLabel']
+            new_bodies[i] = msg['CleavedLabel']
+            labels.extend(msg['CleavedSupervoxels'])
+            label_counts[i] = len(msg['CleavedSupervoxels'])
+        elif action == 'split':
+            bodies[i] = msg['Target']
+            new_bodies[i] = msg['NewLabel']
+            if msg['SVSplits'] is None:
+                logger.error(f"SVSplits is null for body {msg['Target']}")
+                continue
+            for old_sv, split_info in msg['SVSplits'].items():
+                sv_splits.append((int(old_sv), split_info['Remain'], split_info['Split']))
+            sv_split_counts[i] = len(msg['SVSplits'])
+        elif action == 'split-supervoxel':
+            bodies[i] = msg.get('Body', 0)
+            sv_splits.append((msg['Supervoxel'], msg['RemainSupervoxel'], msg['SplitSupervoxel']))
+            sv_split_counts[i] = 1
+        elif action == 'renumber':
+            bodies[i] = msg['OrigLabel']
+            new_bodies[i] = msg['NewLabel']
+
+    def offsets(counts):
+        o = np.zeros(n+1, np.int64)
+        o[1:] = np.cumsum(counts)
+        return o
+
+    arrays = {
+        'mutid': mutids,
+        'action_codes': action_codes,
+        'uuid_codes': uuid_codes,
+        'user_codes': user_codes,
+        'timestamp': pd.to_datetime(pd.Series(timestamps, dtype=object)).values.astype('datetime64[ns]'),
+        'body': bodies,
+        'new_body': new_bodies,
+        'labels': np.array(labels, np.uint64),
+        'label_offsets': offsets(label_counts),
+        'sv_splits': np.array(sv_splits, np.uint64).reshape(-1, 3),
+        'sv_split_offsets': offsets(sv_split_counts),
+        'action_names': [*action_names.keys()],
+        'uuid_names': [*uuid_names.keys()],
+        'user_names': [*user_names.keys()],
+    }
+
+    if keep_msgs:
+        arrays['msg_bytes'] = np.frombuffer(b''.join(raw_msgs), np.uint8)
+        arrays['msg_offsets'] = offsets([len(m) for m in raw_msgs])
+
+    return arrays
+
+
+def _dumps(msg):
+    if _have_orjson:
+        return orjson.dumps(msg)
+    return ujson.dumps(msg).encode('utf-8')
+
+
+@dvid_api_wrapper
+def read_labelmap_mutation_log(server, uuid, instance, dag_filter='leaf-and-parents', group_id=None,
+                               consumer_timeout=2.0, kafka_servers=None, topic_prefix=None, keep_msgs=True,
+                               cache_dir=None, *, session=None):
+    """
+    Read the kafka log for a labelmap instance directly into a ``MutationLog``.
+
+    Equivalent to ``MutationLog.from_msgs(read_kafka_messages(...))``,
+    but each message is parsed only once.
+
+    Args:
+        cache_dir:
+            If given, the complete (unfiltered) log for the instance's kafka topic
+            is stored in this directory, along with the offset of the last record.
+            Subsequent calls read only the records that were appended to the topic
+            since then, so the time spent here no longer grows with the size of the log.
+            Not compatible with group_id.
+
+        Other args:
+            See ``read_kafka_messages()``
+
+    Returns:
+        MutationLog
+    """
+    assert dag_filter in ('leaf-only', 'leaf-and-parents', None)
+    assert cache_dir is None or group_id is None, \
+        "Can't use a kafka group_id with a cached log"
+
+    uuid = resolve_ref(server, uuid)
+    kafka_servers, topic, dag = kafka_info_for_dvid_instance(server, uuid, instance, kafka_servers, topic_prefix, session=session)
+
+    if cache_dir is not None:
+        log = _read_cached_mutation_log(topic, kafka_servers, consumer_timeout, cache_dir, keep_msgs)
+    else:
+        with Timer(f"Reading kafka messages for topic: {topic}", logger):
+            records = _read_complete_kafka_log(topic, kafka_servers, group_id, consumer_timeout)
+
+        with Timer(f"Parsing {len(records)} kafka messages", logger):
+            log = MutationLog.from_msgs([rec.value for rec in records], keep_msgs)
+
+    if dag_filter is None:
+        return log
+
+    matching_uuids = [u for u in dag.nodes() if u.startswith(uuid)]
+    assert len(matching_uuids) == 1, f"Can't find a unique UUID in the server DAG that matches: {uuid}"
+    full_uuid = matching_uuids[0]
+
+    if dag_filter == 'leaf-only':
+        return log.filter(uuids=[full_uuid])
+    return log.filter(uuids={full_uuid} | nx.ancestors(dag, full_uuid))
+
+
+def _read_cached_mutation_log(topic, kafka_servers, consumer_timeout, cache_dir, keep_msgs):
+    """
+    Helper for read_labelmap_mutation_log().
+    Load the cached log for the given topic (if any),
+    and append the records that were added to the topic since it was saved.
+
+    Cache layout:
+
+        <cache_dir>/kafka/<topic>.npz   (see MutationLog.save())
+        <cache_dir>/kafka/<topic>.json  (number of messages and the last offset of each partition)
+    """
+    os.makedirs(f'{cache_dir}/kafka', exist_ok=True)
+    path = f'{cache_dir}/kafka/{topic}'
+
+    with file_lock(f'{path}.lock'):
+        log = None
+        offsets = None
+        if os.path.exists(f'{path}.json') and os.path.exists(f'{path}.npz'):
+            with open(f'{path}.json', 'r') as f:
+                meta = ujson.load(f)
+            log = MutationLog.load(f'{path}.npz')
+
+            if keep_msgs and not log.has_msgs:
+                logger.info("Cached kafka log lacks the original messages. Re-reading the complete log.")
+                log = None
+            else:
+                # If a previous update was interrupted, the log may contain
+                # messages from beyond the recorded offsets.  Discard them.
+                if len(log) > meta['messages']:
+                    log = log.take(np.arange(meta['messages']))
+                offsets = {int(pid): offset for pid, offset in meta['offsets'].items()}
+
+        with Timer(f"Reading kafka messages for topic: {topic}", logger):
+            records = _read_complete_kafka_log(topic, kafka_servers, None, consumer_timeout, offsets)
+
+        if log is not None:
+            logger.info(f"Read {len(records)} new kafka messages (in addition to {len(log)} cached messages)")
+            if not records:
+                return log
+
+        with Timer(f"Parsing {len(records)} kafka messages", logger):
+            new_log = MutationLog.from_msgs([rec.value for rec in records], keep_msgs if log is None else log.has_msgs)
+
+        offsets = offsets or {}
+        for rec in records:
+            offsets[rec.partition_id] = max(rec.offset, offsets.get(rec.partition_id, -1))
+
+        if log is not None:
+            log = MutationLog.concatenate([log, new_log])
+        else:
+            log = new_log
+
+        # Write the log first and the metadata last, so the metadata never refers to missing messages.
+        log.save(f'{path}.npz')
+        with open(f'{path}.json.tmp', 'w') as f:
+            ujson.dump({'messages': len(log), 'offsets': offsets}, f)
+        os.rename(f'{path}.json.tmp', f'{path}.json')
+
+    return log
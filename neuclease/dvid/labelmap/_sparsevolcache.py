@@ -0,0 +1,174 @@
+"""
+A persistent, on-disk cache for coarse sparsevols.
+
+Unlike the in-process ``lru_cache`` used by ``fetch_sparsevol_coarse(..., cache=True)``,
+this cache survives restarts and can be shared by several processes on the same machine.
+Entries are stored in a SQLite database, keyed by (server, repo, instance, label),
+along with the body's mutation ID (from ``/lastmod``) at the time it was fetched.
+A cached body is only used if its mutation ID hasn't changed since then.
+
+Supervoxels are never modified (splitting one produces new IDs),
+so cached supervoxels are used without consulting DVID.
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import closing
+
+import numpy as np
+
+from .. import fetch_repo_info
+from ..rle import runlength_decode_from_ranges, runlength_decode_from_ranges_to_mask
+from ._labelmap import fetch_lastmod, _fetch_sparsevol_coarse_impl
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPARSEVOL_CACHE_DIR = os.environ.get('NEUCLEASE_SPARSEVOL_CACHE_DIR', os.path.expanduser('~/.cache/neuclease/sparsevol-coarse'))
+
+
+class SparsevolCoarseCache:
+    """
+    Disk-backed cache of coarse sparsevols (see ``fetch_sparsevol_coarse()``),
+    with least-recently-used eviction once the cached data exceeds ``max_bytes``.
+
+    Example:
+
+        cache = SparsevolCoarseCache()
+        mask, mask_box = fetch_sparsevol_coarse(server, uuid, 'segmentation', body, format='mask', cache=cache)
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=2**30):
+        """
+        Args:
+            cache_dir:
+                Where to store the cache database.
+                Defaults to DEFAULT_SPARSEVOL_CACHE_DIR (``$NEUCLEASE_SPARSEVOL_CACHE_DIR``).
+            max_bytes:
+                When the total size of the cached sparsevols exceeds this limit,
+                the least recently used entries are evicted.
+        """
+        cache_dir = cache_dir or DEFAULT_SPARSEVOL_CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = f'{cache_dir}/sparsevol-coarse.sqlite'
+        self.max_bytes = max_bytes
+
+        # Repo root for each (server, uuid), so we don't have to ask DVID every time.
+        self._repo_roots = {}
+        self._lock = threading.Lock()
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sparsevols (
+                    server TEXT, repo TEXT, instance TEXT, label TEXT, supervoxels INTEGER,
+                    mutid INTEGER, ranges BLOB, nbytes INTEGER, last_access REAL,
+                    PRIMARY KEY (server, repo, instance, label, supervoxels)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS last_access_index ON sparsevols (last_access)")
+
+    def __getstate__(self):
+        # Make the cache picklable, so it can be passed to worker processes.
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    @property
+    def total_bytes(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM sparsevols").fetchone()[0]
+
+    def __len__(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM sparsevols").fetchone()[0]
+
+    def clear(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM sparsevols")
+
+    def fetch(self, server, uuid, instance, label_id, supervoxels=False, *,
+              format='coords', mask_box=None, session=None):  # @ReservedAssignment
+        """
+        Equivalent to ``fetch_sparsevol_coarse()``, but consults the cache first.
+        As with the uncached function, the result is writable (it's a copy of the cached data).
+        """
+        assert format in ('coords', 'ranges', 'mask')
+        ranges = self.fetch_ranges(server, uuid, instance, label_id, supervoxels, session=session)
+
+        if format == 'ranges':
+            return np.array(ranges)
+        if format == 'coords':
+            return runlength_decode_from_ranges(np.array(ranges))
+        if format == 'mask':
+            return runlength_decode_from_ranges_to_mask(ranges, mask_box)
+
+    def fetch_ranges(self, server, uuid, instance, label_id, supervoxels=False, *, session=None):
+        """
+        Return the coarse sparsevol ranges for the given label,
+        from the cache if they're still valid, otherwise from DVID.
+
+        Note:
+            The returned array is read-only.
+            (Use ``fetch(..., format='ranges')`` to obtain a writable copy.)
+        """
+        if not server.startswith('http://') and not server.startswith('https://'):
+            server = 'http://' + server
+
+        key = (server, self._repo_root(server, uuid, session), instance, str(label_id), int(bool(supervoxels)))
+
+        if supervoxels:
+            mutid = 0
+        else:
+            mutid = fetch_lastmod(server, uuid, instance, label_id, session=session)["mutation id"]
+
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT mutid, ranges FROM sparsevols "
+                               "WHERE server=? AND repo=? AND instance=? AND label=? AND supervoxels=?", key).fetchone()
+            if row is not None and row[0] == mutid:
+                conn.execute("UPDATE sparsevols SET last_access=? "
+                             "WHERE server=? AND repo=? AND instance=? AND label=? AND supervoxels=?", (time.time(), *key))
+                return np.frombuffer(row[1], np.int32).reshape(-1, 4)
+
+        ranges = _fetch_sparsevol_coarse_impl(server, uuid, instance, label_id, supervoxels, format='ranges', session=session)
+        ranges = ranges.astype(np.int32, copy=False)
+        ranges.flags['WRITEABLE'] = False
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO sparsevols VALUES (?,?,?,?,?,?,?,?,?)",
+                         (*key, mutid, ranges.tobytes(), ranges.nbytes, time.time()))
+            self._evict(conn)
+
+        return ranges
+
+    def _repo_root(self, server, uuid, session):
+        with self._lock:
+            root = self._repo_roots.get((server, uuid))
+        if root is None:
+            root = fetch_repo_info(server, uuid, session=session)["Root"]
+            with self._lock:
+                self._repo_roots[(server, uuid)] = root
+        return root
+
+    def _evict(self, conn):
+        total_bytes = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM sparsevols").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+
+        excess = total_bytes - self.max_bytes
+        evicted = []
+        for rowid, nbytes in conn.execute("SELECT rowid, nbytes FROM sparsevols ORDER BY last_access"):
+            if excess <= 0:
+                break
+            evicted.append((rowid,))
+            excess -= nbytes
+
+        conn.executemany("DELETE FROM sparsevols WHERE rowid=?", evicted)
+        logger.debug(f"Evicted {len(evicted)} sparsevols from {self.db_path}")
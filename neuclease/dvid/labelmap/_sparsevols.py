@@ -0,0 +1,224 @@
+"""
+Bulk sparsevol fetching.
+
+``iter_sparsevols()`` fetches the sparsevols of many labels using a pool of
+threads, yielding each result as soon as it arrives.  New requests are only
+issued while the results that haven't been consumed yet occupy less than
+a given number of bytes, so the RAM usage stays bounded no matter how many
+labels are requested, even if the consumer is slower than DVID.
+
+Optionally, the parsed RLE ranges are also appended to an on-disk store:
+
+    <store_dir>/ranges.bin      int32 rows of (Z, Y, X0, X1) for all labels, concatenated
+    <store_dir>/index.csv       label,start,stop (row ranges within ranges.bin)
+
+See ``load_sparsevol_store()``.
+"""
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import pandas as pd
+from requests import HTTPError
+
+from .. import dvid_api_wrapper
+from ..rle import parse_rle_response
+from ._labelmap import fetch_sparsevol_rles
+
+logger = logging.getLogger(__name__)
+
+
+def iter_sparsevols(server, uuid, instance, labels, supervoxels=False, scale=0, *,
+                    coarse=False, format='ranges', threads=8, max_bytes=2**30, store_dir=None):  # @ReservedAssignment
+    """
+    Fetch the sparsevols for many labels, using several threads,
+    and yield ``(label, result)`` for each label in the order the results arrive.
+
+    If a label's sparsevol can't be found (error 404), its result is None.
+
+    Args:
+        server, uuid, instance:
+            A labelmap instance
+
+        labels:
+            The bodies (or supervoxels, if supervoxels=True) to fetch.
+
+        scale:
+            Which scale to fetch the sparsevols from.
+            (Not used if coarse=True.)
+
+        coarse:
+            If True, fetch the coarse sparsevol (from /sparsevol-coarse)
+            instead of the sparsevol at the given scale.
+
+        format:
+            Either 'ranges', 'coords', or 'rle-bytes'.
+            The first two are described in ``parse_rle_response()``.
+            If 'rle-bytes', return DVID's RLE response without parsing it.
+
+        threads:
+            How many requests to send to DVID concurrently.
+
+        max_bytes:
+            Stop issuing new requests while the received responses that
+            haven't been yielded yet occupy more than this many bytes.
+            (This doesn't count the responses that are still being received.)
+
+        store_dir:
+            If provided, the ranges for each label are also appended to an on-disk
+            store in this directory (see ``load_sparsevol_store()``).
+            Labels which are already listed in the store are not fetched again,
+            so an interrupted bulk export can simply be restarted.
+
+    Yields:
+        (label, result)
+    """
+    assert format in ('ranges', 'coords', 'rle-bytes')
+    labels = [*map(int, pd.unique(np.asarray(labels, np.uint64)))]
+
+    store = None
+    if store_dir is not None:
+        store = _SparsevolStoreWriter(store_dir)
+        labels = [label for label in labels if label not in store.labels]
+
+    buffered_bytes = 0
+    buffered_lock = threading.Lock()
+
+    def fetch_payload(label):
+        nonlocal buffered_bytes
+        payload = _fetch_sparsevol_payload(server, uuid, instance, label, supervoxels, scale, coarse)
+        with buffered_lock:
+            buffered_bytes += len(payload or b'')
+        return label, payload
+
+    with ThreadPoolExecutor(threads) as executor:
+        remaining_labels = iter(labels)
+        pending = set()
+
+        def submit_requests():
+            while len(pending) < threads and (not pending or buffered_bytes < max_bytes):
+                label = next(remaining_labels, None)
+                if label is None:
+                    break
+                pending.add(executor.submit(fetch_payload, label))
+
+        submit_requests()
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    label, payload = future.result()
+                    with buffered_lock:
+                        buffered_bytes -= len(payload or b'')
+
+                    result = _parse_sparsevol_payload(payload, format, store, label)
+                    del payload
+                    yield label, result
+                    submit_requests()
+        finally:
+            for future in pending:
+                future.cancel()
+            if store is not None:
+                store.close()
+
+
+@dvid_api_wrapper
+def _fetch_sparsevol_payload(server, uuid, instance, label, supervoxels, scale, coarse, *, session=None):
+    """
+    Fetch the raw RLE payload for a label, or None if the label doesn't exist.
+    """
+    try:
+        if not coarse:
+            return fetch_sparsevol_rles(server, uuid, instance, label, supervoxels, scale, session=session)
+
+        supervoxels = str(bool(supervoxels)).lower()
+        r = session.get(f'{server}/api/node/{uuid}/{instance}/sparsevol-coarse/{label}?supervoxels={supervoxels}')
+        r.raise_for_status()
+        return r.content
+    except HTTPError as ex:
+        if ex.response is not None and ex.response.status_code == 404:
+            return None
+        raise
+
+
+def _parse_sparsevol_payload(payload, format, store, label):  # @ReservedAssignment
+    if payload is None:
+        return None
+
+    if format == 'rle-bytes' and store is None:
+        return payload
+
+    ranges = parse_rle_response(payload, format='ranges')
+    if store is not None:
+        store.append(label, ranges)
+
+    if format == 'ranges':
+        return ranges
+    if format == 'coords':
+        return parse_rle_response(payload, format='coords')
+    return payload
+
+
+class _SparsevolStoreWriter:
+    """
+    Appends RLE ranges to the on-disk store described in the module docstring.
+    """
+    def __init__(self, store_dir):
+        os.makedirs(store_dir, exist_ok=True)
+        self.ranges_path = f'{store_dir}/ranges.bin'
+        self.index_path = f'{store_dir}/index.csv'
+
+        if os.path.exists(self.index_path):
+            index = pd.read_csv(self.index_path)
+        else:
+            index = pd.DataFrame({'label': [], 'start': [], 'stop': []}, dtype=np.int64)
+            index.to_csv(self.index_path, index=False, header=True)
+
+        self.labels = set(index['label'].tolist())
+        self.num_rows = int(index['stop'].max()) if len(index) else 0
+
+        # Discard any rows left behind by an interrupted write.
+        self.ranges_file = open(self.ranges_path, 'ab')
+        self.ranges_file.truncate(16*self.num_rows)
+        self.index_file = open(self.index_path, 'a')
+
+    def append(self, label, ranges):
+        ranges = np.asarray(ranges, np.int32)
+        self.ranges_file.write(ranges.tobytes())
+        self.ranges_file.flush()
+
+        start, self.num_rows = self.num_rows, self.num_rows + len(ranges)
+        self.index_file.write(f'{label},{start},{self.num_rows}\n')
+        self.index_file.flush()
+        self.labels.add(label)
+
+    def close(self):
+        self.ranges_file.close()
+        self.index_file.close()
+
+
+def load_sparsevol_store(store_dir):
+    """
+    Open a store of sparsevol RLE ranges written by ``iter_sparsevols(..., store_dir=...)``.
+
+    Returns:
+        (index, ranges)
+        where index is a DataFrame with columns ['label', 'start', 'stop'], and
+        ranges is a read-only memmap (N,4) of (Z, Y, X0, X1) rows for all labels.
+        The ranges for a given label are ``ranges[start:stop]``.
+
+    Example:
+
+        index, ranges = load_sparsevol_store('/path/to/store')
+        index = index.set_index('label')
+        body_ranges = ranges[slice(*index.loc[body, ['start', 'stop']])]
+    """
+    index = pd.read_csv(f'{store_dir}/index.csv')
+    num_rows = int(index['stop'].max()) if len(index) else 0
+    if num_rows == 0:
+        return index, np.zeros((0,4), np.int32)
+    ranges = np.memmap(f'{store_dir}/ranges.bin', np.int32, 'r', shape=(num_rows, 4))
+    return index, ranges
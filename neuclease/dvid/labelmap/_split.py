@@ -8,13 +8,16 @@ import networkx as nx
 
 from ...util import Timer, find_root, tree_to_dict
 from .. import dvid_api_wrapper
-from ..kafka import read_kafka_messages
+from ._mutationlog import MutationLog, read_labelmap_mutation_log
 
 logger = logging.getLogger(__name__)
 
 SplitEvent = namedtuple("SplitEvent", "mutid old remain split type")
 SplitEvent.__new__.__defaults__ = ('unknown',)
 
+# Split events as a structured array (see split_events_to_table())
+SPLIT_EVENT_DTYPE = [('mutid', np.uint64), ('old', np.uint64), ('remain', np.uint64), ('split', np.uint64), ('type', 'U16')]
+
 @dvid_api_wrapper
 def fetch_supervoxel_splits(server, uuid, instance, source='kafka', format='dict', *, session=None): # @ReservedAssignment
     """
@@ -105,7 +108,7 @@ def fetch_supervoxel_splits_from_dvid(server, uuid, instance, *, session=None):
     return events
 
 @dvid_api_wrapper
-def fetch_supervoxel_splits_from_kafka(server, uuid, instance, actions=['split', 'split-supervoxel'], kafka_msgs=None, *, session=None):
+def fetch_supervoxel_splits_from_kafka(server, uuid, instance, actions=['split', 'split-supervoxel'], kafka_msgs=None, *, cache_dir=None, session=None):
     """
     Read the kafka log for the given instance and return a log of
     all supervoxel split events, partitioned by UUID.
@@ -138,7 +141,12 @@ def fetch_supervoxel_splits_from_kafka(server, uuid, instance, actions=['split',
         
         kafka_msgs:
             The first step of this function is to fetch the kafka log, but if you've already downloaded it,
-            you can provide it here.  Should be a list of parsed JSON structures.
+            you can provide it here.  Should be a list of parsed JSON structures, or a ``MutationLog``.
+
+        cache_dir:
+            If kafka_msgs is not provided, cache the kafka log in this directory,
+            so that subsequent calls only need to read new messages.
+            See ``read_labelmap_mutation_log()``.
 
     Returns:
         Dict of { uuid: event_list }, where event_list is a list of SplitEvent tuples.
@@ -150,9 +158,13 @@ def fetch_supervoxel_splits_from_kafka(server, uuid, instance, actions=['split',
         f"Invalid actions: {actions}"
     
     if kafka_msgs is None:
-        msgs = read_kafka_messages(server, uuid, instance, action_filter=actions, dag_filter='leaf-and-parents', session=session)
-    else:
-        msgs = list(filter(lambda msg: msg["Action"] in actions, kafka_msgs))
+        kafka_msgs = read_labelmap_mutation_log(server, uuid, instance, dag_filter='leaf-and-parents',
+                                                keep_msgs=False, cache_dir=cache_dir, session=session)
+
+    if isinstance(kafka_msgs, MutationLog):
+        return _split_events_from_mutation_log(kafka_msgs, actions)
+
+    msgs = list(filter(lambda msg: msg["Action"] in actions, kafka_msgs))
     
     # Supervoxels can be split via either /split or /split-supervoxel.
     # We need to parse them both.
@@ -173,6 +185,122 @@ def fetch_supervoxel_splits_from_kafka(server, uuid, instance, actions=['split',
     return events
 
 
+def _split_events_from_mutation_log(log, actions):
+    """
+    Helper for fetch_supervoxel_splits_from_kafka().
+    Extract the split events directly from the columns of a MutationLog.
+    """
+    table, uuid_codes = _split_table_from_mutation_log(log, actions)
+    all_events = [*map(SplitEvent._make, table.tolist())]
+
+    # Messages from each UUID are (usually) contiguous in the log.
+    starts = [0, *(np.flatnonzero(uuid_codes[1:] != uuid_codes[:-1]) + 1), len(table)]
+
+    events = {}
+    for start, stop in zip(starts[:-1], starts[1:]):
+        uuid = log.uuid_names[uuid_codes[start]]
+        events.setdefault(uuid, []).extend(all_events[start:stop])
+    return events
+
+
+def _split_table_from_mutation_log(log, actions=('split', 'split-supervoxel')):
+    """
+    Return the split events in the given MutationLog as a
+    structured array (see SPLIT_EVENT_DTYPE), along with
+    the UUID code (see MutationLog.uuid_codes) of each event.
+    """
+    rows = log.sv_split_rows()
+    keep = log.action_mask(actions)[rows]
+    rows = rows[keep]
+
+    table = np.zeros(len(rows), SPLIT_EVENT_DTYPE)
+    table['mutid'] = log.mutid[rows]
+    table['old'], table['remain'], table['split'] = log.sv_splits[keep].transpose()
+    table['type'] = np.asarray(log.action_names)[log.action_codes[rows]]
+    return table, log.uuid_codes[rows]
+
+
+def split_events_to_table(split_events):
+    """
+    Convert split events into a single structured array with
+    fields ``(mutid, old, remain, split, type)`` (see SPLIT_EVENT_DTYPE),
+    listing the events in the same order as the input.
+
+    Args:
+        split_events:
+            Either a dict of SplitEvent lists (as returned by ``fetch_supervoxel_splits()``),
+            or a MutationLog, from which the split events are extracted directly.
+
+    Returns:
+        np.ndarray (structured)
+    """
+    if isinstance(split_events, MutationLog):
+        return _split_table_from_mutation_log(split_events)[0]
+
+    events = [*chain(*split_events.values())]
+    table = np.zeros(len(events), SPLIT_EVENT_DTYPE)
+    if events:
+        mutids, old, remain, split, types = zip(*events)
+        table['mutid'] = mutids
+        table['old'] = old
+        table['remain'] = remain
+        table['split'] = split
+        table['type'] = types
+    return table
+
+
+def resolve_split_roots(split_table, svs):
+    """
+    For each of the given supervoxels, find the original (root) supervoxel
+    from which it was split, according to the given split events.
+    Supervoxels that aren't the product of any split are their own root.
+
+    Rather than walking each supervoxel's chain of split events, the child-to-parent
+    mapping is repeatedly composed with itself (via array lookups) until it reaches
+    a fixed point, so the number of iterations is logarithmic in the depth of the
+    deepest split chain.
+
+    Args:
+        split_table:
+            Structured array of split events, as returned by ``split_events_to_table()``
+        svs:
+            Supervoxel IDs to resolve
+
+    Returns:
+        np.ndarray of root supervoxel IDs, in the same order as svs
+    """
+    svs = np.asarray(svs, np.uint64)
+    if len(split_table) == 0:
+        return svs.copy()
+
+    children = np.concatenate((split_table['remain'], split_table['split']))
+    parents = np.concatenate((split_table['old'], split_table['old']))
+
+    order = np.argsort(children, kind='stable')
+    children = children[order]
+    parents = parents[order]
+
+    def parent_positions(ids):
+        # Index of each ID in 'children', or -1 if it has no parent.
+        pos = np.searchsorted(children, ids)
+        pos[pos == len(children)] = 0
+        return np.where(children[pos] == ids, pos, -1)
+
+    # Pointer jumping: replace each child's parent with its grandparent until no parent has a parent.
+    # (Each iteration doubles the distance jumped, so 64 iterations suffice for any valid split history.)
+    for _ in range(64):
+        pos = parent_positions(parents)
+        has_grandparent = pos >= 0
+        if not has_grandparent.any():
+            break
+        parents = np.where(has_grandparent, parents[np.maximum(pos, 0)], parents)
+    else:
+        raise RuntimeError("Split events contain a cycle")
+
+    pos = parent_positions(svs)
+    return np.where(pos >= 0, parents[np.maximum(pos, 0)], svs)
+
+
 def split_events_to_graph(events):
     """
     Load the split events into an annotated networkx.DiGraph, where each node is a supervoxel ID.
@@ -185,24 +313,25 @@ def split_events_to_graph(events):
     Returns:
         nx.DiGraph, which will consist of trees (i.e. a forest)
     """
+    table = split_events_to_table(events)
+    uuids = np.repeat(np.array([*events.keys()], object), [*map(len, events.values())])
+
     g = nx.DiGraph()
+    old = table['old'].tolist()
+    g.add_edges_from(zip(old, table['remain'].tolist()))
+    g.add_edges_from(zip(old, table['split'].tolist()))
+
+    # If the old ID is not a product of a split event, we don't know when it was created.
+    # (Presumably, it originates from the root UUID, but for old servers the /split-supervoxels
+    # endpoint is not comprehensive all the way to the root node.)
+    unknown = {'uuid': '<unknown>', 'mutid': -1}
+    nx.set_node_attributes(g, dict.fromkeys(old, unknown))
+
+    for col in ('remain', 'split'):
+        children = table[col].tolist()
+        nx.set_node_attributes(g, dict(zip(children, uuids)), 'uuid')
+        nx.set_node_attributes(g, dict(zip(children, table['mutid'].tolist())), 'mutid')
 
-    for uuid, event_list in events.items():
-        for (mutid, old, remain, split, _type) in event_list:
-            g.add_edge(old, remain)
-            g.add_edge(old, split)
-            if 'uuid' not in g.node[old]:
-                # If the old ID is not a product of a split event, we don't know when it was created.
-                # (Presumably, it originates from the root UUID, but for old servers the /split-supervoxels
-                # endpoint is not comprehensive all the way to the root node.)
-                g.node[old]['uuid'] = '<unknown>'
-                g.node[old][mutid] = -1
-
-            g.node[remain]['uuid'] = uuid
-            g.node[split]['uuid'] = uuid
-            g.node[remain]['mutid'] = mutid
-            g.node[split]['mutid'] = mutid
-    
     return g
 
 
@@ -227,17 +356,13 @@ def split_events_to_dataframe(events, drop_duplicates=True, sort=True):
         DataFrame with columns:
         ``['uuid', 'mutid', 'old', 'remain', 'split', 'type']``
     """
-    df = pd.DataFrame(list(chain(*events.values())), columns=SplitEvent._fields)
-    df['uuid'] = ''
-    
-    i = 0
-    for uuid, table in events.items():
-        df.iloc[i:i+len(table), -1] = uuid
-        i += len(table)
-    
-    df['uuid'] = df['uuid'].astype('category')
-    df = df[['uuid'] + list(df.columns[:-1])]
-    
+    table = split_events_to_table(events)
+    uuids = np.repeat(np.array([*events.keys()], object), [*map(len, events.values())])
+
+    df = pd.DataFrame(table)
+    df['type'] = df['type'].astype(object)
+    df.insert(0, 'uuid', pd.Categorical(uuids))
+
     if drop_duplicates:
         df = df.drop_duplicates()
     
@@ -452,18 +577,10 @@ def fetch_supervoxel_fragments(server, uuid, instance, split_source='kafka', kaf
         # No splits on this node
         return (np.array([], np.uint64), np.array([], np.uint64))
     
-    split_table = []
-    for events in split_events.values():
-        for event in events:
-            split_table.append(event[:4])
-    split_table = np.asarray(split_table, np.uint64)
-
-    retired_svs = split_table[:, SplitEvent._fields.index('old')]
-    remain_fragment_svs = split_table[:, SplitEvent._fields.index('remain')]
-    split_fragment_svs = split_table[:, SplitEvent._fields.index('split')]
-
-    leaf_fragment_svs = (set(remain_fragment_svs) | set(split_fragment_svs)) - set(retired_svs)
-    leaf_fragment_svs = np.fromiter(leaf_fragment_svs, np.uint64)
+    split_table = split_events_to_table(split_events)
+    retired_svs = split_table['old']
+    fragment_svs = np.concatenate((split_table['remain'], split_table['split']))
+    leaf_fragment_svs = np.setdiff1d(fragment_svs, retired_svs)
     
     return (leaf_fragment_svs, retired_svs)
 
@@ -476,7 +593,7 @@ def split_events_to_mapping(split_events, leaves_only=False):
 
     Args:
         split_events:
-            As produced by fetch_supervoxel_splits()
+            As produced by fetch_supervoxel_splits(), or a MutationLog.
 
         leaves_only:
             If True, do not include intermediate supervoxels in the mapping;
@@ -489,23 +606,12 @@ def split_events_to_mapping(split_events, leaves_only=False):
     if len(split_events) == 0:
         return np.zeros((0,2), np.uint64)
     
-    split_table = []
-    for events in split_events.values():
-        split_table += [event[:4] for event in events]
-    split_table = np.asarray(split_table, np.uint64)
-
-    old_svs = split_table[:, SplitEvent._fields.index('old')]
-    remain_fragment_svs = split_table[:, SplitEvent._fields.index('remain')]
-    split_fragment_svs = split_table[:, SplitEvent._fields.index('split')]
-
+    split_table = split_events_to_table(split_events)
+    fragment_svs = np.concatenate((split_table['remain'], split_table['split']))
     if leaves_only:
-        leaf_fragment_svs = (set(remain_fragment_svs) | set(split_fragment_svs)) - set(old_svs)
-        fragment_svs = np.fromiter(leaf_fragment_svs, np.uint64)
-    else:
-        fragment_svs = np.concatenate((remain_fragment_svs, split_fragment_svs))
-        
-    g = split_events_to_graph(split_events)
-    root_svs = np.fromiter(map(lambda sv: find_root(g, sv), fragment_svs), np.uint64, len(fragment_svs))
+        fragment_svs = np.setdiff1d(fragment_svs, split_table['old'])
+
+    root_svs = resolve_split_roots(split_table, fragment_svs)
 
     mapping = pd.Series(index=fragment_svs, data=root_svs)
     mapping.index.name = 'fragment_sv'
@@ -3,8 +3,6 @@ from numba import jit
 from numba.types import int32
 from numba.typed import List
 
-import pandas as pd
-
 
 def extract_rle_size_and_first_coord(rle_payload_bytes):
     """
@@ -39,6 +37,20 @@ def construct_rle_payload(coords_zyx):
     """
     coords_zyx = coords_zyx.astype(np.int32, copy=False)
     rles_zyx = runlength_encode_to_lengths(coords_zyx, assume_sorted=False)
+    return _construct_rle_payload_from_lengths(rles_zyx)
+
+
+def construct_rle_payload_from_ranges(ranges_zyx):
+    """
+    Like construct_rle_payload(), but starting from RLE ranges
+    (see parse_rle_response()) instead of voxel coordinates.
+    """
+    rles_zyx = normalize_rle_ranges(ranges_zyx).astype(np.int32)
+    rles_zyx[:, 3] = 1 + rles_zyx[:, 3] - rles_zyx[:, 2]
+    return _construct_rle_payload_from_lengths(rles_zyx)
+
+
+def _construct_rle_payload_from_lengths(rles_zyx):
     rles_xyz = rles_zyx[:, (2,1,0,3)]
 
     payload_items = []
@@ -55,9 +67,8 @@ def combine_sparsevol_rle_responses(rle_payloads):
     Combined two sets of RLE payloads (perhaps fetched from DVID),
     into a single RLE payload.
     """
-    combined_coords = map(parse_rle_response, rle_payloads)
-    combined_coords = np.concatenate([*combined_coords])
-    return construct_rle_payload(combined_coords)
+    combined_ranges = [parse_rle_response(p, format='ranges') for p in rle_payloads]
+    return construct_rle_payload_from_ranges(rle_ranges_union(*combined_ranges))
 
 
 def parse_rle_response(response_bytes, dtype=np.int32, format='coords'):  # @ReservedAssignment
@@ -200,16 +211,9 @@ def rle_box_dilation(start_coords, lengths, radius):
     for rz in range(-radius, radius+1):
         new_tables.append( table + np.int32((rz,0,0,0)) )
 
-    # Choose chunk size for condense step.
-    # As a heuristic, anything smaller than the size of the
-    # original RLE seems like a reasonable chunk size to use.
-    # Smaller chunks require less RAM usage overall,
-    # but if there are too many chunks the code isn't well vectorized.
-    chunk_size = max(1024, len(start_coords) // 8)
-
     # Condense.
     table = np.concatenate(new_tables)
-    table = _condense_rles(table, chunk_size)
+    table = _condense_rles(table)
 
     # Dilate in Y
     new_tables = []
@@ -218,51 +222,22 @@ def rle_box_dilation(start_coords, lengths, radius):
 
     # Condense.
     table = np.concatenate(new_tables)
-    table = _condense_rles(table, chunk_size)
+    table = _condense_rles(table)
 
     return table[:, :3], table[:, 3]
 
 
-def _condense_rles(table, chunk_size):
+def _condense_rles(table):
     """
     Given an RLE table (columns Z,Y,X,L) which may contain overlapping RLEs,
     condense it into a minmal RLE table.
-
-    This is done by decoding it, dropping duplicate coordinates, and re-encoding it.
-    The table is processed in chunks to avoid too much instantaneous RAM usage.
     """
     assert len(table) > 0
 
-    # Sort by Z,Y columns
-    order = np.lexsort(table[:, :2].transpose()[::-1])
-    table = table[order]
-
-    # We could do this as one big decode step and drop duplicates afterward,
-    # but that would require a lot of RAM.
-    # Instead, break into chunks and drop duplicates as we go.
-    condensed_chunks = []
-    start = 0
-    while start < len(table):
-        # Search for a stop row that splits *between* ZY groups
-        # TODO: This would be faster without an explicit loop, using diff or something
-        stop = start+chunk_size
-        while stop < len(table) and (table[stop, :2] == table[stop-1, :2]).all():
-            stop += 1
-
-        # Must copy because C-order is required
-        chunk = table[start:stop]
-        start = stop
-
-        chunk_coords = runlength_decode_from_lengths( chunk[:, :3].copy(), chunk[:, 3].copy() )
-        chunk_coords = pd.DataFrame(chunk_coords, columns=[*'zyx'])
-        chunk_coords = chunk_coords.drop_duplicates().sort_values([*'zyx'])
-        chunk_coords = np.asarray(chunk_coords.values, order='C')
-
-        condensed_chunk = runlength_encode_to_lengths(chunk_coords, True)
-        condensed_chunks.append( condensed_chunk )
-        del chunk_coords
-
-    condensed_table = np.concatenate( condensed_chunks )
+    ranges = table.copy()
+    ranges[:, 3] += ranges[:, 2] - 1
+    condensed_table = normalize_rle_ranges(ranges)
+    condensed_table[:, 3] += 1 - condensed_table[:, 2]
     return condensed_table
 
 
@@ -672,3 +647,390 @@ def runlength_decode_from_ranges(rle_array_zyx):
             c += 1
 
     return coords
+
+
+def parse_rle_stream_to_blocks(byte_chunks, block_width=64):
+    """
+    Decode a (legacy) RLE response from DVID (e.g. from /sparsevol)
+    directly into per-block binary masks, without ever constructing
+    the list of voxel coordinates (or even holding the whole response in RAM).
+
+    Blocks are kept in packed form (see ``np.packbits()``) once the stream has
+    moved beyond them, so for a typical (Z-ordered) response, the RAM usage is
+    proportional to the number of blocks the object touches, not its voxel count.
+
+    Args:
+        byte_chunks:
+            The RLE response from DVID, either as a single bytes object,
+            or as an iterable of bytes objects of arbitrary sizes,
+            e.g. ``response.iter_content(2**20)``.
+
+        block_width:
+            The width of each block.  Must be a multiple of 8.
+
+    Returns:
+        dict of ``{corner_zyx: packed_mask}``, in which each corner is a tuple
+        (a multiple of block_width), and each packed mask is a uint8 array of
+        ``block_width**3 // 8`` bytes.  See ``unpack_block_mask()``.
+        Blocks which contain no voxels are not included.
+    """
+    assert block_width % 8 == 0
+    if isinstance(byte_chunks, (bytes, bytearray, memoryview)):
+        byte_chunks = [bytes(byte_chunks)]
+
+    block_shape = (block_width,)*3
+    active_blocks = {}
+    packed_blocks = {}
+
+    def pack_blocks(max_block_z):
+        for corner in [c for c in active_blocks if c[0] < max_block_z]:
+            packed_blocks[corner] = np.packbits(active_blocks.pop(corner))
+
+    header = None
+    leftover = b''
+    for chunk in byte_chunks:
+        buf = leftover + chunk
+        if header is None:
+            if len(buf) < 12:
+                leftover = buf
+                continue
+            header = np.frombuffer(buf[:12], np.uint8)
+            assert header[0] == 0, f"Don't know how to handle this payload. (descriptor: {header[0]})"
+            assert header[1] == 3, "Expected XYZ run-lengths"
+            assert header[2] == 0, "This function assumes the RLE run dimension is X"
+            buf = buf[12:]
+
+        num_rows = len(buf) // 16
+        leftover = buf[16*num_rows:]
+        if num_rows == 0:
+            continue
+
+        rles_xyzl = np.frombuffer(buf, np.int32, 4*num_rows).reshape(-1, 4)
+        block_coords, local_ranges = _split_rles_at_blocks(rles_xyzl, block_width)
+
+        order = np.lexsort(block_coords.transpose()[::-1])
+        block_coords = block_coords[order]
+        local_ranges = local_ranges[order]
+
+        group_starts = np.flatnonzero((block_coords[1:] != block_coords[:-1]).any(axis=1)) + 1
+        group_starts = np.concatenate(([0], group_starts))
+        group_stops = np.concatenate((group_starts[1:], [len(block_coords)]))
+
+        corners = block_coords[group_starts] * block_width
+        for corner, start, stop in zip(map(tuple, corners.tolist()), group_starts, group_stops):
+            mask = active_blocks.get(corner)
+            if mask is None:
+                if corner in packed_blocks:
+                    mask = unpack_block_mask(packed_blocks.pop(corner), block_width)
+                else:
+                    mask = np.zeros(block_shape, bool)
+                active_blocks[corner] = mask
+            _write_mask_from_ranges(local_ranges[start:stop], mask)
+
+        # Pack the blocks that the stream has (apparently) moved past.
+        pack_blocks(rles_xyzl[-1, 2] // block_width * block_width)
+
+    assert header is not None and len(leftover) == 0, \
+        "RLE response is truncated or malformed"
+
+    pack_blocks(np.inf)
+    return packed_blocks
+
+
+def unpack_block_mask(packed_mask, block_width=64):
+    """
+    Unpack a block mask as returned by ``parse_rle_stream_to_blocks()``.
+
+    Returns:
+        boolean array of shape (block_width, block_width, block_width)
+    """
+    return np.unpackbits(packed_mask).view(bool).reshape((block_width,)*3)
+
+
+@jit(nopython=True, nogil=True)
+def _split_rles_at_blocks(rles_xyzl, block_width):
+    """
+    Split the given RLEs (rows of X,Y,Z,length) at block boundaries.
+
+    Returns:
+        (block_coords, local_ranges)
+        where block_coords gives the block index (ZYX) of each RLE piece,
+        and local_ranges gives each piece as [Z,Y,X0,X1] within its block,
+        using Python conventions (X1 is one-past-the-end).
+    """
+    num_pieces = 0
+    for i in range(len(rles_xyzl)):
+        x0 = rles_xyzl[i, 0]
+        length = rles_xyzl[i, 3]
+        if length > 0:
+            num_pieces += (x0 + length - 1) // block_width - x0 // block_width + 1
+
+    block_coords = np.empty((num_pieces, 3), np.int32)
+    local_ranges = np.empty((num_pieces, 4), np.int32)
+
+    p = 0
+    for i in range(len(rles_xyzl)):
+        x, y, z, length = rles_xyzl[i]
+        x_end = x + length
+        bz = z // block_width
+        by = y // block_width
+        while x < x_end:
+            bx = x // block_width
+            piece_end = min(x_end, (bx + 1) * block_width)
+            block_coords[p, 0] = bz
+            block_coords[p, 1] = by
+            block_coords[p, 2] = bx
+            local_ranges[p, 0] = z - bz * block_width
+            local_ranges[p, 1] = y - by * block_width
+            local_ranges[p, 2] = x - bx * block_width
+            local_ranges[p, 3] = piece_end - bx * block_width
+            x = piece_end
+            p += 1
+
+    return block_coords, local_ranges
+
+
+#
+# Set operations on RLE ranges.
+#
+# The functions below operate directly on arrays of RLE ranges
+# (as returned by parse_rle_response(..., format='ranges')), i.e.
+#
+#     [[Z,Y,X0,X1], [Z,Y,X0,X1], ...]
+#
+# in which the interval [X0,X1] is INCLUSIVE, following DVID conventions.
+# Their cost scales with the number of runs, not the number of voxels.
+#
+# Unless otherwise noted, they return "normalized" ranges:
+# sorted in Z-Y-X order, with no overlapping or adjacent runs.
+#
+
+def normalize_rle_ranges(ranges_zyx):
+    """
+    Sort the given RLE ranges and merge any overlapping (or adjacent) runs,
+    so that each voxel is listed exactly once, in the minimal number of runs.
+    """
+    ranges_zyx = np.asarray(ranges_zyx)
+    if len(ranges_zyx) == 0:
+        return np.zeros((0,4), ranges_zyx.dtype)
+
+    assert ranges_zyx.ndim == 2 and ranges_zyx.shape[1] == 4
+    order = np.lexsort(ranges_zyx[:, :3].transpose()[::-1])
+    ranges = np.ascontiguousarray(ranges_zyx[order], np.int64)
+    return _merge_sorted_ranges(ranges).astype(ranges_zyx.dtype)
+
+
+def rle_ranges_union(*ranges_list):
+    """
+    Return the union of the given RLE ranges arrays (any number of them).
+    """
+    ranges_list = [np.asarray(r).reshape(-1, 4) for r in ranges_list]
+    return normalize_rle_ranges(np.concatenate(ranges_list))
+
+
+def rle_ranges_intersection(ranges_a, ranges_b):
+    """
+    Return the voxels that are present in both of the given RLE ranges arrays.
+    """
+    a, b, dtype = _normalized_pair(ranges_a, ranges_b)
+    return _intersect_normalized_ranges(a, b).astype(dtype)
+
+
+def rle_ranges_difference(ranges_a, ranges_b):
+    """
+    Return the voxels from ranges_a that are not present in ranges_b.
+    """
+    a, b, dtype = _normalized_pair(ranges_a, ranges_b)
+    return _subtract_normalized_ranges(a, b).astype(dtype)
+
+
+def rle_ranges_contains(ranges_zyx, points_zyx, assume_normalized=False):
+    """
+    Determine which of the given points lie within the given RLE ranges,
+    via binary search (without decoding the RLEs).
+
+    Args:
+        ranges_zyx:
+            RLE ranges, as described above.
+        points_zyx:
+            array (N,3)
+        assume_normalized:
+            If True, skip the normalization step
+            (e.g. if you're querying the same ranges repeatedly).
+
+    Returns:
+        boolean array (N,)
+    """
+    if not assume_normalized:
+        ranges_zyx = normalize_rle_ranges(ranges_zyx)
+    ranges = np.ascontiguousarray(ranges_zyx, np.int64).reshape(-1, 4)
+    points = np.ascontiguousarray(points_zyx, np.int64).reshape(-1, 3)
+    return _ranges_contain_points(ranges, points)
+
+
+def rle_ranges_clip(ranges_zyx, box_zyx):
+    """
+    Discard the portions of the given RLE ranges that fall outside the given box.
+
+    Args:
+        ranges_zyx:
+            RLE ranges, as described above.  (Need not be normalized.)
+        box_zyx:
+            [start, stop], following Python conventions (stop is one-past-the-end).
+
+    Returns:
+        The clipped ranges, in the same order as the input (minus the discarded runs).
+    """
+    ranges_zyx = np.asarray(ranges_zyx).reshape(-1, 4)
+    box_zyx = np.asarray(box_zyx)
+
+    keep = (ranges_zyx[:, :2] >= box_zyx[0, :2]).all(axis=1)
+    keep &= (ranges_zyx[:, :2] < box_zyx[1, :2]).all(axis=1)
+    keep &= (ranges_zyx[:, 3] >= box_zyx[0, 2])
+    keep &= (ranges_zyx[:, 2] < box_zyx[1, 2])
+
+    clipped = ranges_zyx[keep]
+    clipped[:, 2] = np.maximum(clipped[:, 2], box_zyx[0, 2])
+    clipped[:, 3] = np.minimum(clipped[:, 3], box_zyx[1, 2] - 1)
+    return clipped
+
+
+def rle_ranges_voxel_count(ranges_zyx):
+    """
+    Return the number of voxels in the given RLE ranges.
+    (If the ranges might overlap, normalize them first.)
+    """
+    ranges_zyx = np.asarray(ranges_zyx).reshape(-1, 4)
+    return int((ranges_zyx[:, 3].astype(np.int64) - ranges_zyx[:, 2] + 1).sum())
+
+
+def _normalized_pair(ranges_a, ranges_b):
+    ranges_a = np.asarray(ranges_a).reshape(-1, 4)
+    ranges_b = np.asarray(ranges_b).reshape(-1, 4)
+    dtype = np.result_type(ranges_a.dtype, ranges_b.dtype)
+    a = np.ascontiguousarray(normalize_rle_ranges(ranges_a), np.int64)
+    b = np.ascontiguousarray(normalize_rle_ranges(ranges_b), np.int64)
+    return a, b, dtype
+
+
+@jit(nopython=True, nogil=True)
+def _compare_zy(z1, y1, z2, y2):
+    if z1 != z2:
+        return -1 if z1 < z2 else 1
+    if y1 != y2:
+        return -1 if y1 < y2 else 1
+    return 0
+
+
+@jit(nopython=True, nogil=True)
+def _merge_sorted_ranges(ranges):
+    """
+    Merge overlapping or adjacent runs.
+    The input must be sorted in Z-Y-X0 order.
+    """
+    merged = np.empty_like(ranges)
+    n = 0
+    for i in range(len(ranges)):
+        z, y, x0, x1 = ranges[i]
+        if n > 0 and merged[n-1, 0] == z and merged[n-1, 1] == y and x0 <= merged[n-1, 3] + 1:
+            merged[n-1, 3] = max(merged[n-1, 3], x1)
+        else:
+            merged[n, 0] = z
+            merged[n, 1] = y
+            merged[n, 2] = x0
+            merged[n, 3] = x1
+            n += 1
+    return merged[:n]
+
+
+@jit(nopython=True, nogil=True)
+def _intersect_normalized_ranges(a, b):
+    result = np.empty((len(a) + len(b), 4), np.int64)
+    n = 0
+    i = 0
+    j = 0
+    while i < len(a) and j < len(b):
+        c = _compare_zy(a[i, 0], a[i, 1], b[j, 0], b[j, 1])
+        if c < 0:
+            i += 1
+            continue
+        if c > 0:
+            j += 1
+            continue
+
+        x0 = max(a[i, 2], b[j, 2])
+        x1 = min(a[i, 3], b[j, 3])
+        if x0 <= x1:
+            result[n, 0] = a[i, 0]
+            result[n, 1] = a[i, 1]
+            result[n, 2] = x0
+            result[n, 3] = x1
+            n += 1
+
+        # Advance whichever run ends first
+        if a[i, 3] < b[j, 3]:
+            i += 1
+        else:
+            j += 1
+    return result[:n]
+
+
+@jit(nopython=True, nogil=True)
+def _subtract_normalized_ranges(a, b):
+    result = np.empty((len(a) + len(b), 4), np.int64)
+    n = 0
+    j = 0
+    for i in range(len(a)):
+        z, y, x0, x1 = a[i]
+
+        # Skip the runs of b that lie entirely before this run
+        while j < len(b):
+            c = _compare_zy(b[j, 0], b[j, 1], z, y)
+            if c < 0 or (c == 0 and b[j, 3] < x0):
+                j += 1
+            else:
+                break
+
+        # Emit the gaps between the runs of b that overlap this run
+        x = x0
+        k = j
+        while k < len(b) and b[k, 0] == z and b[k, 1] == y and b[k, 2] <= x1:
+            if b[k, 2] > x:
+                result[n, 0] = z
+                result[n, 1] = y
+                result[n, 2] = x
+                result[n, 3] = b[k, 2] - 1
+                n += 1
+            x = max(x, b[k, 3] + 1)
+            k += 1
+
+        if x <= x1:
+            result[n, 0] = z
+            result[n, 1] = y
+            result[n, 2] = x
+            result[n, 3] = x1
+            n += 1
+    return result[:n]
+
+
+@jit(nopython=True, nogil=True)
+def _ranges_contain_points(ranges, points):
+    results = np.zeros(len(points), np.bool_)
+    for p in range(len(points)):
+        z, y, x = points[p]
+
+        # Find the last run that starts at or before the point
+        lo = 0
+        hi = len(ranges)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            c = _compare_zy(ranges[mid, 0], ranges[mid, 1], z, y)
+            if c < 0 or (c == 0 and ranges[mid, 2] <= x):
+                lo = mid + 1
+            else:
+                hi = mid
+
+        r = lo - 1
+        if r >= 0 and ranges[r, 0] == z and ranges[r, 1] == y and x <= ranges[r, 3]:
+            results[p] = True
+    return results
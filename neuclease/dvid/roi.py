@@ -1,3 +1,5 @@
+import os
+import hashlib
 import logging
 from functools import partial
 from collections.abc import Mapping
@@ -5,13 +7,17 @@ from collections.abc import Mapping
 import ujson
 import numpy as np
 import pandas as pd
+from numba import jit
 
-from ..util import tqdm_proxy, extract_labels_from_volume, box_shape, extract_subvol, box_intersection, compute_parallel
+from ..util import tqdm_proxy, extract_labels_from_volume, box_shape, compute_parallel
 from . import dvid_api_wrapper, fetch_generic_json
+from .repo import fetch_repo_info, expand_uuid
 from .rle import runlength_decode_from_ranges, runlength_decode_from_ranges_to_mask, runlength_encode_mask_to_ranges
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_ROI_CACHE_DIR = os.environ.get('NEUCLEASE_ROI_CACHE_DIR', os.path.expanduser('~/.cache/neuclease/rois'))
+
 @dvid_api_wrapper
 def fetch_roi(server, uuid, instance, format='ranges', *, mask_box=None, session=None): # @ReservedAssignment
     """
@@ -181,20 +187,20 @@ def _fetch_roi_size(server, uuid, roi, session=None):
 
 
 @dvid_api_wrapper
-def fetch_combined_roi_volume(server, uuid, rois, as_bool=False, box_zyx=None, *, session=None):
+def fetch_combined_roi_volume(server, uuid, rois, as_bool=False, box_zyx=None, *, cache=False, session=None):
     """
     Fetch several ROIs from DVID and combine them into a single label volume or mask.
     The label values in the returned volume correspond to the order in which the ROI
     names were passed in, starting at label 1.
 
-    If the ROIs overlap, the location of the overlapping voxels is not preserved in the result,
-    but a list of detected overlapping ROI pairs is included in the results.
+    If the ROIs overlap, the location of the overlapping voxels is not preserved in the result
+    (the last ROI in the list "wins"), but the overlapping ROI pairs are reported in the results.
 
     Note: All results are returned at SCALE 5, i.e. resolution = 2**5.
-    
-    Two progress bars are shown: one for downloading the ROI RLEs, and another for
-    constructing the output volume.
-    
+
+    All ROIs are painted into the result in a single (compiled) pass over their RLE ranges,
+    which also counts the overlapping voxels as each ROI is painted.
+
     Caveat for pathological cases:
         Note that if more than 2 ROIs overlap at a common location,
         then some pathological cases can omit pairs of overlaps.
@@ -217,7 +223,6 @@ def fetch_combined_roi_volume(server, uuid, rois, as_bool=False, box_zyx=None, *
     
         as_bool:
             If True, return a boolean mask instead of a label volume.
-            Note: When using is_bool, the `overlapping_pairs` result is undefined.
         
         box_zyx:
             Optional. Specifies the box `[start, stop] == [(z0,y0,x0), (z1,y1,x1)]`
@@ -232,13 +237,19 @@ def fetch_combined_roi_volume(server, uuid, rois, as_bool=False, box_zyx=None, *
             For example, `box_zyx=[(0,0,0), None]` can be used to produce an output
             volume whose coordinates are aligned to the underlying data (at scale 5)
             with no offset.
+
+        cache:
+            If True (or a directory path), store the downloaded ROI ranges on disk,
+            keyed by (server, uuid, ROI set), and re-use them on subsequent calls.
+            By default, they are stored in DEFAULT_ROI_CACHE_DIR (``$NEUCLEASE_ROI_CACHE_DIR``).
+            The cache is only used for locked nodes, since ROIs in an unlocked node may still change.
     
     Returns:
         (combined_vol, combined_box, overlap_stats)
         where combined_vol is an image volume (ndarray) (resolution: scale 5),
         combined_box indicates the location of combined_vol (scale 5),
-        and overlap_stats indicates which ROIs overlap, and are thus not
-        completely represented in the output volume (see caveat above).
+        and overlap_stats indicates which ROIs overlap (and how many voxels they share),
+        and are thus not completely represented in the output volume.
         
         Unless as_bool is used, combined_vol is a label volume, whose dtype 
         will be wide enough to allow a unique value for each ROI in the list.
@@ -255,14 +266,85 @@ def fetch_combined_roi_volume(server, uuid, rois, as_bool=False, box_zyx=None, *
         # Combine into volume
         roi_vol, box, overlaps = fetch_combined_roi_volume('emdata3:8900', '7f0c', rois, box_zyx=[(0,0,0), None])
     """
+    rois, reverse_rois = _normalize_roi_labels(rois)
+    all_rle_ranges = _fetch_roi_ranges(server, uuid, [*rois.keys()], cache, session)
+
+    # If roi is completely empty, don't process it at all
+    all_rle_ranges = {roi: ranges for roi, ranges in all_rle_ranges.items() if len(ranges) > 0}
+    rois = {roi: label for roi, label in rois.items() if roi in all_rle_ranges}
+
+    if box_zyx is None:
+        box_zyx = [None, None]
+
+    box_zyx = list(box_zyx)
+    assert len(box_zyx) == 2
+
+    combined_ranges = np.concatenate([np.zeros((0,4), np.int32), *all_rle_ranges.values()])
+    if box_zyx[0] is None:
+        box_zyx[0] = combined_ranges[:, (0,1,2)].min(axis=0)
+    if box_zyx[1] is None:
+        box_zyx[1] = 1 + combined_ranges[:, (0,1,3)].max(axis=0)
+
+    box_zyx = np.asarray(box_zyx)
+    combined_shape = (box_zyx[1] - box_zyx[0])
+
+    # Paint the ROI index (starting at 1) for each voxel, then translate to the ROI labels below.
+    roi_indexes = np.repeat(np.arange(1, len(rois)+1), [len(r) for r in all_rle_ranges.values()])
+    index_dtype = _smallest_uint_dtype(len(rois))
+    index_vol = np.zeros(combined_shape, index_dtype)
+    overlaps = np.zeros((len(rois)+1, len(rois)+1), np.int64)
+    _paint_roi_ranges(combined_ranges.astype(np.int64), roi_indexes, box_zyx[0].astype(np.int64), index_vol, overlaps)
+
+    roi_labels = np.array([0, *rois.values()])
+    overlap_stats = _overlap_stats(overlaps, rois, reverse_rois)
+
+    if as_bool:
+        return index_vol.astype(bool), box_zyx, overlap_stats
+
+    # Choose smallest dtype that can hold enough unique values
+    dtype = _smallest_uint_dtype(roi_labels.max())
+    if dtype == index_dtype and (roi_labels == np.arange(len(roi_labels))).all():
+        combined_vol = index_vol
+    else:
+        combined_vol = roi_labels.astype(dtype)[index_vol]
+
+    return combined_vol, box_zyx, overlap_stats
+
+
+def _overlap_stats(overlaps, rois, reverse_rois):
+    """
+    Convert the overlap counts from _paint_roi_ranges() (or _count_range_overlaps())
+    into a DataFrame of overlapping ROI pairs ['roi_a', 'roi_b', 'overlap'],
+    listed in the order the ROIs were painted.
+    """
+    roi_names = [None, *rois.keys()]
+    roi_labels = np.array([0, *rois.values()])
+
+    overlap_stats = []
+    for b, a in zip(*overlaps.transpose().nonzero()):
+        overlap_stats.append((reverse_rois[roi_labels[a]], roi_names[b], b, overlaps[a, b]))
+    overlap_stats = pd.DataFrame(overlap_stats, columns=['roi_a', 'roi_b', 'roi_b_index', 'overlap'])
+    overlap_stats = (overlap_stats.groupby(['roi_b_index', 'roi_a', 'roi_b'], sort=False)['overlap'].sum()
+                                  .reset_index()
+                                  .sort_values(['roi_b_index', 'overlap'], ascending=[True, False], kind='stable'))
+    return overlap_stats[['roi_a', 'roi_b', 'overlap']].reset_index(drop=True)
+
+
+def _normalize_roi_labels(rois):
+    """
+    Convert the given ROI list (or single ROI name, or dict) to a dict {name: label},
+    and also return the reverse mapping {label: name} (with names joined via '+'
+    if the caller mapped more than one ROI to the same label).
+    """
     if isinstance(rois, str):
         rois = [rois]
-    
+
     # rois is a dict {name : label}
     if not isinstance(rois, Mapping):
         rois = { roi : i for i,roi in enumerate(rois, start=1) }
+    rois = dict(rois)
 
-    # Create a reverse-lookup {label : name} for reporting overlaps below.
+    # Create a reverse-lookup {label : name} for reporting overlaps.
     reverse_rois = {}
     for roi, label in rois.items():
         if label in reverse_rois:
@@ -272,88 +354,189 @@ def fetch_combined_roi_volume(server, uuid, rois, as_bool=False, box_zyx=None, *
         else:
             reverse_rois[label] = roi
 
-    all_rle_ranges = {}
-    for roi in tqdm_proxy(rois.keys(), leave=False):
-        all_rle_ranges[roi] = fetch_roi(server, uuid, roi, format='ranges', session=session)
-    
-    roi_boxes = {}
-    for roi, rle_ranges in all_rle_ranges.items():
-        # If roi is completely empty, don't process it at all
-        if len(rle_ranges) == 0:
-            del rois[roi]
-        else:
-            roi_boxes[roi] = np.array([  rle_ranges[:, (0,1,2)].min(axis=0),
-                                       1+rle_ranges[:, (0,1,3)].max(axis=0)])
-    
-    if box_zyx is None:
-        box_zyx = [None, None]
+    return rois, reverse_rois
 
-    box_zyx = list(box_zyx)
-    assert len(box_zyx) == 2
 
-    roi_box_array = np.array([*roi_boxes.values()])
-    if box_zyx[0] is None:
-        box_zyx[0] = roi_box_array[:,0,:].min(axis=0)
-    if box_zyx[1] is None:
-        box_zyx[1] = roi_box_array[:,1,:].max(axis=0)
-    
-    box_zyx = np.asarray(box_zyx)
-    combined_shape = (box_zyx[1] - box_zyx[0])
-    
-    if as_bool:
-        dtype = np.bool
+def _smallest_uint_dtype(max_value):
+    for d in [np.uint8, np.uint16, np.uint32]:
+        if max_value <= np.iinfo(d).max:
+            return d
+    return np.uint64
+
+
+def _fetch_roi_ranges(server, uuid, rois, cache=False, session=None):
+    """
+    Fetch the RLE ranges for each of the given ROIs, possibly from the on-disk cache.
+    (See ``fetch_combined_roi_volume()`` for details about the cache.)
+
+    Returns:
+        dict {roi: ranges}, in the same order as the given ROI names.
+    """
+    if not cache:
+        return {roi: fetch_roi(server, uuid, roi, format='ranges', session=session)
+                for roi in tqdm_proxy(rois, leave=False)}
+
+    repo_info = fetch_repo_info(server, uuid, session=session)
+    full_uuid = expand_uuid(server, uuid, repo_info=repo_info, session=session)
+    if not repo_info['DAG']['Nodes'][full_uuid]['Locked']:
+        logger.info(f"Not using the ROI cache, since node {full_uuid} is not locked.")
+        return _fetch_roi_ranges(server, uuid, rois, False, session)
+
+    cache_dir = DEFAULT_ROI_CACHE_DIR if cache is True else cache
+    os.makedirs(cache_dir, exist_ok=True)
+
+    sorted_rois = sorted(set(rois))
+    key = hashlib.sha1(ujson.dumps([server, full_uuid, sorted_rois]).encode()).hexdigest()
+    path = f'{cache_dir}/{key}.npz'
+
+    if os.path.exists(path):
+        with np.load(path) as f:
+            counts = f['counts']
+            ranges = f['ranges']
+        all_ranges = dict(zip(sorted_rois, np.split(ranges, np.cumsum(counts)[:-1])))
     else:
-        # Choose smallest dtype that can hold enough unique values
-        for d in [np.uint8, np.uint16, np.uint32]:
-            if max(rois.values()) <= np.iinfo(d).max:
-                dtype = d
-                break
+        all_ranges = _fetch_roi_ranges(server, uuid, sorted_rois, False, session)
+        counts = np.array([len(r) for r in all_ranges.values()], np.int64)
+        ranges = np.concatenate([np.zeros((0,4), np.int32), *all_ranges.values()])
 
-    overlap_stats = []
-    combined_vol = np.zeros(combined_shape, dtype)
-
-    # Overlay ROIs one-by-one
-    for roi, label in tqdm_proxy(rois.items(), leave=False):
-        roi_box = box_intersection(roi_boxes[roi], box_zyx)
-        assert (roi_box[1] - roi_box[0] > 0).all(), "ROI box does not intersect the full box."
-        roi_mask, _roi_box = runlength_decode_from_ranges_to_mask(all_rle_ranges[roi], roi_box)
-        assert (_roi_box == roi_box).all()
-        
-        # If we're overwriting some areas of a ROI we previously wrote,
-        # keep track of the overlapping pairs.
-        combined_view = extract_subvol(combined_vol, roi_box - box_zyx[0])
-        assert combined_view.base is combined_vol
-        
-        # Keep track of the overlapping sizes
-        prev_labels_overlap_sizes = pd.Series(combined_view[roi_mask]).value_counts()
-        for p, size in prev_labels_overlap_sizes.items():
-            if p == 0:
-                continue
-            
-            if p == label:
-                # Note: In the case of combined ROIs, where the user is
-                # mapping more than one ROI to the same label, we
-                # overlaps among ROIs in the same group are still worth noting.
-                # Hence, no special handling in this case.
-                pass
-            overlap_stats.append((reverse_rois[p], roi, size))
-
-        # Overwrite view
-        if as_bool:
-            combined_view[roi_mask] = True
-        else:
-            combined_view[roi_mask] = label
+        # Write to a temporary file first, in case another process is reading the cache.
+        with open(f'{path}.{os.getpid()}.tmp', 'wb') as f:
+            np.savez(f, counts=counts, ranges=ranges)
+        os.replace(f'{path}.{os.getpid()}.tmp', path)
 
-    overlap_stats = pd.DataFrame(overlap_stats, columns=['roi_a', 'roi_b', 'overlap'])
-    return combined_vol, box_zyx, overlap_stats
+    return {roi: all_ranges[roi] for roi in rois}
+
+
+@jit(nopython=True, nogil=True)
+def _paint_roi_ranges(ranges, roi_indexes, box_start, vol, overlaps):
+    """
+    Paint each ROI's index into the given volume, in order,
+    and count the voxels in which one ROI overwrites another.
+    Ranges (or portions of ranges) outside the volume are ignored.
+
+    Args:
+        ranges:
+            RLE ranges [[Z,Y,X0,X1], ...] (X1 is inclusive), for all ROIs
+        roi_indexes:
+            The ROI index to paint for each range (must be nonzero)
+        box_start:
+            The location of the volume's first voxel
+        vol:
+            The volume to paint into
+        overlaps:
+            2D array into which the overlaps are accumulated,
+            indexed by [previous_index, new_index].
+    """
+    Z, Y, X = vol.shape
+    for i in range(len(ranges)):
+        z = ranges[i, 0] - box_start[0]
+        y = ranges[i, 1] - box_start[1]
+        x0 = max(ranges[i, 2] - box_start[2], 0)
+        x1 = min(ranges[i, 3] - box_start[2], X - 1)
+        if z < 0 or z >= Z or y < 0 or y >= Y:
+            continue
+
+        r = roi_indexes[i]
+        for x in range(x0, x1+1):
+            prev = vol[z, y, x]
+            if prev != 0 and prev != r:
+                overlaps[prev, r] += 1
+            vol[z, y, x] = r
+
+
+@jit(nopython=True, nogil=True)
+def _count_range_overlaps(ranges, roi_indexes, box_start, box_stop, overlaps):
+    """
+    Count the overlapping voxels exactly as _paint_roi_ranges() would,
+    but without painting the ranges into a volume.
+    Only voxels within the given box are counted.
+
+    The ranges must be sorted by (Z,Y), and within each row,
+    they must be listed in the order they would be painted.
+    """
+    N = len(ranges)
+    row_start = 0
+    while row_start < N:
+        z = ranges[row_start, 0]
+        y = ranges[row_start, 1]
+        row_stop = row_start + 1
+        while row_stop < N and ranges[row_stop, 0] == z and ranges[row_stop, 1] == y:
+            row_stop += 1
+
+        row_indexes = roi_indexes[row_start:row_stop]
+        if (row_indexes.min() != row_indexes.max()
+                and box_start[0] <= z < box_stop[0]
+                and box_start[1] <= y < box_stop[1]):
+            _count_row_overlaps(ranges[row_start:row_stop], row_indexes, box_start[2], box_stop[2], overlaps)
+        row_start = row_stop
+
+
+@jit(nopython=True, nogil=True)
+def _count_row_overlaps(ranges, roi_indexes, x_start, x_stop, overlaps):
+    """
+    Helper for _count_range_overlaps(), for the ranges of a single row.
+    The row is divided into intervals at each range endpoint,
+    and within each interval, the covering ranges are 'painted' in order.
+    """
+    bounds = np.empty(2*len(ranges), np.int64)
+    for i in range(len(ranges)):
+        bounds[2*i] = min(max(ranges[i, 2], x_start), x_stop)
+        bounds[2*i+1] = min(max(ranges[i, 3] + 1, x_start), x_stop)
+    bounds = np.unique(bounds)
+
+    for k in range(len(bounds) - 1):
+        x = bounds[k]
+        length = bounds[k+1] - x
+        prev = 0
+        for i in range(len(ranges)):
+            if ranges[i, 2] <= x <= ranges[i, 3]:
+                r = roi_indexes[i]
+                if prev != 0 and prev != r:
+                    overlaps[prev, r] += length
+                prev = r
+
+
+@jit(nopython=True, nogil=True)
+def _lookup_roi_ranges(ranges, roi_indexes, points):
+    """
+    For each point, find the ROI index of the last ROI (highest index)
+    whose ranges contain the point, or 0 if there is none.
+
+    The ranges must be sorted by (Z,Y), but they may overlap.
+    """
+    results = np.zeros(len(points), roi_indexes.dtype)
+    for p in range(len(points)):
+        z, y, x = points[p]
+
+        # Find the first range in the point's row
+        lo = 0
+        hi = len(ranges)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ranges[mid, 0] < z or (ranges[mid, 0] == z and ranges[mid, 1] < y):
+                lo = mid + 1
+            else:
+                hi = mid
+
+        i = lo
+        while i < len(ranges) and ranges[i, 0] == z and ranges[i, 1] == y:
+            if ranges[i, 2] <= x <= ranges[i, 3] and roi_indexes[i] > results[p]:
+                results[p] = roi_indexes[i]
+            i += 1
+    return results
 
 
 @dvid_api_wrapper
-def determine_point_rois(server, uuid, rois, points_df, combined_vol=None, combined_box=None, *, session=None):
+def determine_point_rois(server, uuid, rois, points_df, combined_vol=None, combined_box=None, *, cache=False, session=None):
     """
     Convenience function that combines fetch_combined_roi_volume() and extract_labels_from_volume().
     Labels points with their corresponding ROI (if any).
     Points that are not contained in the given ROIs are not labeled.
+
+    Unless you provide combined_vol, the ROI volume is not actually constructed.
+    Instead, the points are looked up directly in the ROIs' RLE ranges (via binary search),
+    which is much cheaper for large ROIs (and works for very large point lists).
+    The results are the same either way.
     
     Given a list of ROI names and a DataFrame with (at least) columns ['x', 'y', 'z'],
     append columns 'roi_label' and 'roi', indicating which ROI each point falls in.
@@ -388,6 +571,10 @@ def determine_point_rois(server, uuid, rois, points_df, combined_vol=None, combi
         combined_box:
             Optionally crop the ROIs according to the given box before using them.
             Must be provided if combined_vol is provided.
+
+        cache:
+            If True (or a directory path), use the on-disk ROI cache.
+            See fetch_combined_roi_volume().
     
     Returns:
         Nothing.  points_df is modified in-place.4
@@ -403,10 +590,8 @@ def determine_point_rois(server, uuid, rois, points_df, combined_vol=None, combi
         "This function doesn't work if the input DataFrame's index has duplicate values."
 
     if combined_vol is None:
-        combined_vol, combined_box, overlaps = fetch_combined_roi_volume(server, uuid, rois, False, combined_box, session=session)
-        if len(overlaps):
-            logger.warning(f"Some ROIs overlap!")
-            logger.warning(f"Overlapping pairs:\n{overlaps}")
+        _determine_point_rois_from_ranges(server, uuid, rois, points_df, combined_box, cache, session)
+        return
 
     assert combined_box is not None
 
@@ -414,3 +599,56 @@ def determine_point_rois(server, uuid, rois, points_df, combined_vol=None, combi
     points_df.drop(columns=['roi', 'roi_label'], errors='ignore', inplace=True)
     points_df.rename(inplace=True, columns={'label': 'roi_label', 'label_name': 'roi'})
 
+
+def _determine_point_rois_from_ranges(server, uuid, rois, points_df, box_zyx, cache, session):
+    """
+    Implementation of determine_point_rois() which consults the ROI
+    RLE ranges directly (via binary search), without rasterizing them.
+    The results are identical to those obtained from the combined ROI volume,
+    including the handling of overlapping ROIs (the last ROI "wins").
+    """
+    rois, reverse_rois = _normalize_roi_labels(rois)
+    all_rle_ranges = _fetch_roi_ranges(server, uuid, [*rois.keys()], cache, session)
+
+    ranges = np.concatenate([np.zeros((0,4), np.int32), *all_rle_ranges.values()]).astype(np.int64)
+    roi_indexes = np.repeat(np.arange(1, len(rois)+1), [len(r) for r in all_rle_ranges.values()])
+
+    # lexsort is stable, so within each row, the ranges remain in ROI order.
+    order = np.lexsort(ranges[:, :2].transpose()[::-1])
+    ranges = ranges[order]
+    roi_indexes = roi_indexes[order]
+
+    # Report overlapping ROIs, just as we would if we had constructed the combined volume.
+    if box_zyx is None:
+        overlap_box = np.array([3*[np.iinfo(np.int64).min], 3*[np.iinfo(np.int64).max]])
+    else:
+        overlap_box = np.asarray(box_zyx, np.int64)
+    overlaps = np.zeros((len(rois)+1, len(rois)+1), np.int64)
+    _count_range_overlaps(ranges, roi_indexes, overlap_box[0], overlap_box[1], overlaps)
+    if overlaps.any():
+        overlap_stats = _overlap_stats(overlaps, rois, reverse_rois)
+        logger.warning("Some ROIs overlap!")
+        logger.warning(f"Overlapping pairs:\n{overlap_stats}")
+
+    points_zyx = (points_df[['z', 'y', 'x']].values // 2**5).astype(np.int64)
+    point_indexes = _lookup_roi_ranges(ranges, roi_indexes, points_zyx)
+
+    if box_zyx is not None:
+        box_zyx = np.asarray(box_zyx)
+        in_box = ((points_zyx >= box_zyx[0]) & (points_zyx < box_zyx[1])).all(axis=1)
+        point_indexes[~in_box] = 0
+
+    roi_labels = np.array([0, *rois.values()])
+    dtype = _smallest_uint_dtype(roi_labels.max())
+
+    # Same conventions as extract_labels_from_volume():
+    # If several ROIs share a label, the label's name is the last such ROI.
+    label_names = {label: roi for roi, label in rois.items()}
+    categories = ['<unspecified>', *label_names.values()]
+    label_codes = dict(zip(label_names.keys(), range(1, len(categories))))
+    roi_codes = np.array([0, *(label_codes[label] for label in rois.values())])
+
+    points_df.drop(columns=['roi', 'roi_label'], errors='ignore', inplace=True)
+    points_df['roi_label'] = roi_labels.astype(dtype)[point_indexes]
+    points_df['roi'] = pd.Categorical.from_codes(roi_codes[point_indexes], categories)
+
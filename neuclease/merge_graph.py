@@ -1,21 +1,34 @@
 import os
+import time
 import logging
 import threading
 from socket import getfqdn
 from collections import defaultdict
 from contextlib import contextmanager
 
+import ujson
 import numpy as np
 import pandas as pd
 
-from .util import Timer
-from .dvid import fetch_repo_info, find_repo_root, fetch_supervoxels, fetch_labels, fetch_complete_mappings, fetch_mutation_id, fetch_supervoxel_splits, fetch_supervoxel_splits_from_kafka
+from .util import Timer, dump_json
+from .rwlock import ReadWriteLock
+from .dvid import fetch_repo_info, resolve_ref, fetch_supervoxels, fetch_labels, fetch_complete_mappings, fetch_mutation_id, fetch_supervoxel_splits, fetch_supervoxel_splits_from_kafka, split_events_to_table
 from .merge_table import MERGE_TABLE_DTYPE, load_mapping, load_merge_table, normalize_merge_table, apply_mapping_to_mergetable
 from .focused.ingest import fetch_focused_decisions
 from .adjacency import find_missing_adjacencies
 
 _logger = logging.getLogger(__name__)
 
+# How long (in seconds) cached server names and repo roots remain valid.
+REPO_INFO_CACHE_TTL = 600.0
+
+# Written (last) by LabelmapMergeGraph.publish_shared()
+SHARED_GRAPH_MANIFEST = 'manifest.json'
+
+# Number of buffered edges (see LabelmapMergeGraph.add_edges())
+# which triggers a background merge into the main merge table.
+MAX_PENDING_EDGES = 100_000
+
 
 @contextmanager
 def dummy_lock():
@@ -26,6 +39,26 @@ def dummy_lock():
     yield
 
 
+def _frame_from_shared_arrays(arrays):
+    """
+    Construct a DataFrame whose columns are views of the given (memory-mapped) arrays.
+
+    Ordinarily, pandas consolidates columns of the same dtype into a single 2D block,
+    which copies them -- either in the DataFrame constructor or lazily (e.g. in take()).
+    Here, each column gets its own block, and the frame is marked as already consolidated,
+    so the columns are never copied into private memory.
+    """
+    frames = [pd.DataFrame(a[:, None], columns=[col], copy=False) for col, a in arrays.items()]
+    df = pd.concat(frames, axis=1, copy=False)
+
+    mgr = getattr(df, '_mgr', None)
+    if mgr is None:
+        mgr = df._data  # pandas < 1.1
+    mgr._is_consolidated = True
+    mgr._known_consolidated = True
+    return df
+
+
 class LabelmapMergeGraph:
     """
     Represents a volume-wide merge graph.
@@ -65,6 +98,10 @@ class LabelmapMergeGraph:
 
         self.no_kafka = no_kafka
 
+        # If True, the table and mapping are (read-only) views of
+        # data published by another process.  See attach_shared().
+        self.read_only = False
+
         if table is None:
             # Empty table -- allowed for debugging.
             self.merge_table_df = pd.DataFrame(np.zeros((0,), dtype=MERGE_TABLE_DTYPE))
@@ -82,6 +119,11 @@ class LabelmapMergeGraph:
         assert list(self.merge_table_df.columns)[:9] == list(dict(MERGE_TABLE_DTYPE).keys())[:9]
         
         self._mapping_versions = {}
+
+        # Inverted index of the in-memory mapping (body -> supervoxels).
+        # See _update_body_index()
+        self.mapping = None
+        self._body_index = (np.zeros(0, np.uint64), np.zeros(1, np.int64), np.zeros(0, np.uint64))
         
         self._edge_cache = {}
         
@@ -94,6 +136,101 @@ class LabelmapMergeGraph:
         
         self.max_cache_len = 1000
 
+        # Caches for server name canonicalization and repo root lookups,
+        # so that extract_edges() can answer cache hits without a DNS lookup
+        # or a /repo/info round trip.  Values are (result, timestamp).
+        self._server_names = {}
+        self._repo_roots = {}
+        self._repo_info_lock = threading.Lock()
+        self.repo_info_ttl = REPO_INFO_CACHE_TTL
+
+        # Edges added via add_edges() are held in a side buffer
+        # until they are merged into the main table (see merge_pending_edges()).
+        # The RW lock ensures that readers always see a consistent combination
+        # of the main table and the buffer.
+        self._table_rwlock = ReadWriteLock()
+        self._pending_edges = []
+        self._pending_lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._merge_thread = None
+        self.max_pending_edges = MAX_PENDING_EDGES
+
+        # Incremented whenever edges are added, so that extract_edges()
+        # can avoid caching results that were computed from stale edges.
+        self._edges_version = 0
+
+
+    @classmethod
+    def attach_shared(cls, path, primary_uuid=None, debug_export_dir=None):
+        """
+        Construct a read-only merge graph from the arrays written by ``publish_shared()``
+        (typically by a different process).  The arrays are memory-mapped rather than
+        loaded, so if the directory resides on a RAM-backed filesystem (e.g. /dev/shm),
+        all attached processes share a single copy of the data.
+        Only the edge cache is private to each process.
+
+        Note:
+            The returned graph can't be modified,
+            i.e. the append_edges_*() and apply_mapping() methods will fail.
+
+        Args:
+            path:
+                A directory previously populated via ``publish_shared()``.
+
+            primary_uuid, debug_export_dir:
+                See ``__init__()``
+        """
+        with open(f'{path}/{SHARED_GRAPH_MANIFEST}', 'r') as f:
+            manifest = ujson.load(f)
+
+        def load(name):
+            return np.load(f'{path}/{name}.npy', mmap_mode='r')
+
+        with Timer(f"Attaching to shared merge graph in {path}", _logger):
+            table = _frame_from_shared_arrays({col: load(f'table-{col}') for col in manifest['columns']})
+            graph = cls(table, primary_uuid, debug_export_dir, no_kafka=True)
+
+            if manifest['has-mapping']:
+                mapping_index = pd.Index(load('mapping-sv'), name='sv', copy=False)
+                graph.mapping = pd.Series(load('mapping-body'), index=mapping_index, name='body', copy=False)
+                graph._body_index = (load('index-bodies'), load('index-offsets'), load('index-svs'))
+
+        graph.read_only = True
+        return graph
+
+
+    def publish_shared(self, path):
+        """
+        Write the merge table, mapping, and body index to the given directory (as .npy files),
+        so that other processes can attach to them via ``attach_shared()``.
+        To share the data in RAM, choose a directory on a RAM-backed filesystem, e.g. /dev/shm/<name>.
+
+        The manifest file is written last, so readers never see a partially-written graph.
+        """
+        os.makedirs(path, exist_ok=True)
+        with Timer(f"Publishing shared merge graph to {path}", _logger):
+            for col in self.merge_table_df.columns:
+                np.save(f'{path}/table-{col}.npy', self.merge_table_df[col].values)
+
+            has_mapping = self.mapping is not None
+            if has_mapping:
+                np.save(f'{path}/mapping-sv.npy', self.mapping.index.values)
+                np.save(f'{path}/mapping-body.npy', self.mapping.values)
+                for name, a in zip(('bodies', 'offsets', 'svs'), self._body_index):
+                    np.save(f'{path}/index-{name}.npy', a)
+
+            manifest = { 'columns': list(self.merge_table_df.columns),
+                         'num-edges': len(self.merge_table_df),
+                         'has-mapping': has_mapping,
+                         'primary-uuid': self.primary_uuid }
+            dump_json(manifest, f'{path}/{SHARED_GRAPH_MANIFEST}.tmp')
+            os.rename(f'{path}/{SHARED_GRAPH_MANIFEST}.tmp', f'{path}/{SHARED_GRAPH_MANIFEST}')
+
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError("This merge graph is attached to shared (read-only) data and can't be modified.")
+
 
     def set_primary_uuid(self, primary_uuid):
         _logger.info(f"Changing primary (cached) UUID from {self.primary_uuid} to {primary_uuid}")
@@ -101,17 +238,67 @@ class LabelmapMergeGraph:
 
 
     def apply_mapping(self, mapping):
+        self._check_writable()
         if isinstance(mapping, str):
             mapping = load_mapping(mapping)
-        apply_mapping_to_mergetable(self.merge_table_df, mapping)
-        self.mapping = mapping
 
+        # Buffered edges must be included in the table before the mapping is applied.
+        self.merge_pending_edges()
+        with self._merge_lock, self._table_rwlock.context(write=True):
+            apply_mapping_to_mergetable(self.merge_table_df, mapping)
+            self.mapping = mapping
+            self._update_body_index()
+
+
+    def _update_body_index(self):
+        """
+        Build an inverted index of self.mapping, for fast body -> supervoxels lookups.
+        The index consists of the unique (sorted) body IDs, the start offset of
+        each body's supervoxels (plus a final sentinel), and the supervoxel IDs,
+        sorted by body and then by supervoxel.
+        """
+        with Timer("Indexing mapping by body", _logger):
+            bodies = self.mapping.values.astype(np.uint64, copy=False)
+            svs = self.mapping.index.values.astype(np.uint64, copy=False)
+            if self.mapping.index.is_monotonic_increasing:
+                order = np.argsort(bodies, kind='stable')
+            else:
+                order = np.lexsort((svs, bodies))
+
+            sorted_bodies = bodies[order]
+            sorted_svs = svs[order]
+            del order
+
+            starts = np.flatnonzero(sorted_bodies[1:] != sorted_bodies[:-1]) + 1
+            starts = np.concatenate(([0], starts)) if len(sorted_bodies) else starts
+            unique_bodies = sorted_bodies[starts]
+            offsets = np.append(starts, len(sorted_bodies)).astype(np.int64)
+
+        # Replace all three arrays at once, for the benefit of concurrent readers.
+        self._body_index = (unique_bodies, offsets, sorted_svs)
+
+
+    def supervoxels_for_body(self, body_id):
+        """
+        Return the (sorted) supervoxels of the given body according to the
+        in-memory mapping, via the body index (no full scan of the mapping).
+        If the body is not present in the mapping, an empty array is returned.
+        """
+        unique_bodies, offsets, sorted_svs = self._body_index
+        i = np.searchsorted(unique_bodies, np.uint64(body_id))
+        if i == len(unique_bodies) or unique_bodies[i] != body_id:
+            return sorted_svs[:0]
+        return sorted_svs[offsets[i]:offsets[i+1]]
+
+
+    def fetch_and_apply_mapping(self, server, uuid, instance, kafka_msgs=None, mapping_cache_dir=None):
+        self._check_writable()
 
-    def fetch_and_apply_mapping(self, server, uuid, instance, kafka_msgs=None):
         # For testing purposes, we have a special means of avoiding kafkas
         if self.no_kafka:
             kafka_msgs = []
-        mapping = fetch_complete_mappings(server, uuid, instance, include_retired=True, kafka_msgs=kafka_msgs)
+        mapping = fetch_complete_mappings(server, uuid, instance, include_retired=True, kafka_msgs=kafka_msgs,
+                                          cache_dir=mapping_cache_dir)
         self.apply_mapping(mapping)
 
 
@@ -128,6 +315,7 @@ class LabelmapMergeGraph:
         Returns:
             The count of appended edges
         """
+        self._check_writable()
         repo_info = fetch_repo_info(server, uuid)
         if focused_decisions_instance not in repo_info["DataInstances"]:
             return 0
@@ -139,14 +327,10 @@ class LabelmapMergeGraph:
 
         # These are manual merges: Give a great score.
         focused_merges['score'] = np.float32(0.01)
-        
-        # Ensure correct dtypes for concatenation
-        for col, dtype in MERGE_TABLE_DTYPE:
-            focused_merges[col] = focused_merges[col].astype(dtype, copy=False)
-        
-        focused_merges = focused_merges.loc[:, list(self.merge_table_df.columns)]
-        self.merge_table_df = pd.concat((self.merge_table_df, focused_merges), ignore_index=True, copy=False)
-        return len(focused_merges)
+
+        num_edges = self.add_edges(focused_merges)
+        self.merge_pending_edges()
+        return num_edges
 
 
     def append_edges_for_split_supervoxels(self, instance_info, parent_sv_handling='unmap', read_from='kafka', kafka_msgs=None):
@@ -175,6 +359,7 @@ class LabelmapMergeGraph:
             If any edges could not be preserved because the queried point in DVID does not seem to be a split child,
             a DataFrame of such edges is returned.
         """
+        self._check_writable()
         assert parent_sv_handling in ('keep', 'drop', 'unmap')
         assert read_from in ('dvid', 'kafka')
         
@@ -183,26 +368,18 @@ class LabelmapMergeGraph:
         else:
             split_events = fetch_supervoxel_splits(*instance_info, 'dvid')
 
-        # Drop 'type' field, keep only the int fields.
-        all_split_events = []
-        for events in split_events.values():
-            for event in events:
-                all_split_events.append(event[:-1])
-
-        all_split_events = np.asarray(all_split_events, np.uint64)
-        if len(all_split_events) == 0:
-            all_split_events = np.zeros((0,4), np.uint64)
-        
-        assert all_split_events.shape[1] == 4
+        all_split_events = split_events_to_table(split_events)
         if len(all_split_events) == 0:
             # No split events at all: Return empty dataframe
             bad_edges = self.merge_table_df.iloc[:0]
             return bad_edges
         
-        # Each event is [mutid, old, remain, split]
-        old_ids = all_split_events[:, 1]
-        remain_ids = all_split_events[:, 2]
-        split_ids = all_split_events[:, 3]
+        old_ids = all_split_events['old']
+        remain_ids = all_split_events['remain']
+        split_ids = all_split_events['split']
+
+        # Edges which are still in the pending buffer may refer to the split parents, too.
+        self.merge_pending_edges()
 
         # First extract relevant rows for faster queries below
         _parents = set(old_ids)
@@ -210,10 +387,11 @@ class LabelmapMergeGraph:
         parent_rows_df = self.merge_table_df.query('id_a in @_parents or id_b in @_parents').copy()
         assert parent_rows_df.columns[:2].tolist() == ['id_a', 'id_b']
         
-        if parent_sv_handling == 'drop':
-            self.merge_table_df = self.merge_table_df.drop(parent_rows_df.index)
-        elif parent_sv_handling == 'unmap':
-            self.merge_table_df.loc[parent_rows_df.index, 'body'] = np.uint64(0)
+        with self._merge_lock, self._table_rwlock.context(write=True):
+            if parent_sv_handling == 'drop':
+                self.merge_table_df = self.merge_table_df.drop(parent_rows_df.index)
+            elif parent_sv_handling == 'unmap':
+                self.merge_table_df.loc[parent_rows_df.index, 'body'] = np.uint64(0)
 
         with Timer(f"Appending {len(parent_rows_df)} edges with split supervoxel IDs", _logger):
             bad_edges = []
@@ -247,26 +425,160 @@ class LabelmapMergeGraph:
         else:
             bad_edges = update_table_df.iloc[:0] # No bad edges: Empty DataFrame
 
-        # Normalize the updates
-        update_table_array = update_table_df.to_records(index=False)
-        normalized_update = normalize_merge_table(update_table_array, False, None)
-        normalized_update_df = pd.DataFrame(normalized_update, index=update_table_df.index)
-
-        # Append the updates
-        assert (normalized_update_df.columns == self.merge_table_df.columns).all()
-        self.merge_table_df = pd.concat((self.merge_table_df, normalized_update_df), ignore_index=True, copy=False)
+        # Normalize and append the updates
+        self.add_edges(update_table_df, normalize=True)
+        self.merge_pending_edges()
 
         return bad_edges
 
 
+    def add_edges(self, edges_df, normalize=True):
+        """
+        Add new edges to the merge graph, e.g. from new focused merge decisions
+        or edges for newly split supervoxels.  Safe to call while the server is running.
+
+        The new edges are held in a side buffer, which is consulted by extract_edges().
+        Once more than ``max_pending_edges`` have accumulated, the buffer is merged
+        into the main table in a background thread.  (See ``merge_pending_edges()``.)
+        Cached edges for any body that contains the new edges are discarded.
+
+        Args:
+            edges_df:
+                DataFrame with columns 'id_a', 'id_b', 'score', and (optionally)
+                the coordinate columns listed in MERGE_TABLE_DTYPE.
+                Missing coordinates are set to 0.
+                If the DataFrame has a 'body' column, it is ignored.
+                The 'body' column is determined from the current in-memory mapping.
+
+            normalize:
+                If True, ensure that id_a <= id_b for all edges (swapping coordinates as needed).
+
+        Returns:
+            The count of added edges
+        """
+        self._check_writable()
+
+        edges_df = edges_df.copy()
+        for col, dtype in MERGE_TABLE_DTYPE:
+            if col not in edges_df.columns:
+                edges_df[col] = 0
+            edges_df[col] = edges_df[col].astype(dtype, copy=False)
+
+        edges = edges_df[[col for col, _dtype in MERGE_TABLE_DTYPE]].to_records(index=False)
+        if normalize:
+            edges = normalize_merge_table(edges, False, None)
+        edges_df = pd.DataFrame(edges)
+
+        if 'body' in self.merge_table_df.columns:
+            edges_df['body'] = self._bodies_for_edges(edges_df['id_a'].values, edges_df['id_b'].values)
+        edges_df = edges_df[list(self.merge_table_df.columns)]
+
+        if len(edges_df) == 0:
+            return 0
+
+        with self._pending_lock:
+            self._pending_edges.append(edges_df)
+            num_pending = sum(map(len, self._pending_edges))
+
+        # Discard cached results which ought to include the new edges.
+        id_a = edges_df['id_a'].values
+        id_b = edges_df['id_b'].values
+        with self._edge_cache_main_lock:
+            self._edges_version += 1
+            for key, (supervoxels, _edges, _scores) in list(self._edge_cache.items()):
+                if (np.isin(id_a, supervoxels) & np.isin(id_b, supervoxels)).any():
+                    del self._edge_cache[key]
+
+        if num_pending > self.max_pending_edges:
+            self._start_background_merge()
+
+        return len(edges_df)
+
+
+    def merge_pending_edges(self):
+        """
+        Merge the buffered edges (from ``add_edges()``) into the main merge table.
+        The new table is constructed while extract_edges() remains free to read the old one.
+        Readers are blocked only while the new table replaces the old one.
+
+        Returns:
+            The count of merged edges
+        """
+        with self._merge_lock:
+            with self._pending_lock:
+                pending = list(self._pending_edges)
+
+            if not pending:
+                return 0
+
+            num_edges = sum(map(len, pending))
+            with Timer(f"Merging {num_edges} pending edges into the merge table", _logger):
+                new_table = pd.concat((self.merge_table_df, *pending), ignore_index=True, copy=False)
+                with self._table_rwlock.context(write=True):
+                    self.merge_table_df = new_table
+                    with self._pending_lock:
+                        del self._pending_edges[:len(pending)]
+
+        return num_edges
+
+
+    def _start_background_merge(self):
+        with self._pending_lock:
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            self._merge_thread = threading.Thread(target=self.merge_pending_edges, daemon=True)
+            self._merge_thread.start()
+
+
+    def _bodies_for_edges(self, id_a, id_b):
+        """
+        Determine the 'body' column for the given edges according to the in-memory mapping,
+        following the same conventions as apply_mapping_to_mergetable():
+        Edges whose endpoints belong to different bodies (or are unmapped) are assigned body 0.
+        """
+        if self.mapping is None or len(self.mapping) == 0:
+            return np.zeros(len(id_a), np.uint64)
+
+        svs = self.mapping.index.values
+        bodies = self.mapping.values
+        if self.mapping.index.is_monotonic_increasing:
+            def _map(ids):
+                pos = np.searchsorted(svs, ids).clip(0, len(svs)-1)
+                found = (svs[pos] == ids)
+                return np.where(found, bodies[pos], 0).astype(np.uint64)
+        else:
+            def _map(ids):
+                return self.mapping.reindex(ids, fill_value=0).values.astype(np.uint64)
+
+        body_a = _map(id_a)
+        body_b = _map(id_b)
+        body_a[body_a != body_b] = 0
+        return body_a
+
+
+    def extract_pending_rows(self, supervoxels):
+        """
+        Return the buffered edges (not yet merged into the main table)
+        whose endpoints both belong to the given set of supervoxels.
+        """
+        with self._pending_lock:
+            pending = list(self._pending_edges)
+
+        if not pending:
+            return self.merge_table_df.iloc[:0]
+
+        pending_df = pd.concat(pending, ignore_index=True)
+        keep = np.isin(pending_df['id_a'].values, supervoxels) & np.isin(pending_df['id_b'].values, supervoxels)
+        return pending_df.loc[keep]
+
+
     def extract_edges(self, server, uuid, instance, body_id, find_missing=True, *, session=None, logger=None):
         body_id = np.uint64(body_id)
         if logger is None:
             logger = _logger
 
-        domain = server.split('://')[-1]
-        server = server[:-len(domain)] + getfqdn(domain)
-        repo_uuid = find_repo_root(server, uuid)
+        server = self.canonical_server(server)
+        repo_uuid = self.find_repo_root(server, uuid)
 
         # Mutation IDs are unique, even across UUIDs,
         # so we can warm the cache for bodies in ancestor nodes,
@@ -281,8 +593,12 @@ class LabelmapMergeGraph:
         # in case the user sends several requests at once for the same body,
         # which can happen if they click faster than dvid can respond.
         with key_lock:
-            if key in self._edge_cache:
-                supervoxels, edges, scores = self._edge_cache[key]
+            with self._edge_cache_main_lock:
+                cached = self._edge_cache.get(key)
+                edges_version = self._edges_version
+
+            if cached is not None:
+                supervoxels, edges, scores = cached
                 logger.info("Returning cached edges")
                 return (mutid, supervoxels, edges, scores)
 
@@ -291,13 +607,21 @@ class LabelmapMergeGraph:
 
             # It's very fast to select rows based on the body_id,
             # so we prefer that if the mapping is already in sync with DVID.
-            svs_from_mapping = self.mapping[self.mapping == body_id].index
-            mapping_is_in_sync = (set(svs_from_mapping) == set(dvid_supervoxels))
+            # (Both lists are sorted.)
+            svs_from_mapping = self.supervoxels_for_body(body_id)
+            mapping_is_in_sync = np.array_equal(svs_from_mapping, dvid_supervoxels)
 
-            if mapping_is_in_sync:
-                subset_df = self.extract_premapped_rows(body_id)
-            else:
-                subset_df = self.extract_rows_by_sv(dvid_supervoxels)
+            with self._table_rwlock.context(write=False):
+                if mapping_is_in_sync:
+                    subset_df = self.extract_premapped_rows(body_id)
+                else:
+                    subset_df = self.extract_rows_by_sv(dvid_supervoxels)
+
+                # Include edges that haven't been merged into the main table yet.
+                pending_df = self.extract_pending_rows(dvid_supervoxels)
+
+            if len(pending_df) > 0:
+                subset_df = pd.concat((subset_df, pending_df), ignore_index=True)
 
             orig_num_cc = 0
             extra_edges = extra_scores = []
@@ -329,7 +653,10 @@ class LabelmapMergeGraph:
                 scores = np.concatenate((scores, extra_scores))
 
             # Cache before returning
+            # (unless new edges were added in the meantime).
             with self._edge_cache_main_lock:
+                if edges_version != self._edges_version:
+                    return (mutid, dvid_supervoxels, edges, scores)
                 if key in self._edge_cache:
                     del self._edge_cache[key]
                 if len(self._edge_cache) == self.max_cache_len:
@@ -340,6 +667,77 @@ class LabelmapMergeGraph:
         return (mutid, dvid_supervoxels, edges, scores)
 
 
+    def canonical_server(self, server):
+        """
+        Return the given server address with its hostname replaced
+        by the fully-qualified domain name, so that equivalent addresses
+        produce identical cache keys.
+        The result is cached for ``self.repo_info_ttl`` seconds.
+        """
+        now = time.time()
+        with self._repo_info_lock:
+            cached = self._server_names.get(server)
+        if cached is not None and now - cached[1] < self.repo_info_ttl:
+            return cached[0]
+
+        domain = server.split('://')[-1]
+        canonical = server[:-len(domain)] + getfqdn(domain)
+        with self._repo_info_lock:
+            self._server_names[server] = (canonical, now)
+        return canonical
+
+
+    def find_repo_root(self, server, uuid):
+        """
+        Return the repo root uuid for the given dvid node (or branch name).
+
+        On a cache miss, the repo info is fetched and the root is recorded
+        for every node in the repo DAG, so subsequent requests for any node
+        in the same repo need not contact DVID at all.
+        Entries expire after ``self.repo_info_ttl`` seconds.
+
+        See also: ``notify_new_node()``
+        """
+        now = time.time()
+        with self._repo_info_lock:
+            cached = self._repo_roots.get((server, uuid))
+        if cached is not None and now - cached[1] < self.repo_info_ttl:
+            return cached[0]
+
+        try:
+            repo_info = fetch_repo_info(server, uuid)
+        except Exception:
+            repo_info = fetch_repo_info(server, resolve_ref(server, uuid))
+
+        self._update_repo_roots(server, repo_info, now)
+        repo_uuid = repo_info['Root']
+        with self._repo_info_lock:
+            self._repo_roots[(server, uuid)] = (repo_uuid, now)
+        return repo_uuid
+
+
+    def notify_new_node(self, server, uuid):
+        """
+        Refresh the cached DAG info for the repo that contains the given node.
+        Should be called when a new node is created (e.g. a new commit or branch),
+        so that requests for the new node are served from the cache immediately.
+
+        Returns:
+            The repo root uuid
+        """
+        server = self.canonical_server(server)
+        repo_info = fetch_repo_info(server, uuid)
+        self._update_repo_roots(server, repo_info, time.time())
+        return repo_info['Root']
+
+
+    def _update_repo_roots(self, server, repo_info, timestamp):
+        repo_uuid = repo_info['Root']
+        with self._repo_info_lock:
+            for node_uuid in repo_info['DAG']['Nodes'].keys():
+                self._repo_roots[(server, node_uuid)] = (repo_uuid, timestamp)
+
+
     def extract_premapped_rows(self, body_id):
         body_positions_orig = (self.merge_table_df['body'] == body_id).values.nonzero()[0]
         subset_df = self.merge_table_df.iloc[body_positions_orig]
@@ -7,12 +7,11 @@ import os
 import sys
 import argparse
 import logging
-import numpy as np
 import pandas as pd
 
 from neuclease import configure_default_logging
-from neuclease.util import box_to_slicing
 from neuclease.dvid import fetch_roi, load_synapses
+from neuclease.dvid.rle import rle_ranges_union, rle_ranges_contains
 
 logger = logging.getLogger(__name__)
 
@@ -57,40 +56,15 @@ def check_in_rois(server, uuid, synapse_df, rois):
     num_bodies = len(pd.unique(synapse_df['body']))
     logging.info(f"Checking in {len(rois)} ROIs for {len(synapse_df)} synapses from {num_bodies} bodies")
     
-    masks_and_boxes = []
-    for roi in rois:
-        logger.info(f"Fetching ROI '{roi}'")
-        mask, box = fetch_roi(server, uuid, roi, format='mask')
-        masks_and_boxes.append((mask, box))
-    
-    _masks, boxes = zip(*masks_and_boxes)
-    boxes = np.array(boxes)
-    
-    # box/shape is in scale-5 coordinates
-    logger.info("Combining ROIs into a single mask")
-    combined_box = (boxes[:,0,:].min(axis=0), boxes[:,1,:].max(axis=0))
-    combined_shape = (combined_box[1] - combined_box[0])
-    combined_mask = np.zeros(combined_shape, dtype=bool)
-    
-    for mask, box in masks_and_boxes:
-        offset_box = box - combined_box[0]
-        combined_mask[box_to_slicing(*offset_box)] |= mask
-
-    # Rescale points to scale 5 (ROIs are given at scale 5)
-    logger.info("Scaling points")
-    downsampled_coords_zyx = synapse_df[['z', 'y', 'x']] // (2**5)
-
-    # Drop everything outside the combined_box
-    logger.info("Excluding OOB points")
-    min_z, min_y, min_x = combined_box[0] #@UnusedVariable
-    max_z, max_y, max_x = combined_box[1] #@UnusedVariable
-    q = 'z >= @min_z and y >= @min_y and x >= @min_x and z < @max_z and y < @max_y and x < @max_x'
-    downsampled_coords_zyx.query(q, inplace=True)
+    logger.info("Fetching ROIs")
+    roi_ranges = [fetch_roi(server, uuid, roi, format='ranges') for roi in rois]
+    combined_ranges = rle_ranges_union(*roi_ranges)
 
-    logging.info("Extracting mask values")
-    synapse_df['in_roi'] = False
-    downsampled_coords_zyx -= combined_box[0]
-    synapse_df.loc[downsampled_coords_zyx.index, 'in_roi'] = combined_mask[tuple(downsampled_coords_zyx.values.transpose())]
+    # Rescale points to scale 5 (ROIs are given at scale 5),
+    # and look them up directly in the (combined) RLE ranges.
+    logger.info("Checking points against ROI ranges")
+    downsampled_coords_zyx = synapse_df[['z', 'y', 'x']].values // (2**5)
+    synapse_df['in_roi'] = rle_ranges_contains(combined_ranges, downsampled_coords_zyx, assume_normalized=True)
 
     roi_synapses = synapse_df['in_roi'].sum()
     roi_bodies = len(pd.unique(synapse_df['body'][synapse_df['in_roi']]))
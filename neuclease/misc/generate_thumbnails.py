@@ -36,10 +36,10 @@ def generate_roi_thumbnail(seg_instance, background_roi):
     return roi_thumbnail
 
 
-def generate_body_thumbnail(seg_instance, body, roi_thumbnail, final_scale=7, format='rgb', neuron_color=[255,255,0], roi_color=[100,100,100]):
+def generate_body_thumbnail(seg_instance, body, roi_thumbnail, final_scale=7, format='rgb', neuron_color=[255,255,0], roi_color=[100,100,100], svc_cache=False):
     assert final_scale >= 6
     
-    mask, _mask_box = fetch_sparsevol_coarse(*seg_instance, body, format='mask', mask_box=[(0,0,0), roi_thumbnail])
+    mask, _mask_box = fetch_sparsevol_coarse(*seg_instance, body, format='mask', mask_box=[(0,0,0), roi_thumbnail], cache=svc_cache)
 
     # Project through Y
     mask_thumbnail = np.logical_or.reduce(mask, axis=1)
@@ -70,12 +70,12 @@ def generate_body_thumbnail(seg_instance, body, roi_thumbnail, final_scale=7, fo
         return rgb_thumbnail
 
 
-def thumbnail_batch(seg_instance, roi_thumbnail, final_scale, output_dir, bodies, neuron_color=[255,255,0], roi_color=[100,100,100]):
+def thumbnail_batch(seg_instance, roi_thumbnail, final_scale, output_dir, bodies, neuron_color=[255,255,0], roi_color=[100,100,100], svc_cache=False):
     bad_bodies = []
     for body in bodies:
         try:
             rgb = generate_body_thumbnail(seg_instance, body, roi_thumbnail, final_scale,
-                                          format='rgb', neuron_color=neuron_color, roi_color=roi_color)
+                                          format='rgb', neuron_color=neuron_color, roi_color=roi_color, svc_cache=svc_cache)
         except Exception:
             bad_bodies.append(body)
             continue
@@ -86,7 +86,7 @@ def thumbnail_batch(seg_instance, roi_thumbnail, final_scale, output_dir, bodies
 
 def generate_traced_body_thumbnails(npclient, seg_instance, background_roi, final_scale,
                                     output_dir, neuron_color=[255,255,0], roi_color=[100,100,100],
-                                    processes=32):
+                                    processes=32, svc_cache=False):
     traced_statuses = ["Leaves", "Prelim Roughly traced", "Roughly traced", "Traced"]
 
     q = f"""\
@@ -100,7 +100,7 @@ def generate_traced_body_thumbnails(npclient, seg_instance, background_roi, fina
     body_batches = iter_batches(traced_bodies, batch_size)
 
     roi_thumbnail = generate_roi_thumbnail(seg_instance, background_roi)
-    batch_fn = partial(thumbnail_batch, roi_thumbnail, final_scale, output_dir, neuron_color=neuron_color, roi_color=roi_color)
+    batch_fn = partial(thumbnail_batch, roi_thumbnail, final_scale, output_dir, neuron_color=neuron_color, roi_color=roi_color, svc_cache=svc_cache)
     bad_bodies = compute_parallel(batch_fn, body_batches, processes=processes, ordered=False)
     bad_bodies = [*chain(*bad_bodies)]
     return bad_bodies
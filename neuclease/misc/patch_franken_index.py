@@ -12,7 +12,7 @@ import numpy as np
 import pandas as pd
 
 from neuclease import configure_default_logging
-from neuclease.dvid import fetch_repo_info, fetch_labelindex, convert_labelindex_to_pandas, PandasLabelIndex, create_labelindex, post_labelindex, post_mappings
+from neuclease.dvid import fetch_repo_info, fetch_labelindex, convert_labelindex_to_pandas, PandasLabelIndex, encode_labelindex_bytes, post_labelindex, post_mappings
 from neuclease.util import Timer
 
 # This script patches exactly one "franken-supervoxel"
@@ -81,7 +81,7 @@ def main():
         last_mutid = fetch_repo_info(*seg_instance[:2])["MutationID"]
         mod_time = datetime.datetime.now().isoformat()
         new_li = PandasLabelIndex(new_df, FRANKENBODY_SV, last_mutid, mod_time, os.environ.get("USER", "unknown"))
-        new_labelindex = create_labelindex(new_li)
+        new_labelindex = encode_labelindex_bytes(new_li)
 
     with Timer("Posting new labelindex", logger):
         post_labelindex(*seg_instance, FRANKENBODY_SV, new_labelindex)
@@ -48,7 +48,10 @@ import json
 import logging
 import argparse
 import urllib.parse
+from functools import partial
+from itertools import chain, starmap
 from textwrap import dedent
+from collections import namedtuple
 from collections.abc import Iterable
 
 import numpy as np
@@ -61,10 +64,12 @@ from vol2mesh import Mesh
 from confiddler import load_config, dump_default_config
 
 from neuclease import configure_default_logging
-from neuclease.util import round_box, box_to_slicing as b2s, tqdm_proxy, swc_to_dataframe, mask_centroid, sphere_mask
-from neuclease.dvid import (post_key, determine_point_rois, fetch_sparsevol, fetch_roi_roi,
+from neuclease.util import (round_box, box_to_slicing as b2s, box_intersection, ndrange_array, tqdm_proxy,
+                            iter_batches, compute_parallel, swc_to_dataframe, mask_centroid, sphere_mask)
+from neuclease.dvid import (post_key, post_keyvalues, determine_point_rois, fetch_sparsevol, fetch_roi_roi,
                             runlength_encode_mask_to_ranges, fetch_volume_box, fetch_instance_info,
                             fetch_annotation_label, fetch_labelmap_voxels, post_labelmap_voxels,
+                            fetch_labelmap_specificblocks, post_labelmap_blocks,
                             create_labelmap_instance, fetch_key, create_instance)
 
 logger = logging.getLogger(__name__)
@@ -149,12 +154,23 @@ ConfigSchema = {
 }
 
 
-def write_point_neighborhoods(seg_src, seg_dst, points_zyx, radius=125, src_bodies=None, dst_bodies=None):
+def write_point_neighborhoods(seg_src, seg_dst, points_zyx, radius=125, src_bodies=None, dst_bodies=None,
+                              *, processes=0, batch_size=32, mesh_batch_size=100):
     """
     For each point in the given list, create a mask of the portion
     of a particular body that falls within a given distance of the
     point.
 
+    The points are processed in spatially coherent batches:
+
+      - Points that fall within the same 64px block share a single
+        fetch of the source segmentation.
+      - The masks and meshes are generated in a process pool.
+      - The destination writes for each batch are merged per block,
+        so each block is fetched and posted only once per batch
+        (and blocks that the neighborhoods don't touch aren't posted at all).
+      - The meshes are posted via ``post_keyvalues()``, in batches.
+
     Args:
         seg_src:
             tuple (server, uuid, instance) specifying where to fetch neuron segmentation from.
@@ -178,33 +194,79 @@ def write_point_neighborhoods(seg_src, seg_dst, points_zyx, radius=125, src_bodi
             Note that the default formula does not take the source body into account,
             so if there are duplicate points provided in points_zyx, the destination body IDs will
             be duplicated too, unless you supply your own destination body IDs here.
+        processes:
+            How many processes to use for generating the neighborhood masks and meshes.
+            If 0, everything is computed in the calling process.
+        batch_size:
+            Approximately how many points to process before writing
+            the results to the destination.  The destination blocks for
+            each batch are held in RAM (up to ~2 MB per block), so
+            don't make this too large if the radius is large.
+        mesh_batch_size:
+            How many meshes to send to DVID per request.
 
     Returns:
         In addition to writing the neighborhood segments to the seg_dst instance,
         this function returns a dataframe with basic stats about the neighborhoods
         that were written.
+
+    Note:
+        Within a batch, overlapping neighborhoods are written in the order of the
+        input list (later points overwrite earlier ones), as if each point were
+        processed individually.  But the batches are ordered spatially, so that
+        isn't guaranteed for overlapping neighborhoods in different batches.
     """
     if isinstance(points_zyx, pd.DataFrame):
         points_zyx = points_zyx[[*'zyx']].values
     else:
         points_zyx = np.asarray(points_zyx)
 
+    if not isinstance(src_bodies, Iterable):
+        src_bodies = [src_bodies]*len(points_zyx)
+    if not isinstance(dst_bodies, Iterable):
+        dst_bodies = [dst_bodies]*len(points_zyx)
+    src_bodies = np.array(src_bodies, object)
+    dst_bodies = np.array(dst_bodies, object)
+
+    # Group the points by block, and arrange the groups into batches.
+    block_df = pd.DataFrame(points_zyx // 64, columns=[*'zyx'])
+    block_df['i'] = np.arange(len(points_zyx))
+    groups = [g['i'].values for _, g in block_df.groupby([*'zyx'], sort=True)]
+
+    batches = [[]]
+    batch_points = 0
+    for group in groups:
+        if batch_points >= batch_size:
+            batches.append([])
+            batch_points = 0
+        batches[-1].append(group)
+        batch_points += len(group)
+
+    gen_neighborhoods = partial(_generate_neighborhoods, seg_src, radius)
+
     results = []
-    for i, point in enumerate(tqdm_proxy(points_zyx)):
-        if isinstance(src_bodies, Iterable):
-            src_body = src_bodies[i]
+    progress = tqdm_proxy(total=len(points_zyx))
+    for batch_groups in batches:
+        args = [(g, points_zyx[g], src_bodies[g], dst_bodies[g]) for g in batch_groups]
+        if processes == 0:
+            group_neighborhoods = [*starmap(gen_neighborhoods, args)]
         else:
-            src_body = src_bodies
+            group_neighborhoods = compute_parallel(gen_neighborhoods, args, starmap=True, processes=processes,
+                                                   ordered=False, show_progress=False)
 
-        if isinstance(dst_bodies, Iterable):
-            dst_body = dst_bodies[i]
-        else:
-            dst_body = dst_bodies
+        neighborhoods = sorted(chain(*group_neighborhoods), key=lambda n: n.index)
+        _write_neighborhood_voxels(seg_dst, neighborhoods, radius)
+
+        meshes = {f'{n.dst_body}.ngmesh': n.mesh for n in neighborhoods}
+        for mesh_batch in iter_batches([*meshes.items()], mesh_batch_size):
+            post_keyvalues(*seg_dst[:2], f'{seg_dst[2]}_meshes', dict(mesh_batch), show_progress=False)
 
-        point, centroid, top_point, src_body, dst_body, dst_voxels = \
-            process_point(seg_src, seg_dst, point, radius, src_body, dst_body)
+        for n in neighborhoods:
+            results.append((n.index, *n.point, *n.centroid, *n.top_point, n.src_body, n.dst_body, n.dst_voxels))
+        progress.update(len(neighborhoods))
+    progress.close()
 
-        results.append( (*point, *centroid, *top_point, src_body, dst_body, dst_voxels) )
+    results = [r[1:] for r in sorted(results)]
 
     cols = ['z', 'y', 'x']
     cols += ['cz', 'cy', 'cx']
@@ -213,15 +275,111 @@ def write_point_neighborhoods(seg_src, seg_dst, points_zyx, radius=125, src_bodi
     return pd.DataFrame(results, columns=cols)
 
 
+_Neighborhood = namedtuple('_Neighborhood', 'index point src_body dst_body packed_mask mesh centroid top_point dst_voxels')
+
+
+def _generate_neighborhoods(seg_src, radius, indexes, points, src_bodies, dst_bodies):
+    """
+    Generate the neighborhood masks and meshes for a group of nearby points,
+    using a single fetch of the source segmentation for the whole group.
+
+    The masks are returned in packed form (see ``np.packbits()``),
+    to reduce the cost of sending them back from a worker process.
+    """
+    r = radius
+    point_boxes = np.array([(p - r, p + r + 1) for p in points])
+    group_box = (point_boxes[:, 0].min(axis=0), point_boxes[:, 1].max(axis=0))
+    group_box = round_box(group_box, 64, 'out')
+    group_vol = fetch_labelmap_voxels(*seg_src, group_box)
+    sphere = sphere_mask(r)
+
+    neighborhoods = []
+    for i, point, src_box, src_body, dst_body in zip(indexes, points, point_boxes, src_bodies, dst_bodies):
+        src_vol = group_vol[b2s(*(src_box - group_box[0]))]
+        mask, mesh, centroid, top_point, src_body, dst_body = \
+            _neighborhood_mask_and_mesh(point, src_box, src_vol, sphere, src_body, dst_body)
+
+        neighborhoods.append(
+            _Neighborhood(i, point, src_body, dst_body, np.packbits(mask),
+                          mesh.serialize(fmt='ngmesh'), centroid, top_point, mask.sum()))
+    return neighborhoods
+
+
+def _write_neighborhood_voxels(seg_dst, neighborhoods, radius):
+    """
+    Write the given neighborhood masks into the destination segmentation.
+    Each destination block is fetched and posted (with downres) only once,
+    no matter how many of the neighborhoods it overlaps.
+    """
+    r = radius
+    mask_shape = (2*r + 1,)*3
+
+    # Determine which blocks each neighborhood actually touches.
+    masks = []
+    all_corners = set()
+    for n in neighborhoods:
+        mask = np.unpackbits(n.packed_mask, count=np.prod(mask_shape)).view(bool).reshape(mask_shape)
+        src_box = np.array((n.point - r, n.point + r + 1))
+        corners = []
+        for corner in ndrange_array(*round_box(src_box, 64, 'out'), 64):
+            block_box = box_intersection((corner, corner + 64), src_box)
+            if mask[b2s(*(block_box - src_box[0]))].any():
+                corners.append(corner)
+        masks.append((n.dst_body, src_box, mask, corners))
+        all_corners |= {*map(tuple, corners)}
+
+    if not all_corners:
+        return
+
+    # Blocks that don't exist yet are omitted from the response.
+    all_corners = np.array(sorted(all_corners))
+    blocks = fetch_labelmap_specificblocks(*seg_dst, all_corners, supervoxels=True, format='blocks')
+    for corner in map(tuple, all_corners):
+        if corner not in blocks:
+            blocks[corner] = np.zeros((64,64,64), np.uint64)
+
+    for dst_body, src_box, mask, corners in masks:
+        for corner in corners:
+            block_box = box_intersection((corner, corner + 64), src_box)
+            block = blocks[tuple(corner)]
+            block[b2s(*(block_box - corner))][mask[b2s(*(block_box - src_box[0]))]] = dst_body
+
+    corners = np.array([*blocks.keys()])
+    post_labelmap_blocks(*seg_dst, corners, [*blocks.values()], downres=True)
+
+
 def process_point(seg_src, seg_dst, point, radius, src_body, dst_body):
     """
     Generate a neighborhood segment around a particular point.
     Upload the voxels for the segment and the corresponding mesh.
+
+    (For many points, ``write_point_neighborhoods()`` is much faster.)
     """
     r = radius
     src_box = np.asarray(( point - r, point + r + 1 ))
     src_vol = fetch_labelmap_voxels(*seg_src, src_box)
 
+    mask, mesh, centroid, top_point, src_body, dst_body = \
+        _neighborhood_mask_and_mesh(point, src_box, src_vol, sphere_mask(r), src_body, dst_body)
+
+    dst_box = round_box(src_box, 64, 'out')
+    dst_vol = fetch_labelmap_voxels(*seg_dst, dst_box)
+
+    dst_view = dst_vol[b2s(*(src_box - dst_box[0]))]
+    dst_view[mask] = dst_body
+
+    post_labelmap_voxels(*seg_dst, dst_box[0], dst_vol, downres=True)
+    post_key(*seg_dst[:2], f'{seg_dst[2]}_meshes', f'{dst_body}.ngmesh', mesh.serialize(fmt='ngmesh'))
+
+    return point, centroid, top_point, src_body, dst_body, mask.sum()
+
+
+def _neighborhood_mask_and_mesh(point, src_box, src_vol, sphere, src_body, dst_body):
+    """
+    Compute the neighborhood mask for a point (given its source segmentation),
+    along with its mesh and some basic stats.
+    """
+    r = sphere.shape[0] // 2
     if src_body is None:
         src_body = src_vol[r,r,r]
 
@@ -232,27 +390,18 @@ def process_point(seg_src, seg_dst, point, radius, src_body, dst_body):
         # the coordinate, but that's usually OK for our purposes.)
         dst_body = encode_point_to_uint64(point // 4, 17)
 
-    mask = (src_vol == src_body) & sphere_mask(r)
-
-    dst_box = round_box(src_box, 64, 'out')
-    dst_vol = fetch_labelmap_voxels(*seg_dst, dst_box)
-
-    dst_view = dst_vol[b2s(*(src_box - dst_box[0]))]
-    dst_view[mask] = dst_body
-
-    post_labelmap_voxels(*seg_dst, dst_box[0], dst_vol, downres=True)
+    mask = (src_vol == src_body) & sphere
 
     # Mesh needs to be written in nm, hence 8x
     mesh = Mesh.from_binary_vol(mask, 8*src_box, smoothing_rounds=2)
     mesh.simplify(0.05, in_memory=True)
-    post_key(*seg_dst[:2], f'{seg_dst[2]}_meshes', f'{dst_body}.ngmesh', mesh.serialize(fmt='ngmesh'))
 
     centroid = src_box[0] + mask_centroid(mask, True)
     top_z = mask.sum(axis=(1,2)).nonzero()[0][0]
     top_coords = np.transpose(mask[top_z].nonzero())
     top_point = src_box[0] + (top_z, *top_coords[len(top_coords)//2])
 
-    return point, centroid, top_point, src_body, dst_body, mask.sum()
+    return mask, mesh, centroid, top_point, src_body, dst_body
 
 
 def encode_point_to_uint64(point_zyx, bitwidth):
@@ -676,6 +825,8 @@ def main():
     parser.add_argument('--ng-links', '-n', action='store_true',
                         help='If given, include neuroglancer links in the output CSV.'
                              'Your config should specify the basic neuroglancer view settings; only the "position" will be overwritten in each link.')
+    parser.add_argument('--processes', '-j', type=int, default=8,
+                        help='How many processes to use for generating neighborhood masks and meshes.')
     parser.add_argument('config')
     args = parser.parse_args()
 
@@ -772,7 +923,7 @@ def main():
         # Also create keyvalue for meshes
         create_instance(*output_seg[:2], output_seg[2] + '_meshes', 'keyvalue')
 
-    results_df = write_point_neighborhoods(input_seg, output_seg, points, radius, args.body)
+    results_df = write_point_neighborhoods(input_seg, output_seg, points, radius, args.body, processes=args.processes)
 
     add_link_col(results_df, config)
     export_as_html(results_df, csv_path)
@@ -6,7 +6,7 @@ import numpy as np
 import pandas as pd
 
 from neuclease.util import Timer, Grid, boxes_from_grid, compute_parallel
-from neuclease.dvid import find_master, fetch_labelmap_voxels, fetch_mapping, fetch_labelindex, create_labelindex, post_labelindex
+from neuclease.dvid import find_master, fetch_labelmap_voxels, fetch_mapping, fetch_labelindex, post_labelindex
 
 from neuclease import configure_default_logging
 configure_default_logging()
@@ -50,8 +50,7 @@ def _repair_index(master_seg, body):
     # there isn't supposed to be segmentation in that region.)
     pli.blocks.query('z >= 1024 and y >= 1024 and x >= 1024', inplace=True)
     
-    li = create_labelindex(pli)
-    post_labelindex(*master_seg, pli.label, li)
+    post_labelindex(*master_seg, pli.label, pli)
 
 
 if __name__ == "__main__":
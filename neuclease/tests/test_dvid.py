@@ -1,7 +1,9 @@
 """
 Test module for the dvid API wrapper functions defined in neuclease.dvid
 """
+import os
 import sys
+import gzip
 import time
 import logging
 import datetime
@@ -11,21 +13,30 @@ import pytest
 import numpy as np
 import pandas as pd
 
-from libdvid import DVIDNodeService
+from libdvid import DVIDNodeService, encode_label_block
 
 from neuclease.dvid import (dvid_api_wrapper, DvidInstanceInfo, fetch_supervoxels, fetch_supervoxel_sizes_for_body,
                             fetch_label, fetch_labels, fetch_labels_batched, fetch_mappings, fetch_complete_mappings, post_mappings,
+                            block_sorted_order, encode_coords_json, parse_json_uint64_list,
+                            fetch_labels_via_blocks, LabelBlockCache, parse_label_block, sample_label_block,
+                            complete_mapping_from_arrays, iter_complete_mapping_chunks,
                             fetch_mutation_id, generate_sample_coordinate, fetch_labelmap_voxels, fetch_labelmap_voxels_chunkwise,
                             post_labelmap_blocks, post_labelmap_voxels,
                             encode_labelarray_volume, encode_nonaligned_labelarray_volume, fetch_raw, post_raw,
                             fetch_labelindex, post_labelindex, fetch_labelindices, create_labelindex, PandasLabelIndex,
-                            copy_labelindices,
+                            copy_labelindices, decode_labelindex_bytes, decode_labelindices_bytes, decode_labelindex_blocks,
+                            encode_labelindex_bytes, encode_labelindices_bytes, encode_block_coords,
                             fetch_maxlabel, post_maxlabel, fetch_nextlabel, post_nextlabel, create_labelmap_instance,
                             post_merge, fetch_sparsevol_coarse, fetch_sparsevol_coarse_via_labelindex, post_branch,
-                            post_hierarchical_cleaves, fetch_mapping, fetch_mutations, post_commit, post_newversion)
+                            post_hierarchical_cleaves, fetch_mapping, fetch_mutations, post_commit, post_newversion,
+                            fetch_sparsevol, iter_sparsevols, load_sparsevol_store, SparsevolCoarseCache,
+                            fetch_cached_mappings, MutationLog, fetch_supervoxel_splits_from_kafka,
+                            SplitEvent, split_events_to_table, split_events_to_mapping, resolve_split_roots,
+                            create_instance, post_roi, fetch_combined_roi_volume, determine_point_rois)
 
 from neuclease.dvid._dvid import default_dvid_session
-from neuclease.util import box_to_slicing, extract_subvol, ndrange
+from neuclease.dvid.labelmap.labelops_pb2 import LabelIndex, LabelIndices
+from neuclease.util import box_to_slicing, extract_subvol, ndrange, ndrange_array, DEFAULT_TIMESTAMP
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -135,6 +146,118 @@ def test_fetch_labels_batched(labelmap_setup):
     assert (labels == [1,1,1,2,2,2]).all() # See init_labelmap_nodes() in conftest.py
 
 
+def test_fetch_labels_via_blocks(labelmap_setup):
+    dvid_server, dvid_repo, _merge_table_path, _mapping_path, _supervoxel_vol = labelmap_setup
+    instance_info = DvidInstanceInfo(dvid_server, dvid_repo, 'segmentation')
+
+    coords = np.random.randint(0, 128, size=(1000, 3))
+    coords[:6] = [[0,0,0], [0,0,1], [0,0,2], [0,0,3], [0,0,4], [0,0,4]]
+
+    for supervoxels in (False, True):
+        expected = fetch_labels(*instance_info, coords, supervoxels=supervoxels)
+
+        cache = LabelBlockCache()
+        labels = fetch_labels_via_blocks(*instance_info, coords, supervoxels=supervoxels, cache=cache, blocks_per_request=2)
+        assert labels.dtype == np.uint64
+        assert (labels == expected).all()
+        assert len(cache) > 0
+
+        # Second call is served entirely from the cache
+        labels = fetch_labels_batched(*instance_info, coords, supervoxels, engine='blocks', block_cache=cache, threads=2)
+        assert (labels == expected).all()
+
+
+def test_sample_label_block():
+    block = np.random.randint(1, 4, size=(64,64,64)).astype(np.uint64)
+    block[:32, :32, :32] = np.random.randint(1, 1000, size=(32,32,32))
+    block[:8, :8, :8] = 0
+    block[8:16, :8, :8] = 2**63 + 1
+
+    points = np.random.randint(0, 64, size=(10_000, 3))
+
+    encoded = encode_label_block(block)
+    for data in (encoded, gzip.compress(encoded)):
+        labels = sample_label_block(parse_label_block(data), points)
+        assert labels.dtype == np.uint64
+        assert (labels == block[tuple(points.T)]).all()
+
+    solid = np.full((64,64,64), 7, np.uint64)
+    assert (sample_label_block(parse_label_block(encode_label_block(solid)), points) == 7).all()
+
+
+def test_fetch_labels_encoding():
+    """
+    Check the client-side helpers used by fetch_labels()
+    against the plain json approach.
+    (No DVID server required.)
+    """
+    import json
+    coords_zyx = np.random.randint(-1000, 100_000, size=(1000, 3)).astype(np.int32)
+    labels = np.random.randint(0, 2**63, size=1000, dtype=np.uint64)
+    labels[:3] = [0, 1, 2**64-1]
+
+    payload = encode_coords_json(coords_zyx[:, ::-1])
+    assert json.loads(payload) == coords_zyx[:, ::-1].tolist()
+
+    assert parse_json_uint64_list(b'[]').tolist() == []
+    assert parse_json_uint64_list(b'[ 1, 2,\n3]\n').tolist() == [1, 2, 3]
+
+    parsed_labels = parse_json_uint64_list(json.dumps(labels.tolist()).encode('utf-8'))
+    assert parsed_labels.dtype == np.uint64
+    assert (parsed_labels == labels).all()
+
+    # Points are grouped by block, and the blocks are sorted.
+    order = block_sorted_order(coords_zyx)
+    assert sorted(order.tolist()) == list(range(len(coords_zyx)))
+    block_coords = coords_zyx[order] // 64
+    assert (np.diff(block_coords[:, 0]) >= 0).all()
+    assert (np.diff(np.unique(block_coords, axis=0, return_index=True)[1]) > 0).all()
+
+
+@pytest.mark.skipif(not os.environ.get('NEUCLEASE_BENCHMARKS'),
+                    reason="Set NEUCLEASE_BENCHMARKS=1 to run benchmarks")
+def test_fetch_labels_encoding_benchmark():
+    """
+    Microbenchmark for the client-side work in fetch_labels():
+    encoding 1M coordinates and parsing 1M labels,
+    compared with the plain json approach.
+    (No DVID server required.)
+    """
+    import json
+    coords_zyx = np.random.randint(-1000, 100_000, size=(1_000_000, 3)).astype(np.int32)
+    labels = np.random.randint(0, 2**63, size=1_000_000, dtype=np.uint64)
+
+    start = time.time()
+    expected_payload = json.dumps(coords_zyx[:, ::-1].tolist())
+    old_encode = time.time() - start
+
+    start = time.time()
+    block_sorted_order(coords_zyx)
+    sort_time = time.time() - start
+
+    start = time.time()
+    payload = encode_coords_json(coords_zyx[:, ::-1])
+    new_encode = time.time() - start
+    assert json.loads(payload) == json.loads(expected_payload)
+
+    # Compile the parser before it is timed below.
+    parse_json_uint64_list(b'[]')
+
+    response = json.dumps(labels.tolist()).encode('utf-8')
+
+    start = time.time()
+    expected_labels = np.array(json.loads(response), np.uint64)
+    old_parse = time.time() - start
+
+    start = time.time()
+    parsed_labels = parse_json_uint64_list(response)
+    new_parse = time.time() - start
+    assert (parsed_labels == expected_labels).all()
+
+    print(f"\n1M points: encode {old_encode:.2f}s -> {new_encode:.2f}s, "
+          f"parse {old_parse:.2f}s -> {new_parse:.2f}s, block sort {sort_time:.2f}s")
+
+
 def test_fetch_mappings(labelmap_setup):
     """
     Test the wrapper function for the /mappings DVID API.
@@ -150,6 +273,65 @@ def test_fetch_mappings(labelmap_setup):
     assert (mapping == 1).all() # see initialization in conftest.py
 
 
+def test_fetch_mappings_encoded_response():
+    """
+    The binary /mappings response is decoded correctly even if
+    the server compresses it, in which case its Content-Length
+    doesn't match the size of the (decoded) mapping.
+    """
+    import io
+    import requests
+    import urllib3
+
+    mapping = np.array([[10, 1], [11, 1], [12, 2]], np.uint64)
+
+    class FakeSession:
+        def __init__(self, body, headers):
+            self.body = body
+            self.headers = headers
+
+        def get(self, url, stream=False, **kwargs):
+            raw = urllib3.HTTPResponse(io.BytesIO(self.body), headers=self.headers, status=200,
+                                       preload_content=False, decode_content=True)
+            return requests.adapters.HTTPAdapter().build_response(requests.Request('GET', url).prepare(), raw)
+
+    for body, encoding in [(mapping.tobytes(), None), (gzip.compress(mapping.tobytes()), 'gzip')]:
+        headers = {'Content-Length': str(len(body))}
+        if encoding:
+            headers['Content-Encoding'] = encoding
+
+        session = FakeSession(body, headers)
+        a = fetch_mappings('http://fake-server', 'abc123', 'segmentation', as_array=True, format='binary', session=session)
+        assert a.flags.writeable
+        assert (a == mapping).all()
+
+
+def test_fetch_mapping(labelmap_setup):
+    """
+    Test fetch_mapping() with duplicate supervoxels, batches, and a local cache.
+    """
+    dvid_server, dvid_repo, _merge_table_path, _mapping_path, _supervoxel_vol = labelmap_setup
+    instance_info = DvidInstanceInfo(dvid_server, dvid_repo, 'segmentation')
+
+    svs = [5,4,3,2,1,1,2,3,4,5]
+    mapping = fetch_mapping(*instance_info, svs, as_series=True)
+    assert mapping.index.name == 'sv'
+    assert mapping.name == 'body'
+    assert (mapping.index == svs).all()
+    assert (mapping == 1).all() # see initialization in conftest.py
+
+    assert (fetch_mapping(*instance_info, svs, batch_size=2, threads=2) == 1).all()
+    assert len(fetch_mapping(*instance_info, [])) == 0
+
+    # Cached svs aren't fetched from DVID
+    cache = pd.Series([10, 20], index=np.array([2, 3], np.uint64))
+    bodies = fetch_mapping(*instance_info, svs, cache=cache)
+    assert (bodies == [1,1,20,10,1,1,10,20,1,1]).all()
+
+    cache_array = np.array([[2, 10], [3, 20]], np.uint64)
+    assert (fetch_mapping(*instance_info, svs, cache=cache_array) == bodies).all()
+
+
 def test_post_mappings(labelmap_setup):
     """
     Test the wrapper function for the /mappings DVID API.
@@ -214,6 +396,123 @@ def test_fetch_complete_mappings(labelmap_setup):
     assert (mapping == 1).all() # see initialization in conftest.py
 
 
+def test_complete_mapping_from_arrays():
+    """
+    Compare the array-based construction of the complete mapping
+    against a straightforward set-based construction.
+    """
+    base_mapping = np.array([[10, 1], [11, 1], [12, 2], [13, 5], [14, 5], [15, 7], [16, 8], [17, 9]], np.uint64)
+    retired_svs = [14, 20, 5]
+    cleave_fragments = [9]
+
+    def expected_mapping(include_retired):
+        mapping = dict(base_mapping.tolist())
+        base_bodies = set(base_mapping[:, 1].tolist())
+        for body in base_bodies - set(mapping.keys()) - set(retired_svs) - set(cleave_fragments):
+            mapping[body] = body
+        for sv in retired_svs:
+            if include_retired:
+                mapping[sv] = 0
+            else:
+                mapping.pop(sv, None)
+        return pd.Series(mapping).sort_index()
+
+    for include_retired in (True, False):
+        expected = expected_mapping(include_retired)
+
+        # Shuffle the input rows, since DVID returns them in arbitrary order.
+        shuffled = base_mapping[np.random.permutation(len(base_mapping))]
+        mapping = complete_mapping_from_arrays(shuffled, retired_svs, cleave_fragments, include_retired)
+        assert mapping.index.name == 'sv'
+        assert mapping.name == 'body'
+        assert mapping.index.dtype == mapping.dtype == np.uint64
+        assert mapping.index.tolist() == expected.index.tolist()
+        assert mapping.tolist() == expected.tolist()
+
+        chunks = list(iter_complete_mapping_chunks(base_mapping.copy(), retired_svs, cleave_fragments, include_retired, 3))
+        assert max(map(len, chunks)) == 3
+        assert pd.concat(chunks).index.tolist() == expected.index.tolist()
+        assert pd.concat(chunks).tolist() == expected.tolist()
+
+    mapping = complete_mapping_from_arrays(base_mapping.copy(), retired_svs, cleave_fragments, sort='body')
+    assert (np.diff(mapping.values.astype(np.int64)) >= 0).all()
+
+
+def test_complete_mapping_from_arrays_duplicates():
+    """
+    If the base mapping lists a supervoxel more than once,
+    the last row for that supervoxel is used, regardless of
+    where the duplicate rows end up after sorting.
+    """
+    rng = np.random.default_rng(0)
+    svs = np.arange(1, 1001, dtype=np.uint64)
+    base_mapping = np.array([svs, svs // 10 + 2000]).transpose()
+
+    # Every third supervoxel is listed a few more times, with different bodies.
+    dupes = [np.array([svs[::3], np.full(len(svs[::3]), 3000 + i, np.uint64)]).transpose() for i in range(3)]
+    base_mapping = np.concatenate((base_mapping, *dupes))
+    base_mapping = base_mapping[rng.permutation(len(base_mapping))]
+
+    expected = pd.Series(dict(base_mapping.tolist()))
+    expected = expected.loc[svs]
+
+    mapping = complete_mapping_from_arrays(base_mapping.copy(), [], [])
+    assert mapping.loc[svs].tolist() == expected.tolist()
+
+
+@pytest.mark.skipif(not os.environ.get('NEUCLEASE_BENCHMARKS'),
+                    reason="Set NEUCLEASE_BENCHMARKS=1 to run benchmarks")
+def test_complete_mapping_benchmark():
+    """
+    Report the wall time and peak RSS (above the input mapping) of
+    complete_mapping_from_arrays() for a synthetic mapping.
+    The default size is modest; set NEUCLEASE_BENCHMARK_MAPPING_ROWS
+    (e.g. to 500_000_000) for a full-scale benchmark.
+    """
+    import resource
+    import multiprocessing
+
+    num_rows = int(os.environ.get('NEUCLEASE_BENCHMARK_MAPPING_ROWS', 10_000_000))
+
+    def current_rss():
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+
+    def run_benchmark(queue):
+        rng = np.random.default_rng(0)
+        base_mapping = np.empty((num_rows, 2), np.uint64)
+        base_mapping[:, 0] = np.arange(1, num_rows+1, dtype=np.uint64) * 3
+        rng.shuffle(base_mapping[:, 0])
+        base_mapping[:, 1] = base_mapping[rng.integers(0, num_rows, num_rows) // 16 * 16, 0]
+        retired_svs = rng.integers(1, 3*num_rows, num_rows // 1000).astype(np.uint64)
+        cleave_fragments = base_mapping[:100, 1].copy()
+
+        rss_before = current_rss()
+        start = time.time()
+        mapping = complete_mapping_from_arrays(base_mapping, retired_svs, cleave_fragments)
+        elapsed = time.time() - start
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        queue.put((elapsed, peak_rss - rss_before, len(mapping)))
+
+    # Run in a child process, so the peak RSS is not polluted by other tests.
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    p = ctx.Process(target=run_benchmark, args=(queue,))
+    p.start()
+    try:
+        elapsed, peak_increase, result_rows = queue.get(timeout=3600)
+    finally:
+        p.join(10)
+        if p.is_alive():
+            p.terminate()
+    assert p.exitcode == 0
+
+    assert result_rows >= num_rows
+    input_gib = 16 * num_rows / 2**30
+    print(f"\nComplete mapping for {num_rows} rows ({input_gib:.2f} GiB input): "
+          f"{elapsed:.1f}s, peak RSS increase {peak_increase / 2**30:.2f} GiB")
+
+
 def test_fetch_mutation_id(labelmap_setup):
     dvid_server, dvid_repo, _merge_table_path, _mapping_path, _supervoxel_vol = labelmap_setup
     instance_info = DvidInstanceInfo(dvid_server, dvid_repo, 'segmentation')
@@ -448,6 +747,99 @@ def test_labelindex(labelmap_setup):
     assert compare_proto_blocks(labelindex, dvid_labelindex)
 
 
+def test_decode_labelindex_bytes():
+    """
+    Compare the fast wire-format decoder against
+    a straightforward walk through the protobuf structure.
+    """
+    labelindex = LabelIndex()
+    labelindex.label = 123
+    labelindex.last_mutid = 456
+    labelindex.last_mod_time = datetime.datetime.now().isoformat()
+    labelindex.last_mod_user = 'someuser'
+
+    encoded_blocks = []
+    for z, y, x in [(0,0,0), (0,0,1), (-1,2,3), (2**20-1, -2**20, 7)]:
+        encoded_blocks.append(((z & 0x1F_FFFF) << 42) | ((y & 0x1F_FFFF) << 21) | (x & 0x1F_FFFF))
+
+    for i, block_id in enumerate(encoded_blocks):
+        labelindex.blocks[block_id].counts.update({ 2**63+i: 1000+i, i: 64**3, 7: 0 })
+
+    expected_rows = []
+    for block_id, sv_counts in labelindex.blocks.items():
+        (coord_zyx,) = decode_labelindex_blocks(np.array([block_id], np.uint64))
+        for sv, count in sv_counts.counts.items():
+            expected_rows.append((*coord_zyx, sv, count))
+    expected_df = pd.DataFrame(expected_rows, columns=['z', 'y', 'x', 'sv', 'count'])
+    expected_df = expected_df.sort_values(['z', 'y', 'x', 'sv']).reset_index(drop=True)
+
+    pli = decode_labelindex_bytes(labelindex.SerializeToString())
+    assert pli.label == 123
+    assert pli.last_mutid == 456
+    assert pli.last_mod_time == labelindex.last_mod_time
+    assert pli.last_mod_user == 'someuser'
+
+    blocks_df = pli.blocks.sort_values(['z', 'y', 'x', 'sv']).reset_index(drop=True)
+    assert blocks_df.dtypes.tolist() == [np.int32, np.int32, np.int32, np.uint64, np.uint32]
+    for col in blocks_df.columns:
+        assert (blocks_df[col].values == expected_df[col].values).all(), col
+    assert blocks_df.iloc[-1][['z', 'y', 'x']].tolist() == [64*(2**20-1), -64*2**20, 64*7]
+
+    labelindices = LabelIndices()
+    labelindices.indices.extend([labelindex, LabelIndex(label=5)])
+    plis = decode_labelindices_bytes(labelindices.SerializeToString())
+    assert [pli.label for pli in plis] == [123, 5]
+    assert len(plis[0].blocks) == len(expected_df)
+    assert len(plis[1].blocks) == 0
+
+
+def test_encode_labelindex_bytes():
+    """
+    Compare the fast wire-format encoder against
+    the protobuf structure, built one entry at a time.
+    """
+    rows = [(-64, 128, 0, 5, 10),
+            (0, 0, 0, 2**63+1, 2**32-1),
+            (-64, 128, 0, 6, 11),
+            (64*(2**20-1), -64*2**20, 64, 7, 0),
+            (0, 0, 0, 3, 1)]
+    blocks_df = pd.DataFrame(rows, columns=['z', 'y', 'x', 'sv', 'count'])
+    blocks_df = blocks_df.astype({'z': np.int32, 'y': np.int32, 'x': np.int32, 'sv': np.uint64, 'count': np.uint32})
+    orig_df = blocks_df.copy()
+
+    expected = LabelIndex()
+    expected.label = 123
+    expected.last_mutid = 456
+    expected.last_mod_time = datetime.datetime.now().isoformat()
+    expected.last_mod_user = 'someuser'
+    for z, y, x, sv, count in rows:
+        (block_id,) = encode_block_coords([(z, y, x)])
+        expected.blocks[block_id].counts[sv] = count
+
+    pli = PandasLabelIndex(blocks_df, 123, 456, expected.last_mod_time, 'someuser')
+    labelindex = LabelIndex()
+    labelindex.ParseFromString(encode_labelindex_bytes(pli))
+    assert labelindex == expected
+    assert create_labelindex(pli) == expected
+
+    # The caller's table is not modified
+    assert blocks_df.equals(orig_df)
+
+    # Round-trip
+    decoded = decode_labelindex_bytes(encode_labelindex_bytes(pli))
+    decoded_df = decoded.blocks.sort_values(['z', 'y', 'x', 'sv']).reset_index(drop=True)
+    orig_df = orig_df.sort_values(['z', 'y', 'x', 'sv']).reset_index(drop=True)
+    for col in orig_df.columns:
+        assert (decoded_df[col].values == orig_df[col].values).all(), col
+
+    empty_pli = PandasLabelIndex(blocks_df.iloc[:0], 5, 0, '', '')
+    labelindices = LabelIndices()
+    labelindices.ParseFromString(encode_labelindices_bytes([pli, expected, expected.SerializeToString(), empty_pli]))
+    assert [li.label for li in labelindices.indices] == [123, 123, 123, 5]
+    assert labelindices.indices[0] == expected
+    assert len(labelindices.indices[3].blocks) == 0
+
+
 def test_fetch_labelindices(labelmap_setup):
     dvid_server, dvid_repo, _merge_table_path, _mapping_path, _supervoxel_vol = labelmap_setup
 
@@ -532,6 +924,136 @@ def test_fetch_sparsevol_coarse_via_labelindex(labelmap_setup):
     assert sorted(sv_svc.tolist()) == sorted(expected_sv_svc.tolist())
 
 
+def test_iter_sparsevols(labelmap_setup, tmpdir):
+    dvid_server, dvid_repo, _merge_table_path, _mapping_path, _supervoxel_vol = labelmap_setup
+    instance_info = DvidInstanceInfo(dvid_server, dvid_repo, 'segmentation')
+
+    # Label 999 doesn't exist
+    svs = [1, 2, 3, 4, 5, 999]
+    results = dict(iter_sparsevols(*instance_info, svs, supervoxels=True, threads=2, max_bytes=0))
+    assert results.keys() == set(svs)
+    assert results[999] is None
+    for sv in svs[:-1]:
+        expected = fetch_sparsevol(*instance_info, sv, supervoxels=True, format='ranges')
+        assert (results[sv] == expected).all()
+
+    coarse = dict(iter_sparsevols(*instance_info, [1], coarse=True, format='coords'))
+    assert sorted(coarse[1].tolist()) == sorted(fetch_sparsevol_coarse(*instance_info, 1).tolist())
+
+    # With a store, labels which were already stored aren't fetched again.
+    store_dir = f'{tmpdir}/sparsevol-store'
+    assert len([*iter_sparsevols(*instance_info, svs[:2], supervoxels=True, store_dir=store_dir)]) == 2
+    assert len([*iter_sparsevols(*instance_info, svs, supervoxels=True, store_dir=store_dir)]) == 4
+
+    index, ranges = load_sparsevol_store(store_dir)
+    assert sorted(index['label']) == svs[:-1]
+    for row in index.itertuples():
+        assert (ranges[row.start:row.stop] == results[row.label]).all()
+
+
+def test_sparsevol_coarse_cache(labelmap_setup, tmpdir):
+    dvid_server, dvid_repo, _merge_table_path, _mapping_path, _supervoxel_vol = labelmap_setup
+
+    # Three blocks, one supervoxel each
+    vol_shape = (64,64,256)
+    sv_vol = np.zeros(vol_shape, np.uint64)
+    sv_vol[:,:,0:64] = 1
+    sv_vol[:,:,64:128] = 2
+    sv_vol[:,:,128:192] = 3
+
+    instance_info = dvid_server, dvid_repo, 'segmentation-test-sparsevol-coarse-cache'
+    create_labelmap_instance(*instance_info)
+    post_labelmap_voxels(*instance_info, (0,0,0), sv_vol)
+
+    cache = SparsevolCoarseCache(str(tmpdir), max_bytes=2**20)
+    svc = fetch_sparsevol_coarse(*instance_info, 2, cache=cache)
+    assert sorted(svc.tolist()) == [[0,0,1]]
+    assert len(cache) == 1
+
+    # Cached results survive in a new cache object (e.g. in another process).
+    cache = SparsevolCoarseCache(str(tmpdir), max_bytes=2**20)
+    mask, mask_box = fetch_sparsevol_coarse(*instance_info, 2, format='mask', cache=cache)
+    assert mask.sum() == 1 and (mask_box == [[0,0,1], [1,1,2]]).all()
+
+    # As with the uncached function, the returned ranges are writable.
+    ranges = fetch_sparsevol_coarse(*instance_info, 2, format='ranges', cache=cache)
+    assert ranges.flags['WRITEABLE']
+    assert not cache.fetch_ranges(*instance_info, 2).flags['WRITEABLE']
+
+    # After a mutation, the cached body is no longer used.
+    post_merge(*instance_info, 2, [3])
+    svc = fetch_sparsevol_coarse(*instance_info, 2, cache=cache)
+    assert sorted(svc.tolist()) == [[0,0,1], [0,0,2]]
+
+    # Eviction
+    cache.max_bytes = 0
+    fetch_sparsevol_coarse(*instance_info, 1, cache=cache)
+    assert len(cache) == 0
+
+
+def test_fetch_combined_roi_volume(labelmap_setup, caplog):
+    dvid_server, dvid_repo, _merge_table_path, _mapping_path, _supervoxel_vol = labelmap_setup
+
+    # Two overlapping ROIs (scale-5 ranges; X1 is inclusive)
+    roi_ranges = {
+        'test-roi-a': [[0, 0, 0, 3], [0, 1, 0, 3]],
+        'test-roi-b': [[0, 1, 2, 5], [1, 1, 2, 5]],
+    }
+    for roi, ranges in roi_ranges.items():
+        create_instance(dvid_server, dvid_repo, roi, 'roi')
+        post_roi(dvid_server, dvid_repo, roi, ranges)
+
+    rois = [*roi_ranges.keys()]
+    vol, box, overlaps = fetch_combined_roi_volume(dvid_server, dvid_repo, rois)
+    assert (box == [[0,0,0], [2,2,6]]).all()
+
+    expected = np.zeros((2,2,6), np.uint8)
+    expected[0, 0, 0:4] = 1
+    expected[0, 1, 0:4] = 1
+    expected[0:2, 1, 2:6] = 2
+    assert vol.dtype == np.uint8
+    assert (vol == expected).all()
+    assert overlaps.values.tolist() == [['test-roi-a', 'test-roi-b', 2]]
+
+    # Points are labeled identically whether or not the volume is provided.
+    points_df = pd.DataFrame(32*ndrange_array((0,0,0), (3,3,7)), columns=[*'zyx'])
+    points_from_ranges = points_df.copy()
+    with caplog.at_level(logging.WARNING, logger='neuclease.dvid.roi'):
+        determine_point_rois(dvid_server, dvid_repo, rois, points_from_ranges)
+    assert "Some ROIs overlap!" in caplog.text
+    determine_point_rois(dvid_server, dvid_repo, rois, points_df, vol, box)
+    assert (points_from_ranges['roi_label'] == points_df['roi_label']).all()
+    assert (points_from_ranges['roi'].astype(str) == points_df['roi'].astype(str)).all()
+
+
+def test_count_range_overlaps():
+    """
+    Overlaps are counted from the ROI ranges just as they are
+    when the ranges are painted into the combined ROI volume.
+    """
+    from neuclease.dvid.roi import _paint_roi_ranges, _count_range_overlaps
+
+    rng = np.random.default_rng(0)
+    num_rois = 4
+    roi_indexes = np.repeat(np.arange(1, num_rois+1), 200)
+    ranges = np.zeros((len(roi_indexes), 4), np.int64)
+    ranges[:, :2] = rng.integers(0, 5, (len(ranges), 2))
+    ranges[:, 2] = rng.integers(0, 30, len(ranges))
+    ranges[:, 3] = ranges[:, 2] + rng.integers(0, 10, len(ranges))
+
+    for box in ([(0,0,0), (5,5,40)], [(1,2,5), (4,5,20)]):
+        box = np.array(box, np.int64)
+        vol = np.zeros(box[1] - box[0], np.uint8)
+        expected = np.zeros((num_rois+1, num_rois+1), np.int64)
+        _paint_roi_ranges(ranges, roi_indexes, box[0], vol, expected)
+        assert expected.any()
+
+        order = np.lexsort(ranges[:, :2].transpose()[::-1])
+        overlaps = np.zeros((num_rois+1, num_rois+1), np.int64)
+        _count_range_overlaps(ranges[order], roi_indexes[order], box[0], box[1], overlaps)
+        assert (overlaps == expected).all()
+
+
 def test_post_hierarchical_cleaves(labelmap_setup):
     dvid_server, dvid_repo, _merge_table_path, _mapping_path, _supervoxel_vol = labelmap_setup
 
@@ -615,6 +1137,208 @@ def test_fetch_mutations(labelmap_setup):
     assert (mut_df['target_body'] == [1, 5, 9, 1]).all()
 
 
+def test_fetch_cached_mappings(labelmap_setup, tmpdir):
+    dvid_server, dvid_repo, _merge_table_path, _mapping_path, _supervoxel_vol = labelmap_setup
+
+    uuid = post_branch(dvid_server, dvid_repo, 'segmentation-fetch_cached_mappings', '')
+
+    instance = 'segmentation-fetch_cached_mappings'
+    create_labelmap_instance(dvid_server, uuid, instance)
+
+    voxels = np.zeros((64,64,64), dtype=np.uint64)
+    voxels[0, 0, :10] = [*range(1,11)]
+    post_labelmap_voxels(dvid_server, uuid, instance, (0,0,0), voxels)
+    post_merge(dvid_server, uuid, instance, 1, [2,3,4])
+
+    def check(uuid):
+        cached = fetch_cached_mappings(dvid_server, uuid, instance, str(tmpdir))
+        cached = pd.Series(cached[:, 1], index=cached[:, 0])
+        cached = cached[cached.index != cached.values].sort_index()
+        expected = fetch_mappings(dvid_server, uuid, instance).sort_index()
+        assert (cached.index == expected.index).all()
+        assert (cached.values == expected.values).all()
+
+    # Initial download
+    check(uuid)
+
+    # Incremental updates, within the same UUID and in a child UUID.
+    post_merge(dvid_server, uuid, instance, 5, [6,7,8])
+    check(uuid)
+
+    post_commit(dvid_server, uuid, '')
+    uuid2 = post_newversion(dvid_server, uuid, '')
+    post_merge(dvid_server, uuid2, instance, 1, [5,10])
+    check(uuid2)
+
+
+def test_mutation_log(tmpdir):
+    msgs = [
+        {"Action": "merge", "UUID": "aaaa", "MutationID": 1, "Target": 1, "Labels": [2, 3], "User": "alice",
+         "Timestamp": "2019-07-01 12:00:00.123456 -0400"},
+        {"Action": "merge-complete", "UUID": "aaaa", "MutationID": 1},
+        {"Action": "cleave", "UUID": "aaaa", "MutationID": 2, "OrigLabel": 1, "CleavedLabel": 10, "CleavedSupervoxels": [3]},
+        {"Action": "split", "UUID": "bbbb", "MutationID": 3, "Target": 10, "NewLabel": 11,
+         "SVSplits": {"3": {"Split": 12, "Remain": 13}}},
+        {"Action": "split-complete", "UUID": "bbbb", "MutationID": 3},
+        {"Action": "split-supervoxel", "UUID": "bbbb", "MutationID": 4, "Supervoxel": 2,
+         "SplitSupervoxel": 14, "RemainSupervoxel": 15, "Body": 1},
+        {"Action": "renumber", "UUID": "bbbb", "MutationID": 5, "OrigLabel": 11, "NewLabel": 16},
+    ]
+
+    log = MutationLog.from_msgs(msgs)
+    assert len(log) == len(msgs)
+    assert list(log) == msgs
+    assert log.body.tolist() == [1, 0, 1, 10, 0, 1, 11]
+    assert log.new_body.tolist() == [0, 0, 10, 11, 0, 0, 16]
+    assert log.labels.tolist() == [2, 3, 3]
+    assert log.sv_splits.tolist() == [[3, 13, 12], [2, 15, 14]]
+
+    # The '-complete' messages inherit the targets of the matching mutation.
+    # Messages without a timestamp are assigned the default timestamp,
+    # and the timestamps are truncated to milliseconds (without the timezone).
+    expected_df = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2019-07-01 12:00:00.123'] + 6*[DEFAULT_TIMESTAMP]),
+        'uuid': ['aaaa', 'aaaa', 'aaaa', 'bbbb', 'bbbb', 'bbbb', 'bbbb'],
+        'mutid': [1, 1, 2, 3, 3, 4, 5],
+        'action': ['merge', 'merge-complete', 'cleave', 'split', 'split-complete', 'split-supervoxel', 'renumber'],
+        'target_body': [1, 1, 1, 10, 10, 0, 0],
+        'target_sv': [0, 0, 0, 0, 0, 2, 0],
+        'user': ['alice', '', '', '', '', '', ''],
+    })
+
+    df = log.to_dataframe(drop_completes=False)
+    assert df.columns.tolist() == ['timestamp', 'uuid', 'mutid', 'action', 'target_body', 'target_sv', 'user', 'msg']
+    assert df.index.tolist() == [0, 1, 2, 3, 4, 5, 6]
+    for col in expected_df.columns:
+        assert df[col].tolist() == expected_df[col].tolist(), col
+    assert df['msg'].tolist() == msgs
+
+    df = log.to_dataframe(drop_completes=True)
+    assert df.index.tolist() == [0, 2, 3, 5, 6]
+    for col in expected_df.columns:
+        assert df[col].tolist() == expected_df.loc[[0, 2, 3, 5, 6], col].tolist(), col
+
+    assert log.to_dataframe(include_msgs=False).columns.tolist() == \
+        ['timestamp', 'uuid', 'mutid', 'action', 'target_body', 'target_sv', 'user']
+
+    splits = fetch_supervoxel_splits_from_kafka('unused', 'unused', 'unused', kafka_msgs=log)
+    expected_splits = fetch_supervoxel_splits_from_kafka('unused', 'unused', 'unused', kafka_msgs=msgs)
+    assert splits == expected_splits
+
+    sub_log = log.filter(uuids=['bbbb'], drop_completes=True)
+    assert list(sub_log) == [msgs[3], msgs[5], msgs[6]]
+    assert sub_log.sv_splits.tolist() == [[3, 13, 12], [2, 15, 14]]
+
+    path = f'{tmpdir}/mutations.npz'
+    log.save(path)
+    loaded = MutationLog.load(path)
+    assert list(loaded) == msgs
+    assert loaded.uuid_names == log.uuid_names
+
+    # Logs without the original messages can be saved, too.
+    msgless_log = MutationLog.from_msgs(msgs, keep_msgs=False)
+    msgless_log.save(path, include_msgs=False)
+    loaded = MutationLog.load(path)
+    assert not loaded.has_msgs
+    assert loaded.sv_splits.tolist() == log.sv_splits.tolist()
+    assert (loaded.to_dataframe()['target_body'] == log.to_dataframe()['target_body']).all()
+
+    # Incrementally-read logs are assembled via concatenate()
+    combined = MutationLog.concatenate([MutationLog.from_msgs(msgs[:4]), MutationLog.from_msgs(msgs[4:])])
+    assert list(combined) == msgs
+    assert combined.sv_splits.tolist() == log.sv_splits.tolist()
+    assert (combined.to_dataframe()['target_body'] == log.to_dataframe()['target_body']).all()
+
+
+def _deep_split_chain_events(num_splits):
+    """
+    Synthetic split history in which each split fragment is split again,
+    producing a single chain of num_splits events.
+    """
+    events = {'aaaa': []}
+    sv = 1
+    for i in range(num_splits):
+        remain, split = 2*i + 2, 2*i + 3
+        events['aaaa'].append(SplitEvent(i, sv, remain, split, 'split-supervoxel'))
+        sv = split
+    return events
+
+
+def test_resolve_split_roots():
+    events = {
+        'aaaa': [SplitEvent(1, 10, 11, 12, 'split'), SplitEvent(2, 12, 13, 14, 'split-supervoxel')],
+        'bbbb': [SplitEvent(3, 14, 15, 16, 'split-supervoxel'), SplitEvent(4, 20, 21, 22, 'split')],
+    }
+    table = split_events_to_table(events)
+    assert table['old'].tolist() == [10, 12, 14, 20]
+    assert table['type'].tolist() == ['split', 'split-supervoxel', 'split-supervoxel', 'split']
+
+    roots = resolve_split_roots(table, [10, 11, 12, 13, 14, 15, 16, 21, 22, 99])
+    assert roots.tolist() == [10, 10, 10, 10, 10, 10, 10, 20, 20, 99]
+
+    mapping = split_events_to_mapping(events, leaves_only=True)
+    assert sorted(mapping.index) == [11, 13, 15, 16, 21, 22]
+    assert (mapping.sort_index().values == [10, 10, 10, 10, 20, 20]).all()
+
+    assert resolve_split_roots(split_events_to_table({}), [1, 2]).tolist() == [1, 2]
+
+
+def _split_roots_via_graph(table, fragments):
+    """
+    Resolve split roots by walking the split chains in a networkx graph,
+    for comparison with resolve_split_roots().
+    """
+    import networkx as nx
+    from neuclease.util import find_root
+
+    g = nx.DiGraph()
+    g.add_edges_from(zip(table['old'].tolist(), table['remain'].tolist()))
+    g.add_edges_from(zip(table['old'].tolist(), table['split'].tolist()))
+    return [find_root(g, sv) for sv in fragments.tolist()]
+
+
+def test_resolve_split_roots_deep_chain():
+    events = _deep_split_chain_events(200)
+    table = split_events_to_table(events)
+    fragments = np.concatenate((table['remain'], table['split']))
+
+    roots = resolve_split_roots(table, fragments)
+    assert roots.tolist() == _split_roots_via_graph(table, fragments)
+    assert (roots == 1).all()
+
+
+@pytest.mark.skipif(not os.environ.get('NEUCLEASE_BENCHMARKS'),
+                    reason="Set NEUCLEASE_BENCHMARKS=1 to run benchmarks")
+def test_split_roots_benchmark():
+    """
+    Benchmark root resolution on a synthetic deep split chain,
+    compared with walking the chain in a networkx graph.
+    (No DVID server required.)
+    """
+    events = _deep_split_chain_events(2_000)
+    table = split_events_to_table(events)
+    fragments = np.concatenate((table['remain'], table['split']))
+
+    start = time.time()
+    expected = _split_roots_via_graph(table, fragments)
+    graph_time = time.time() - start
+
+    start = time.time()
+    roots = resolve_split_roots(table, fragments)
+    array_time = time.time() - start
+    assert roots.tolist() == expected
+
+    events = _deep_split_chain_events(500_000)
+    start = time.time()
+    table = split_events_to_table(events)
+    roots = resolve_split_roots(table, np.concatenate((table['remain'], table['split'])))
+    big_time = time.time() - start
+    assert (roots == 1).all()
+
+    print(f"\nDeep split chain: 2k splits: graph {graph_time:.2f}s -> arrays {array_time:.3f}s, "
+          f"500k splits: arrays {big_time:.2f}s")
+
+
 if __name__ == "__main__":
     #from neuclease import configure_default_logging
     #configure_default_logging()
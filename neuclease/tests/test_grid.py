@@ -1,6 +1,11 @@
+from functools import partial
+
 import pytest
 import numpy as np
-from neuclease.util import Grid, boxes_from_grid, slabs_from_box
+import pandas as pd
+
+from neuclease.util import (Grid, boxes_from_grid, slabs_from_box, box_to_slicing, extract_subvol,
+                            iter_grid_chunks, reduce_grid_chunks, SparseBlockMask)
 
 
 @pytest.mark.parametrize("lazy", [True, False])
@@ -82,5 +87,56 @@ def test_slabs_for_box_scaled_nonaligned_round_in():
     assert (np.array(slabs) == expected).all()
 
 
+def _count_labels(vol, box, logical_box):
+    vol = vol[box_to_slicing(*(logical_box - box[0]))]
+    return pd.Series(vol.reshape(-1)).value_counts()
+
+
+def _check_halo(full_vol, vol, box, logical_box):
+    assert (vol == extract_subvol(full_vol, box)).all()
+    return (box, logical_box)
+
+
+@pytest.mark.parametrize("pool", [{}, {'threads': 2}, {'processes': 2}])
+def test_reduce_grid_chunks(pool):
+    full_vol = np.random.RandomState(0).randint(0, 5, size=(50, 60, 70))
+    full_vol[:20] += 10  # Not every chunk contains every label
+    bounding_box = [(3, 4, 5), (50, 60, 70)]
+    fetch_fn = partial(extract_subvol, full_vol)
+
+    counts = reduce_grid_chunks(bounding_box, Grid((16, 16, 16), halo=2), _count_labels, 'sum',
+                                fetch_fn=fetch_fn, max_inflight=3, show_progress=False, **pool)
+    expected = pd.Series(extract_subvol(full_vol, bounding_box).reshape(-1)).value_counts()
+    assert counts.dtype == expected.dtype
+    assert (counts.sort_index() == expected.sort_index()).all()
+
+
+def test_iter_grid_chunks_halo():
+    full_vol = np.random.RandomState(0).randint(0, 5, size=(50, 60, 70))
+    bounding_box = np.array([(0, 0, 0), (50, 60, 70)])
+    check_fn = partial(_check_halo, full_vol)
+
+    results = [*iter_grid_chunks(bounding_box, Grid((16, 16, 16), halo=2), check_fn,
+                                 fetch_fn=partial(extract_subvol, full_vol), threads=2, ordered=True, show_progress=False)]
+    expected_logical_boxes = boxes_from_grid(bounding_box, (16, 16, 16), clipped=True)
+    assert len(results) == len(expected_logical_boxes)
+
+    for (logical_box, (box, chunk_logical_box)), expected in zip(results, expected_logical_boxes):
+        assert (logical_box == expected).all()
+        assert (chunk_logical_box == expected).all()
+        assert (box[0] == np.maximum(expected[0] - 2, bounding_box[0])).all()
+        assert (box[1] == np.minimum(expected[1] + 2, bounding_box[1])).all()
+
+
+def test_iter_grid_chunks_sbm():
+    lowres_mask = np.zeros((4, 4, 4), bool)
+    lowres_mask[0, 0, 0] = True
+    lowres_mask[3, 2, 1] = True
+    sbm = SparseBlockMask(lowres_mask, [(0, 0, 0), (64, 64, 64)], 16)
+
+    results = reduce_grid_chunks(sbm.box, (32, 32, 32), lambda box, logical_box: logical_box.tolist(), sbm=sbm, show_progress=False)
+    assert sorted(results) == [[[0, 0, 0], [32, 32, 32]], [[32, 32, 0], [64, 64, 32]]]
+
+
 if __name__ == "__main__":
     pytest.main(['-s', '--tb=native', '--pyargs', 'neuclease.tests.test_grid'])
@@ -1,12 +1,18 @@
+import os
+import time
 import logging
+import tempfile
+from socket import getfqdn
+
 import pytest
 from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
+import pandas as pd
 
 from libdvid import DVIDNodeService
 
-from neuclease.dvid import ( DvidInstanceInfo, post_key, post_branch, create_instance,
+from neuclease.dvid import ( DvidInstanceInfo, post_key, post_branch, create_instance, fetch_repo_info,
                              fetch_mutation_id, post_cleave, post_split_supervoxel, post_merge )
 from neuclease.merge_graph import LabelmapMergeGraph
 from neuclease.merge_table import load_merge_table, MAPPED_MERGE_TABLE_DTYPE
@@ -45,6 +51,7 @@ def _test_extract_edges(labelmap_setup, force_dirty_mapping):
         # A little white-box manipulation here to ensure that the mapping is dirty
         merge_graph.merge_table_df['body'] = np.uint64(0)
         merge_graph.mapping[:] = np.uint64(0)
+        merge_graph._update_body_index()
 
     # First test: If nothing has changed in DVID, we get all rows.
     # We should be able to repeat this with the same results
@@ -64,6 +71,7 @@ def _test_extract_edges(labelmap_setup, force_dirty_mapping):
     if force_dirty_mapping:
         # A little white-box manipulation here to ensure that the mapping is dirty
         merge_graph.mapping.loc[2] = 0
+        merge_graph._update_body_index()
         merge_graph.merge_table_df['body'].values[0:2] = np.uint64(0)
 
     mutid, dvid_supervoxels, edges, _scores = merge_graph.extract_edges(dvid_server, uuid, 'segmentation', 1)
@@ -217,6 +225,126 @@ def test_append_edges_for_split_supervoxels_with_bad_edges(labelmap_setup, paren
         assert (merge_graph.merge_table_df.query('id_a == 3 or id_b == 3')['body'] == 0).all()
 
 
+def test_append_edges_for_split_supervoxels_pending(labelmap_setup):
+    """
+    Edges for split supervoxels are appended even if the edge which
+    refers to the split parent hasn't been merged into the main table yet.
+    """
+    dvid_server, _dvid_repo, merge_table_path, mapping_path, _supervoxel_vol = labelmap_setup
+    uuid, _split_sv, remainder_sv = \
+        _setup_test_append_edges_for_split(labelmap_setup, 'split-pending-test')
+
+    merge_graph = LabelmapMergeGraph(merge_table_path)
+    merge_graph.apply_mapping(mapping_path)
+
+    # Move the edge between SV 3 and 4 into the pending buffer.
+    edge_row = merge_graph.merge_table_df.query('id_a == 3 and id_b == 4').index
+    assert len(edge_row) == 1
+    pending_edge = merge_graph.merge_table_df.loc[edge_row]
+    merge_graph.merge_table_df = merge_graph.merge_table_df.drop(edge_row)
+    merge_graph.add_edges(pending_edge)
+    assert len(merge_graph.extract_pending_rows([3, 4])) == 1
+
+    merge_graph.append_edges_for_split_supervoxels((dvid_server, uuid, 'segmentation'), 'drop', read_from='dvid')
+
+    assert len(merge_graph.extract_pending_rows([3, 4, remainder_sv])) == 0
+    assert len(merge_graph.merge_table_df.query('id_a == 3 or id_b == 3')) == 0
+    assert len(merge_graph.merge_table_df.query('id_a == 4 and id_b == @remainder_sv')) == 1, \
+        f"Merge graph:\n:{str(merge_graph.merge_table_df)}"
+
+
+def test_supervoxels_for_body(labelmap_setup):
+    _dvid_server, _dvid_repo, merge_table_path, _mapping_path, _supervoxel_vol = labelmap_setup
+
+    merge_graph = LabelmapMergeGraph(merge_table_path)
+    assert len(merge_graph.supervoxels_for_body(1)) == 0
+
+    mapping = pd.Series(index=np.array([5,1,4,2,3,6], np.uint64),
+                        data=np.array([20,10,20,10,10,30], np.uint64))
+    merge_graph.apply_mapping(mapping)
+
+    assert (merge_graph.supervoxels_for_body(10) == [1,2,3]).all()
+    assert (merge_graph.supervoxels_for_body(20) == [4,5]).all()
+    assert (merge_graph.supervoxels_for_body(30) == [6]).all()
+    assert len(merge_graph.supervoxels_for_body(15)) == 0
+    assert len(merge_graph.supervoxels_for_body(99)) == 0
+
+
+def test_shared_merge_graph(labelmap_setup):
+    dvid_server, dvid_repo, merge_table_path, mapping_path, _supervoxel_vol = labelmap_setup
+    instance_info = DvidInstanceInfo(dvid_server, dvid_repo, 'segmentation')
+
+    merge_graph = LabelmapMergeGraph(merge_table_path)
+    merge_graph.apply_mapping(mapping_path)
+
+    shared_dir = tempfile.mkdtemp(prefix='test_shared_merge_graph')
+    merge_graph.publish_shared(shared_dir)
+
+    attached_graph = LabelmapMergeGraph.attach_shared(shared_dir)
+    assert attached_graph.read_only
+
+    def assert_shared_columns():
+        # Each column must still be a view of the memory-mapped file.
+        for col in attached_graph.merge_table_df.columns:
+            values = attached_graph.merge_table_df[col].values
+            mmap = values
+            while not isinstance(mmap, np.memmap) and isinstance(mmap.base, np.ndarray):
+                mmap = mmap.base
+            assert isinstance(mmap, np.memmap) and np.shares_memory(values, mmap), \
+                f"Column {col} was copied instead of memory-mapped"
+            assert os.path.samefile(mmap.filename, f'{shared_dir}/table-{col}.npy')
+
+    assert_shared_columns()
+    assert (attached_graph.merge_table_df == merge_graph.merge_table_df).all().all()
+    assert (attached_graph.mapping == merge_graph.mapping).all()
+    assert (attached_graph.supervoxels_for_body(1) == [1,2,3,4,5]).all()
+
+    _mutid, svs, edges, _scores = merge_graph.extract_edges(*instance_info, 1)
+    _mutid, attached_svs, attached_edges, _scores = attached_graph.extract_edges(*instance_info, 1)
+    assert (svs == attached_svs).all()
+    assert (edges == attached_edges).all()
+
+    # Queries don't consolidate (copy) the memory-mapped columns.
+    assert_shared_columns()
+
+    with pytest.raises(RuntimeError):
+        attached_graph.apply_mapping(mapping_path)
+
+
+def test_add_edges(labelmap_setup):
+    """
+    Edges added via add_edges() are visible to extract_edges() immediately,
+    both before and after they are merged into the main table.
+    """
+    dvid_server, dvid_repo, merge_table_path, mapping_path, _supervoxel_vol = labelmap_setup
+    instance_info = DvidInstanceInfo(dvid_server, dvid_repo, 'segmentation')
+
+    merge_graph = LabelmapMergeGraph(merge_table_path)
+    merge_graph.apply_mapping(mapping_path)
+    orig_len = len(merge_graph.merge_table_df)
+
+    _mutid, _svs, edges, _scores = merge_graph.extract_edges(*instance_info, 1)
+    assert [1,5] not in edges.tolist()
+
+    # Deliberately un-normalized (id_a > id_b)
+    new_edges = pd.DataFrame({'id_a': [5], 'id_b': [1], 'score': [0.01]})
+    assert merge_graph.add_edges(new_edges) == 1
+    assert len(merge_graph.merge_table_df) == orig_len
+
+    # The cached edges for body 1 were discarded
+    _mutid, _svs, edges, _scores = merge_graph.extract_edges(*instance_info, 1)
+    assert [1,5] in edges.tolist()
+
+    assert merge_graph.merge_pending_edges() == 1
+    assert len(merge_graph.merge_table_df) == orig_len + 1
+    assert merge_graph.merge_table_df.iloc[-1]['body'] == 1
+    assert len(merge_graph.extract_pending_rows([1,2,3,4,5])) == 0
+
+    merge_graph._edge_cache.clear()
+    _mutid, _svs, edges, _scores = merge_graph.extract_edges(*instance_info, 1)
+    assert [1,5] in edges.tolist()
+
+
 def test_append_edges_for_focused_merges(labelmap_setup):
     dvid_server, dvid_repo, merge_table_path, _mapping_path, _supervoxel_vol = labelmap_setup
     
@@ -270,6 +398,92 @@ def test_extract_edges_multithreaded(labelmap_setup):
     with ThreadPoolExecutor(max_workers=11) as executor:
         list(executor.map(_test, 300*[[True], [False], [False]]))
 
+def test_repo_info_cache(labelmap_setup):
+    """
+    Repo roots are cached for every node in the DAG,
+    and new nodes can be registered via notify_new_node().
+    """
+    dvid_server, dvid_repo, merge_table_path, mapping_path, _supervoxel_vol = labelmap_setup
+
+    merge_graph = LabelmapMergeGraph(merge_table_path)
+    merge_graph.apply_mapping(mapping_path)
+
+    server = merge_graph.canonical_server(dvid_server)
+    assert merge_graph.find_repo_root(server, dvid_repo) == dvid_repo
+
+    uuid = post_branch(dvid_server, dvid_repo, 'test_repo_info_cache', '')
+    assert (server, uuid) not in merge_graph._repo_roots
+    assert merge_graph.notify_new_node(dvid_server, uuid) == dvid_repo
+    assert merge_graph._repo_roots[(server, uuid)][0] == dvid_repo
+
+    # Expired entries are refreshed
+    merge_graph.repo_info_ttl = 0.0
+    assert merge_graph.find_repo_root(server, uuid) == dvid_repo
+
+
+def test_extract_edges_cache_hit(labelmap_setup, monkeypatch):
+    """
+    On an edge cache hit, extract_edges() performs
+    no DNS lookup and no /repo/info request.
+    """
+    dvid_server, dvid_repo, merge_table_path, mapping_path, _supervoxel_vol = labelmap_setup
+    instance_info = DvidInstanceInfo(dvid_server, dvid_repo, 'segmentation')
+
+    merge_graph = LabelmapMergeGraph(merge_table_path)
+    merge_graph.apply_mapping(mapping_path)
+    _mutid, svs, edges, _scores = merge_graph.extract_edges(*instance_info, 1)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Cache hit should not require this lookup")
+
+    monkeypatch.setattr('neuclease.merge_graph.getfqdn', fail)
+    monkeypatch.setattr('neuclease.merge_graph.fetch_repo_info', fail)
+    monkeypatch.setattr('neuclease.merge_graph.resolve_ref', fail)
+
+    _mutid, cached_svs, cached_edges, _scores = merge_graph.extract_edges(*instance_info, 1)
+    assert (cached_svs == svs).all()
+    assert (cached_edges == edges).all()
+
+
+@pytest.mark.skipif(not os.environ.get('NEUCLEASE_BENCHMARKS'),
+                    reason="Set NEUCLEASE_BENCHMARKS=1 to run benchmarks")
+def test_extract_edges_cache_hit_latency(labelmap_setup):
+    """
+    Microbenchmark: Compare the cost of the DNS lookup and /repo/info
+    request (which extract_edges() skips on a cache hit) with the
+    cached equivalents.
+    """
+    dvid_server, dvid_repo, merge_table_path, mapping_path, _supervoxel_vol = labelmap_setup
+    instance_info = DvidInstanceInfo(dvid_server, dvid_repo, 'segmentation')
+
+    merge_graph = LabelmapMergeGraph(merge_table_path)
+    merge_graph.apply_mapping(mapping_path)
+    merge_graph.extract_edges(*instance_info, 1)
+
+    N = 100
+    domain = dvid_server.split('://')[-1]
+    start = time.time()
+    for _ in range(N):
+        getfqdn(domain)
+        fetch_repo_info(dvid_server, dvid_repo)
+    uncached = (time.time() - start) / N
+
+    start = time.time()
+    for _ in range(N):
+        server = merge_graph.canonical_server(dvid_server)
+        merge_graph.find_repo_root(server, dvid_repo)
+    cached = (time.time() - start) / N
+
+    start = time.time()
+    for _ in range(N):
+        merge_graph.extract_edges(*instance_info, 1)
+    cache_hit = (time.time() - start) / N
+
+    print(f"\nServer/repo resolution: uncached {1000*uncached:.3f} ms, cached {1000*cached:.3f} ms")
+    print(f"extract_edges() cache hit: {1000*cache_hit:.3f} ms")
+    assert cached < uncached
+
+
 if __name__ == "__main__":
 #     import sys
 #     import logging
@@ -0,0 +1,117 @@
+import pytest
+import numpy as np
+
+from neuclease.util import sphere_mask, box_to_slicing, ndrange_array
+from neuclease.misc import point_neighborhoods
+from neuclease.misc.point_neighborhoods import write_point_neighborhoods
+
+SEG_SRC = ('http://src-server', 'abc123', 'segmentation')
+SEG_DST = ('http://dst-server', 'def456', 'neighborhoods')
+
+
+@pytest.fixture
+def fake_dvid(monkeypatch):
+    """
+    Replace the DVID functions used by write_point_neighborhoods() with
+    fakes that read from a synthetic source volume and store the
+    destination blocks (and meshes) in RAM, recording every call.
+    """
+    src_vol = np.ones((128, 128, 128), np.uint64)
+    src_vol[:, :, 35:] = 2
+
+    dst = {
+        'blocks': {(0, 0, 0): np.full((64, 64, 64), 99, np.uint64)},
+        'posted_corners': [],
+        'fetched_corners': [],
+        'meshes': {},
+        'mesh_posts': 0,
+        'src_vol': src_vol,
+    }
+
+    def fetch_labelmap_voxels(server, uuid, instance, box, *args, **kwargs):
+        assert (server, uuid, instance) == SEG_SRC
+        box = np.asarray(box)
+        assert (box[0] >= 0).all() and (box[1] <= src_vol.shape).all()
+        return src_vol[box_to_slicing(*box)].copy()
+
+    def fetch_labelmap_specificblocks(server, uuid, instance, corners_zyx, supervoxels=False, *args, format='array', **kwargs):  # @ReservedAssignment
+        assert (server, uuid, instance) == SEG_DST
+        assert supervoxels and format == 'blocks'
+        corners = [*map(tuple, np.asarray(corners_zyx).tolist())]
+        dst['fetched_corners'].extend(corners)
+        return {c: dst['blocks'][c].copy() for c in corners if c in dst['blocks']}
+
+    def post_labelmap_blocks(server, uuid, instance, corners_zyx, blocks, *args, downres=False, **kwargs):
+        assert (server, uuid, instance) == SEG_DST
+        assert downres
+        for corner, block in zip(map(tuple, np.asarray(corners_zyx).tolist()), blocks):
+            dst['posted_corners'].append(corner)
+            dst['blocks'][corner] = np.array(block)
+
+    def post_keyvalues(server, uuid, instance, keyvalues, *args, **kwargs):
+        assert (server, uuid, instance) == (*SEG_DST[:2], f'{SEG_DST[2]}_meshes')
+        dst['mesh_posts'] += 1
+        dst['meshes'].update(keyvalues)
+
+    monkeypatch.setattr(point_neighborhoods, 'fetch_labelmap_voxels', fetch_labelmap_voxels)
+    monkeypatch.setattr(point_neighborhoods, 'fetch_labelmap_specificblocks', fetch_labelmap_specificblocks)
+    monkeypatch.setattr(point_neighborhoods, 'post_labelmap_blocks', post_labelmap_blocks)
+    monkeypatch.setattr(point_neighborhoods, 'post_keyvalues', post_keyvalues)
+    return dst
+
+
+def test_write_point_neighborhoods(fake_dvid):
+    radius = 10
+
+    # The first two points overlap (and lie in the same block),
+    # the third crosses into the neighboring block,
+    # and the fourth is by itself.
+    points = np.array([[34, 30, 30],
+                       [30, 30, 30],
+                       [60, 30, 40],
+                       [100, 100, 100]])
+    dst_bodies = [100, 101, 102, 103]
+
+    # Expected result: write each neighborhood in turn, in the order of the input list.
+    src_vol = fake_dvid['src_vol']
+    expected_vol = np.zeros(src_vol.shape, np.uint64)
+    expected_vol[:64, :64, :64] = 99
+    expected_voxels = []
+    for point, dst_body in zip(points, dst_bodies):
+        box = np.array((point - radius, point + radius + 1))
+        src = src_vol[box_to_slicing(*box)]
+        mask = (src == src[radius, radius, radius]) & sphere_mask(radius)
+        expected_vol[box_to_slicing(*box)][mask] = dst_body
+        expected_voxels.append(mask.sum())
+
+    df = write_point_neighborhoods(SEG_SRC, SEG_DST, points, radius, dst_bodies=dst_bodies, mesh_batch_size=3)
+
+    # The results are listed in the input order
+    assert (df[[*'zyx']].values == points).all()
+    assert df['dst_body'].tolist() == dst_bodies
+    assert df['src_body'].tolist() == [1, 1, 2, 2]
+    assert df['dst_voxels'].tolist() == expected_voxels
+
+    # Each block that the neighborhoods touch is posted exactly once,
+    # and no other blocks are posted.
+    touched_blocks = {(0, 0, 0), (64, 0, 0), (64, 64, 64)}
+    assert sorted(fake_dvid['posted_corners']) == sorted(touched_blocks)
+    assert sorted(fake_dvid['fetched_corners']) == sorted(touched_blocks)
+
+    # Overlapping neighborhoods are written in input order, existing voxels
+    # outside the neighborhoods are preserved, and missing blocks are zero-filled.
+    for corner in ndrange_array((0, 0, 0), src_vol.shape, 64):
+        corner = tuple(corner.tolist())
+        block = fake_dvid['blocks'].get(corner)
+        expected_block = expected_vol[box_to_slicing(corner, np.add(corner, 64))]
+        if block is None:
+            assert not expected_block.any()
+        else:
+            assert (block == expected_block).all(), f"Block {corner} doesn't match"
+
+    # (Sanity check: the overlap between the first two neighborhoods went to the second one.)
+    assert fake_dvid['blocks'][(0, 0, 0)][32, 30, 30] == 101
+
+    # All meshes were posted, in batches.
+    assert sorted(fake_dvid['meshes'].keys()) == sorted(f'{b}.ngmesh' for b in dst_bodies)
+    assert fake_dvid['mesh_posts'] == 2
@@ -3,9 +3,14 @@ import pytest
 import numpy as np
 import scipy.ndimage
 
+from neuclease.util import box_to_slicing
 from neuclease.dvid.rle import (runlength_encode_to_ranges, runlength_decode_from_ranges,
                                 runlength_encode_to_lengths, runlength_decode_from_lengths,
-                                rle_box_dilation)
+                                rle_box_dilation, construct_rle_payload, parse_rle_stream_to_blocks,
+                                unpack_block_mask, normalize_rle_ranges, rle_ranges_union,
+                                rle_ranges_intersection, rle_ranges_difference, rle_ranges_contains,
+                                rle_ranges_clip, rle_ranges_voxel_count, combine_sparsevol_rle_responses,
+                                parse_rle_response)
 
 @pytest.fixture
 def sparse_object():
@@ -94,5 +99,85 @@ def test_rle_box_dilation(sparse_object):
 
     
 
+def test_parse_rle_stream_to_blocks():
+    # A few balls, spanning several blocks (including negative coordinates)
+    vol = np.zeros((100, 90, 150), bool)
+    vol[tuple(np.array([[10, 20, 30], [60, 50, 120], [80, 80, 70]]).transpose())] = 1
+    vol = scipy.ndimage.distance_transform_edt(~vol) < 15
+    coords = np.transpose(vol.nonzero()).astype(np.int32) + (-40, 7, 1000)
+    payload = construct_rle_payload(coords)
+
+    # Any chunk size (even smaller than one RLE) is fine.
+    for chunk_size in (5, 1000, len(payload)):
+        chunks = (payload[i:i+chunk_size] for i in range(0, len(payload), chunk_size))
+        block_masks = parse_rle_stream_to_blocks(chunks)
+
+        decoded = []
+        for corner, packed_mask in block_masks.items():
+            assert (np.array(corner) % 64 == 0).all()
+            mask = unpack_block_mask(packed_mask)
+            assert mask.any()
+            decoded.append(np.transpose(mask.nonzero()) + corner)
+
+        decoded = np.concatenate(decoded)
+        assert len(decoded) == len(coords)
+        assert set(map(tuple, decoded.tolist())) == set(map(tuple, coords.tolist()))
+
+    # The RLEs needn't be sorted
+    rles = np.frombuffer(payload[12:], np.int32).reshape(-1, 4)[::-1]
+    shuffled_masks = parse_rle_stream_to_blocks(payload[:12] + rles.tobytes())
+    assert shuffled_masks.keys() == block_masks.keys()
+    assert all((shuffled_masks[k] == block_masks[k]).all() for k in block_masks)
+
+    assert parse_rle_stream_to_blocks(construct_rle_payload(np.zeros((0,3), np.int32))) == {}
+
+
+
+def test_rle_ranges_set_operations():
+    rng = np.random.default_rng(0)
+    offset = (-2, 3, -17)
+
+    def ranges_for(mask):
+        return runlength_encode_to_ranges(np.transpose(mask.nonzero()).astype(np.int32) + offset)
+
+    for _ in range(10):
+        a = rng.random((4, 5, 40)) < 0.5
+        b = rng.random((4, 5, 40)) < 0.5
+        ranges_a = ranges_for(a)
+        ranges_b = ranges_for(b)
+
+        # Duplicated and unsorted runs are permitted in the input.
+        messy_a = np.concatenate((ranges_a, ranges_a[::3]))[::-1]
+        assert (normalize_rle_ranges(messy_a) == ranges_a).all()
+
+        assert (rle_ranges_union(messy_a, ranges_b) == ranges_for(a | b)).all()
+        assert (rle_ranges_intersection(messy_a, ranges_b) == ranges_for(a & b)).all()
+        assert (rle_ranges_difference(messy_a, ranges_b) == ranges_for(a & ~b)).all()
+        assert rle_ranges_voxel_count(ranges_a) == a.sum()
+
+        points = np.transpose(np.ones_like(a).nonzero()) + offset
+        assert (rle_ranges_contains(messy_a, points) == a.reshape(-1)).all()
+
+        box = np.array([[-1, 4, -10], [1, 7, 10]])
+        clipped_a = np.zeros_like(a)
+        clipped_a[box_to_slicing(*(box - offset))] = a[box_to_slicing(*(box - offset))]
+        assert (normalize_rle_ranges(rle_ranges_clip(messy_a, box)) == ranges_for(clipped_a)).all()
+
+    assert len(rle_ranges_intersection(np.zeros((0,4), np.int32), ranges_a)) == 0
+    assert (rle_ranges_difference(ranges_a, np.zeros((0,4), np.int32)) == ranges_a).all()
+    assert not rle_ranges_contains(np.zeros((0,4), np.int32), [[1,2,3]]).any()
+
+
+def test_combine_sparsevol_rle_responses():
+    rng = np.random.default_rng(0)
+    coords_a = np.transpose((rng.random((5, 5, 50)) < 0.5).nonzero()).astype(np.int32)
+    coords_b = np.transpose((rng.random((5, 5, 50)) < 0.5).nonzero()).astype(np.int32)
+
+    combined = combine_sparsevol_rle_responses([construct_rle_payload(coords_a), construct_rle_payload(coords_b)])
+    expected = np.unique(np.concatenate((coords_a, coords_b)), axis=0)
+    assert (parse_rle_response(combined) == expected).all()
+
+
+
 if __name__ == "__main__":
     pytest.main(['-s', '--tb=native', '--pyargs', 'neuclease.tests.test_rle'])
@@ -1,3 +1,5 @@
+import os
+import time
 from itertools import product
 
 import pytest
@@ -5,7 +7,8 @@ import numpy as np
 import pandas as pd
 
 from dvidutils import LabelMapper
-from neuclease.util import mask_for_labels, apply_mask_for_labels, contingency_table, split_disconnected_bodies
+from neuclease.util import (mask_for_labels, apply_mask_for_labels, contingency_table, split_disconnected_bodies,
+                            edge_mask, compute_adjacencies, connected_components)
 
 def test_mask_for_labels():
     volume = [[0,2,3], [4,5,0]]
@@ -57,6 +60,114 @@ def test_contingency_table_random():
             assert rows['voxel_count'].iloc[0] == expected_overlap
 
 
+def test_edge_mask():
+    labels = np.random.randint(0, 3, size=(10,11,12), dtype=np.uint64)
+
+    # Brute force
+    expected_before = np.zeros(labels.shape, bool)
+    expected_after = np.zeros(labels.shape, bool)
+    for axis in range(3):
+        left = (slice(None),)*axis + (slice(None, -1),)
+        right = (slice(None),)*axis + (slice(1, None),)
+        edges = (labels[left] != labels[right])
+        expected_before[left] |= edges
+        expected_after[right] |= edges
+
+    assert (edge_mask(labels, 'before') == expected_before).all()
+    assert (edge_mask(labels, 'after') == expected_after).all()
+    assert (edge_mask(labels, 'both') == (expected_before | expected_after)).all()
+
+    # 2D, non-contiguous
+    labels_2d = labels[:, 3, :]
+    expected_2d = np.zeros(labels_2d.shape, bool)
+    expected_2d[:-1, :] |= (labels_2d[:-1, :] != labels_2d[1:, :])
+    expected_2d[:, :-1] |= (labels_2d[:, :-1] != labels_2d[:, 1:])
+    assert (edge_mask(labels_2d, 'before') == expected_2d).all()
+
+
+def test_compute_adjacencies():
+    labels = [[1,1,1,1,2,2],
+              [1,1,1,0,2,2],
+              [1,0,0,0,2,2],
+              [1,0,0,0,2,2],
+              [1,0,0,0,2,2],
+              [1,0,2,2,2,2]]
+
+    adj = compute_adjacencies(labels)
+    assert adj.name == 'edge_area'
+    assert adj.index.names == ['label_a', 'label_b']
+    assert adj.index.tolist() == [(1,2)]
+    assert adj.tolist() == [1]
+
+    adj = compute_adjacencies(labels, include_zero=True)
+    assert adj.index.tolist() == [(0,1), (0,2), (1,2)]
+    assert adj.tolist() == [8, 7, 1]
+
+
+def test_compute_adjacencies_random():
+    labels = np.random.randint(0, 5, size=(20,21,22), dtype=np.uint32)
+    adj = compute_adjacencies(labels, include_zero=True)
+
+    # Brute force
+    expected = {}
+    for axis in range(3):
+        left = (slice(None),)*axis + (slice(None, -1),)
+        right = (slice(None),)*axis + (slice(1, None),)
+        edges = (labels[left] != labels[right])
+        pairs = np.sort(np.array([labels[left][edges], labels[right][edges]]).transpose(), axis=1)
+        for pair in map(tuple, pairs.tolist()):
+            expected[pair] = expected.get(pair, 0) + 1
+
+    assert adj.index.tolist() == sorted(expected.keys())
+    assert adj.tolist() == [expected[k] for k in sorted(expected.keys())]
+
+
+def test_connected_components():
+    _ = 0
+    labels = [[1,1,_,2,2],
+              [_,1,_,_,2],
+              [3,_,1,1,_],
+              [3,3,_,1,1]]
+    labels = np.array(labels, np.uint64)
+
+    expected = [[1,1,_,2,2],
+                [_,1,_,_,2],
+                [3,_,4,4,_],
+                [3,3,_,4,4]]
+
+    cc = connected_components(labels)
+    assert cc.dtype == np.uint32
+    assert (cc == expected).all()
+
+    cc, num = connected_components(labels, return_num=True)
+    assert num == 4
+
+    # In-place
+    cc = connected_components(labels, out=labels)
+    assert cc is labels
+    assert (labels == expected).all()
+
+
+def test_connected_components_random():
+    import skimage.measure as skm
+
+    labels = np.random.randint(0, 3, size=(20,21,22), dtype=np.uint8)
+    cc, num = connected_components(labels, return_num=True)
+    expected = skm.label(labels, background=0, connectivity=1)
+    assert num == expected.max()
+
+    # Same components (but not necessarily the same numbering)
+    table = contingency_table(cc, expected)
+    assert len(table) == num + 1
+    assert table.index.get_level_values('left').nunique() == num + 1
+    assert table.index.get_level_values('right').nunique() == num + 1
+
+    # Numbered in C-order
+    first_seen = pd.unique(cc.reshape(-1))
+    first_seen = first_seen[first_seen != 0]
+    assert (first_seen == np.arange(1, num+1)).all()
+
+
 def test_split_disconnected_bodies():
 
     _ = 2 # for readability in the array below
@@ -115,5 +226,61 @@ def test_split_disconnected_bodies():
         "Applying mapping to the relabeled image did not recreate the original image."
 
 
+@pytest.mark.skipif(not os.environ.get('NEUCLEASE_BENCHMARKS'),
+                    reason="Set NEUCLEASE_BENCHMARKS=1 to run benchmarks")
+def test_segmentation_benchmark():
+    """
+    Report the wall time of the compiled label-volume kernels
+    (edge_mask, compute_adjacencies, contingency_table, split_disconnected_bodies)
+    for a synthetic label volume.
+    The default size is modest; set NEUCLEASE_BENCHMARK_SEGMENTATION_WIDTH
+    (e.g. to 512) for a full-scale benchmark.
+    """
+    width = int(os.environ.get('NEUCLEASE_BENCHMARK_SEGMENTATION_WIDTH', 128))
+
+    # Blocky 'segments' of random sizes, with some duplicated labels (which must be split),
+    # and a second segmentation with different boundaries for the contingency table.
+    rng = np.random.default_rng(0)
+    cuts = [np.sort(rng.choice(np.arange(1, width), width // 8, replace=False)) for _ in range(3)]
+    z, y, x = np.ix_(*(np.searchsorted(c, np.arange(width), side='right') for c in cuts))
+    labels = (z * (width // 8 + 1)**2 + y * (width // 8 + 1) + x).astype(np.uint64)
+    labels = rng.permutation(labels.max() + 1).astype(np.uint64)[labels] % (labels.max() // 2)
+    other_labels = (labels + np.arange(width, dtype=np.uint64)[:, None, None] // 32) // 2
+
+    # Compile first
+    small = labels[:2, :2, :2].copy()
+    edge_mask(small, 'both')
+    compute_adjacencies(small)
+    contingency_table(small, other_labels[:2, :2, :2].copy())
+    split_disconnected_bodies(small)
+
+    timings = {}
+
+    start = time.time()
+    mask = edge_mask(labels, 'both')
+    timings['edge_mask'] = time.time() - start
+
+    start = time.time()
+    adj = compute_adjacencies(labels)
+    timings['compute_adjacencies'] = time.time() - start
+
+    start = time.time()
+    table = contingency_table(labels, other_labels)
+    timings['contingency_table'] = time.time() - start
+
+    start = time.time()
+    split, _mapping, _unique = split_disconnected_bodies(labels)
+    timings['split_disconnected_bodies'] = time.time() - start
+
+    assert mask.any()
+    assert len(adj) > 0
+    assert table.sum() == labels.size
+    assert split.shape == labels.shape
+
+    print(f"\nSegmentation kernels for a {width}^3 volume:")
+    for name, elapsed in timings.items():
+        print(f"  {name}: {elapsed:.2f}s")
+
+
 if __name__ == "__main__":
     pytest.main(['-s', '--tb=native', '--pyargs', 'neuclease.tests.test_segmentation'])
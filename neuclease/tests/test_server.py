@@ -1,6 +1,7 @@
 import os
 import sys
 import time
+import base64
 import signal
 import logging
 import functools
@@ -8,6 +9,7 @@ import subprocess
 
 import pytest
 import requests
+import numpy as np
 
 import neuclease
 
@@ -107,6 +109,31 @@ def test_simple_request(cleave_server_setup):
     assert assignments["2"] == [4,5]
             
 
+@show_request_exceptions
+def test_base64_assignments(cleave_server_setup):
+    """
+    Request the compact (base64-encoded uint64) assignments format.
+    """
+    dvid_server, dvid_port, dvid_repo, port = cleave_server_setup
+
+    data = { "user": "bergs",
+             "body-id": 1,
+             "port": dvid_port,
+             "seeds": {"1": [1], "2": [5]},
+             "server": dvid_server,
+             "uuid": dvid_repo,
+             "segmentation-instance": "segmentation",
+             "mesh-instance": "segmentation_meshes_tars",
+             "assignments-format": "base64-uint64" }
+
+    r = requests.post(f'http://127.0.0.1:{port}/compute-cleave', json=data)
+    r.raise_for_status()
+
+    assignments = r.json()["assignments"]
+    assert np.frombuffer(base64.b64decode(assignments["1"]), '<u8').tolist() == [1,2,3]
+    assert np.frombuffer(base64.b64decode(assignments["2"]), '<u8').tolist() == [4,5]
+
+
 @show_request_exceptions
 def test_fetch_log(cleave_server_setup):
     """
@@ -19,7 +19,19 @@ def test_get_fullres_mask():
     expected = np.zeros((140, 130), dtype=bool)
     expected[:90,:80] = full_mask[10:, 20:]
     assert (extracted == expected).all()
-    
+
+
+def test_get_fullres_mask_unaligned():
+    coarse_mask = np.random.randint(2, size=(10,10), dtype=bool)
+    full_mask = upsample(coarse_mask, 10)
+    sbm = SparseBlockMask(coarse_mask, [(0,0), (100,100)], (10,10))
+
+    extracted = sbm.get_fullres_mask([(3,-7), (95,121)])
+    assert extracted.shape == (92, 128)
+    expected = np.zeros((92, 128), dtype=bool)
+    expected[:, 7:107] = full_mask[3:95, :]
+    assert (extracted == expected).all()
+
 
 def test_sparse_boxes_NO_OFFSET():
     block_mask = np.zeros((5,6,7), dtype=bool)
@@ -84,6 +96,9 @@ def test_sparse_boxes_WITH_OFFSET():
                                [[0, 10, 60], [10, 20, 70]],
                                [[0, 20, 30], [10, 30, 60]]]).all() 
 
+    lazy_boxes = sparse_block_mask.sparse_boxes(brick_grid, return_logical_boxes=False, lazy=True)
+    assert (np.array([*lazy_boxes]) == physical_boxes).all()
+
     
 if __name__ == "__main__":
     pytest.main(['-s', '--tb=native', '--pyargs', 'neuclease.tests.test_sparse_block_mask'])
@@ -0,0 +1,87 @@
+import pytest
+import numpy as np
+
+from neuclease.util import SparseBlockVolume
+
+
+@pytest.fixture
+def scattered_blocks():
+    rng = np.random.default_rng(0)
+    corners = np.array([[0, 0, 0], [0, 8, 16], [16, 0, 8], [24, 24, 24]]) + (8, -8, 0)
+    blocks = rng.integers(1, 5, size=(len(corners), 8, 8, 8), dtype=np.uint64)
+
+    box = np.array([corners.min(axis=0), corners.max(axis=0) + 8])
+    dense = np.zeros(box[1] - box[0], np.uint64)
+    for corner, block in zip(corners - box[0], blocks):
+        z, y, x = corner
+        dense[z:z+8, y:y+8, x:x+8] = block
+
+    return corners, blocks, box, dense
+
+
+def test_sparse_block_volume_dense(scattered_blocks):
+    corners, blocks, box, dense = scattered_blocks
+    sbv = SparseBlockVolume(corners, blocks)
+    assert (sbv.box == box).all()
+    assert sbv.shape == dense.shape
+    assert (sbv.to_dense() == dense).all()
+    assert (np.asarray(sbv) == dense).all()
+
+    # Slicing is relative to the volume's box, just like the dense array.
+    assert (sbv[3:20, :, 5:-3] == dense[3:20, :, 5:-3]).all()
+    assert (sbv[10] == dense[10]).all()
+    assert (sbv[-1, 2:5] == dense[-1, 2:5]).all()
+
+    # Boxes outside the volume are permitted
+    outer_box = box + [[-5, -5, -5], [5, 5, 5]]
+    expected = np.zeros(outer_box[1] - outer_box[0], np.uint64)
+    expected[5:-5, 5:-5, 5:-5] = dense
+    assert (sbv.extract_box(outer_box) == expected).all()
+
+    assert (sbv.block(corners[2]) == blocks[2]).all()
+    assert sbv.block((1000, 1000, 1000)) is None
+
+
+def test_sparse_block_volume_operations(scattered_blocks):
+    corners, blocks, _box, dense = scattered_blocks
+    sbv = SparseBlockVolume(corners, blocks)
+
+    assert (sbv.unique() == np.unique(dense)).all()
+    assert ((sbv == 3).to_dense() == (dense == 3)).all()
+    assert (sbv.isin([1, 2]).to_dense() == np.isin(dense, [1, 2])).all()
+    assert sbv.count_nonzero() == np.count_nonzero(dense)
+
+    # No implicit zeros if the blocks cover the whole box.
+    full = SparseBlockVolume(corners[:1], blocks[:1])
+    assert 0 not in full.unique()
+
+
+def test_sparse_block_volume_fill_value(scattered_blocks):
+    corners, blocks, _box, dense = scattered_blocks
+    sbv = SparseBlockVolume(corners, blocks)
+
+    # Predicates which are true for the (implicit) zeros
+    assert ((sbv == 0).to_dense() == (dense == 0)).all()
+    assert (sbv == 0).count_nonzero() == np.count_nonzero(dense == 0)
+    assert ((sbv != 3).to_dense() == (dense != 3)).all()
+    assert (sbv != 3).count_nonzero() == np.count_nonzero(dense != 3)
+    assert (sbv.isin([0, 2]).to_dense() == np.isin(dense, [0, 2])).all()
+    assert sbv.isin([0, 2]).count_nonzero() == np.count_nonzero(np.isin(dense, [0, 2]))
+    assert ((sbv != 3)[2:10, 5] == (dense != 3)[2:10, 5]).all()
+    assert ((sbv == 0).unique() == np.unique(dense == 0)).all()
+
+    # A single block within a larger box
+    v = SparseBlockVolume(np.zeros((1, 3)), np.full((1, 4, 4, 4), 5, np.uint64), [(0, 0, 0), (4, 4, 8)])
+    assert (v == 0).count_nonzero() == 64
+    assert (v != 5).count_nonzero() == 64
+    assert v.isin([0]).count_nonzero() == 64
+
+    filled = SparseBlockVolume(corners, blocks, fill_value=7)
+    expected = SparseBlockVolume(corners, blocks).to_dense()
+    expected[SparseBlockVolume(corners, np.ones_like(blocks)).to_dense() == 0] = 7
+    assert (filled.to_dense() == expected).all()
+    assert filled.count_nonzero() == np.count_nonzero(expected)
+    assert (filled.unique() == np.unique(expected)).all()
+
+    with pytest.raises(TypeError):
+        hash(sbv)
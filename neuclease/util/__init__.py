@@ -5,6 +5,7 @@ from .table import *
 from .box import *
 from .grid import *
 from .sparse_block_mask import *
+from .sparse_block_volume import *
 from .graph import *
 from .downsample_with_numba import *
 from .skeleton import *
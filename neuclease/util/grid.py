@@ -1,3 +1,6 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
 import numpy as np
 import pandas as pd
 
@@ -516,3 +519,230 @@ def fetch_volume_in_chunks(bounding_box, grid, fetch_fn, threads=0, dtype=None):
                       total=num_boxes,
                       initial=prog_start )
     return vol
+
+
+def iter_grid_chunks(bounding_box, grid, chunk_fn, *, fetch_fn=None, sbm=None, clipped=True,
+                     threads=0, processes=0, max_inflight=None, ordered=False, show_progress=True):
+    """
+    Generator.
+
+    Stream the chunks of a large volume (as defined by a Grid, including its halo)
+    through a function, optionally in parallel, and yield the result for each chunk.
+    Unlike ``fetch_volume_in_chunks()``, the volume is never assembled.
+    See also ``reduce_grid_chunks()``.
+
+    Args:
+        bounding_box:
+            The region to process.
+
+        grid:
+            The chunking scheme (a Grid, block shape, or block width).
+            If the Grid has a halo, each chunk is expanded by the halo,
+            so neighboring chunks overlap.
+
+        chunk_fn:
+            The function to call for each chunk.
+            If no fetch_fn is given, it is called as:
+
+                result = chunk_fn(box, logical_box)
+
+            Otherwise, it is called with the fetched chunk:
+
+                result = chunk_fn(vol, box, logical_box)
+
+            where box includes the halo and logical_box does not.
+            (To avoid counting voxels twice, restrict your results to the logical box.)
+
+        fetch_fn:
+            Optional. A function to fetch the voxels of each chunk (including halo):
+
+                vol = fetch_fn(box)
+
+            It is called in the same worker as chunk_fn.
+
+        sbm:
+            Optional. A SparseBlockMask. If given, chunks which don't
+            intersect the mask are skipped. The mask resolution must
+            divide the grid's block shape.
+
+        clipped:
+            If True, no chunk (or halo) extends beyond the bounding_box.
+
+        threads, processes:
+            Process chunks in a thread pool or process pool.
+            (Specify at most one.  If neither is given, process chunks serially.)
+            When using processes, chunk_fn and fetch_fn must be picklable.
+
+        max_inflight:
+            At most this many chunks will be submitted to the pool without their
+            results having been yielded, which bounds the RAM usage if chunk_fn
+            returns large results or the consumer is slower than the workers.
+            Defaults to 2x the number of workers.
+
+        ordered:
+            If True, yield results in grid order.
+            Otherwise, yield them in the order they are completed.
+
+        show_progress:
+            If True, show a progress bar.
+
+    Yields:
+        (logical_box, result)
+    """
+    assert not (threads and processes), "Specify either threads or processes (not both)"
+    boxes, logical_boxes = _grid_chunk_boxes(bounding_box, grid, sbm, clipped)
+    progress = tqdm_proxy(total=len(boxes), disable=not show_progress)
+
+    if not threads and not processes:
+        for box, logical_box in zip(boxes, logical_boxes):
+            yield logical_box, _process_grid_chunk(chunk_fn, fetch_fn, box, logical_box)
+            progress.update(1)
+        progress.close()
+        return
+
+    workers = threads or processes
+    max_inflight = max_inflight or 2*workers
+    if threads:
+        executor = ThreadPoolExecutor(threads)
+    else:
+        executor = ProcessPoolExecutor(processes)
+
+    with executor:
+        remaining = iter(zip(boxes, logical_boxes))
+        pending = deque()
+
+        def submit_chunks():
+            while len(pending) < max_inflight:
+                item = next(remaining, None)
+                if item is None:
+                    break
+                box, logical_box = item
+                future = executor.submit(_process_grid_chunk, chunk_fn, fetch_fn, box, logical_box)
+                pending.append((future, logical_box))
+
+        submit_chunks()
+        try:
+            while pending:
+                if ordered:
+                    future, logical_box = pending.popleft()
+                    result = future.result()
+                else:
+                    wait([f for f, _ in pending], return_when=FIRST_COMPLETED)
+                    i = next(i for i, (f, _) in enumerate(pending) if f.done())
+                    future, logical_box = pending[i]
+                    del pending[i]
+                    result = future.result()
+
+                del future
+                yield logical_box, result
+                del result
+                progress.update(1)
+                submit_chunks()
+        finally:
+            for future, _ in pending:
+                future.cancel()
+            progress.close()
+
+
+def reduce_grid_chunks(bounding_box, grid, chunk_fn, reduce_fn='list', initial=None, **kwargs):
+    """
+    Map/reduce over the chunks of a large volume.
+
+    Each chunk is processed as described in ``iter_grid_chunks()``
+    (which accepts the same keyword arguments), and the results are
+    combined as they arrive, so the complete volume is never held in RAM.
+    Results of None are skipped.
+
+    Args:
+        reduce_fn:
+            How to combine the results. Either:
+
+            - 'list': Return a list of the results.
+            - 'concat': Return ``pd.concat()`` of the (DataFrame) results.
+            - 'sum': Return the sum of the results, starting with ``initial`` (if given).
+            - A callable, which is called in the calling thread as
+              ``acc = reduce_fn(acc, result)``, starting with ``acc = initial``.
+              For example, a function that writes each result to DVID.
+
+        initial:
+            The starting value for 'sum' or a callable reduce_fn.
+
+    Returns:
+        The reduced result, as described above.
+
+    Example:
+
+        def count_voxels(vol, box, logical_box):
+            vol = vol[box_to_slicing(*(logical_box - box[0]))]
+            return pd.Series(vol.reshape(-1)).value_counts()
+
+        sizes = reduce_grid_chunks(box, Grid((256,256,256)), count_voxels, 'sum',
+                                   fetch_fn=partial(fetch_labelmap_voxels, *seg), threads=8)
+    """
+    assert reduce_fn in ('list', 'concat', 'sum') or callable(reduce_fn)
+    acc = initial
+    results = []
+    for _logical_box, result in iter_grid_chunks(bounding_box, grid, chunk_fn, **kwargs):
+        if result is None:
+            continue
+        if reduce_fn in ('list', 'concat'):
+            results.append(result)
+        elif reduce_fn == 'sum':
+            if acc is None:
+                acc = result
+            elif isinstance(acc, pd.Series):
+                # Series.add() produces floats if the indexes don't match.
+                dtype = np.result_type(acc.dtype, result.dtype)
+                acc = acc.add(result, fill_value=0).astype(dtype, copy=False)
+            else:
+                acc = acc + result
+        else:
+            acc = reduce_fn(acc, result)
+
+    if reduce_fn == 'list':
+        return results
+    if reduce_fn == 'concat':
+        if len(results) == 0:
+            return pd.DataFrame()
+        return pd.concat(results, sort=True)
+    return acc
+
+
+def _grid_chunk_boxes(bounding_box, grid, sbm, clipped):
+    """
+    Return the (halo) boxes and logical boxes for iter_grid_chunks().
+    """
+    bounding_box = np.asarray(bounding_box, dtype=int)
+    if not isinstance(grid, Grid):
+        if not hasattr(grid, '__len__'):
+            grid = (grid,)*len(bounding_box[0])
+        grid = Grid(grid)
+
+    if sbm is None:
+        logical_boxes = boxes_from_grid(bounding_box, grid, include_halos=False)
+    else:
+        logical_boxes = sbm.sparse_boxes(Grid(grid.block_shape, grid.offset), return_logical_boxes=True)
+        logical_boxes = np.asarray(logical_boxes, dtype=int).reshape(-1, 2, bounding_box.shape[1])
+        lo = np.maximum(logical_boxes[:, 0], bounding_box[0])
+        hi = np.minimum(logical_boxes[:, 1], bounding_box[1])
+        logical_boxes = logical_boxes[(hi > lo).all(axis=1)]
+
+    if clipped:
+        logical_boxes[:, 0] = np.maximum(logical_boxes[:, 0], bounding_box[0])
+        logical_boxes[:, 1] = np.minimum(logical_boxes[:, 1], bounding_box[1])
+
+    boxes = logical_boxes.copy()
+    boxes[:, 0] -= grid.halo_shape
+    boxes[:, 1] += grid.halo_shape
+    if clipped:
+        boxes[:, 0] = np.maximum(boxes[:, 0], bounding_box[0])
+        boxes[:, 1] = np.minimum(boxes[:, 1], bounding_box[1])
+
+    return boxes, logical_boxes
+
+
+def _process_grid_chunk(chunk_fn, fetch_fn, box, logical_box):
+    if fetch_fn is None:
+        return chunk_fn(box, logical_box)
+    vol = fetch_fn(box)
+    return chunk_fn(vol, box, logical_box)
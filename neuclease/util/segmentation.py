@@ -277,19 +277,24 @@ def edge_mask(label_img, mode='before', mark_volume_edges=False):
          [0 1 1 0 0 0]
          [1 1 0 0 0 0]]
     """
+    assert mode in ('before', 'after', 'both')
     label_img = np.asarray(label_img)
     mask = np.zeros(label_img.shape, bool)
 
-    for axis in range(label_img.ndim):
-        left_slicing = ((slice(None),) * axis) + (np.s_[:-1],)
-        right_slicing = ((slice(None),) * axis) + (np.s_[1:],)
+    if label_img.ndim <= 3:
+        # Single compiled pass over all axes (no per-axis temporaries).
+        _edge_mask_3d(_as_3d(label_img), mode in ('before', 'both'), mode in ('after', 'both'), _as_3d(mask))
+    else:
+        for axis in range(label_img.ndim):
+            left_slicing = ((slice(None),) * axis) + (np.s_[:-1],)
+            right_slicing = ((slice(None),) * axis) + (np.s_[1:],)
 
-        m = edge_mask_for_axis(label_img, axis)
-        if mode in ('before', 'both'):
-            mask[left_slicing] |= m
+            m = edge_mask_for_axis(label_img, axis)
+            if mode in ('before', 'both'):
+                mask[left_slicing] |= m
 
-        if mode in ('after', 'both'):
-            mask[right_slicing] |= m
+            if mode in ('after', 'both'):
+                mask[right_slicing] |= m
 
     if mark_volume_edges:
         for axis in range(mask.ndim):
@@ -302,6 +307,39 @@ def edge_mask(label_img, mode='before', mark_volume_edges=False):
     return mask
 
 
+def _as_3d(a):
+    """
+    Return a view of the given 1D, 2D, or 3D array with
+    unit-length axes prepended as needed to make it 3D.
+    """
+    assert a.ndim <= 3
+    return a.reshape((1,) * (3 - a.ndim) + a.shape)
+
+
+@njit(nogil=True)
+def _edge_mask_3d(label_vol, before, after, mask):
+    Z, Y, X = label_vol.shape
+    for z in range(Z):
+        for y in range(Y):
+            for x in range(X):
+                v = label_vol[z, y, x]
+                if x + 1 < X and label_vol[z, y, x+1] != v:
+                    if before:
+                        mask[z, y, x] = True
+                    if after:
+                        mask[z, y, x+1] = True
+                if y + 1 < Y and label_vol[z, y+1, x] != v:
+                    if before:
+                        mask[z, y, x] = True
+                    if after:
+                        mask[z, y+1, x] = True
+                if z + 1 < Z and label_vol[z+1, y, x] != v:
+                    if before:
+                        mask[z, y, x] = True
+                    if after:
+                        mask[z+1, y, x] = True
+
+
 def edge_mask_for_axis( label_img, axis ):
     """
     Find all supervoxel edges along the given axis and return
@@ -465,29 +503,149 @@ def compute_adjacencies(label_vol, max_dilation=0, include_zero=False, return_di
 
 
 def _compute_adjacencies(label_vol, include_zero=False):
-    all_label_pairs = []
-    for axis in range(label_vol.ndim):
-        left_slicing = ((slice(None),) * axis) + (np.s_[:-1],)
-        right_slicing = ((slice(None),) * axis) + (np.s_[1:],)
-
-        edge_mask = (label_vol[left_slicing] != label_vol[right_slicing])
-        left_labels = label_vol[left_slicing][edge_mask]
-        right_labels = label_vol[right_slicing][edge_mask]
-        
-        label_pairs = np.array([left_labels, right_labels]).transpose()
-        label_pairs.sort(axis=1)
-        
-        if not include_zero:
-            keep_rows = (label_pairs[:,0] != 0) & (label_pairs[:,1] != 0)
-            label_pairs = label_pairs[keep_rows]
-        
-        all_label_pairs.append(label_pairs)
-    
-    all_label_pairs = np.concatenate(all_label_pairs, axis=0)
-    df = pd.DataFrame(all_label_pairs, columns=['label_a', 'label_b'])
-    areas = df.groupby(['label_a', 'label_b']).size().rename('edge_area')
-    return areas
-    
+    if label_vol.ndim <= 3:
+        label_a, label_b, counts = _adjacency_pairs_3d(_as_3d(label_vol), include_zero)
+    else:
+        all_label_pairs = []
+        for axis in range(label_vol.ndim):
+            left_slicing = ((slice(None),) * axis) + (np.s_[:-1],)
+            right_slicing = ((slice(None),) * axis) + (np.s_[1:],)
+
+            edge_mask = (label_vol[left_slicing] != label_vol[right_slicing])
+            left_labels = label_vol[left_slicing][edge_mask]
+            right_labels = label_vol[right_slicing][edge_mask]
+
+            label_pairs = np.array([left_labels, right_labels]).transpose()
+            label_pairs.sort(axis=1)
+
+            if not include_zero:
+                keep_rows = (label_pairs[:,0] != 0) & (label_pairs[:,1] != 0)
+                label_pairs = label_pairs[keep_rows]
+
+            all_label_pairs.append(label_pairs)
+
+        all_label_pairs = np.concatenate(all_label_pairs, axis=0)
+        label_a, label_b = all_label_pairs.transpose()
+        counts = np.ones(len(all_label_pairs), np.int64)
+
+    label_a, label_b, counts = _sum_pair_counts(label_a, label_b, counts)
+    index = pd.MultiIndex.from_arrays([label_a, label_b], names=['label_a', 'label_b'])
+    return pd.Series(counts, index=index, name='edge_area')
+
+
+@njit(nogil=True)
+def _grow_buffer(buf, n):
+    """
+    Return a copy of the given buffer with twice the capacity,
+    containing the first n items of the original.
+    """
+    new_buf = np.empty(2 * len(buf), buf.dtype)
+    new_buf[:n] = buf[:n]
+    return new_buf
+
+
+# Number of slots in the direct-mapped cache used to merge duplicate
+# label pairs as they're found (before they're sorted and summed).
+_PAIR_CACHE_SLOTS = 2**12
+
+
+@njit(nogil=True)
+def _pair_cache_slot(a, b):
+    h = np.uint64(a) * np.uint64(0x9E3779B97F4A7C15)
+    h ^= np.uint64(b) * np.uint64(0xC2B2AE3D27D4EB4F)
+    h ^= h >> np.uint64(32)
+    return np.int64(h & np.uint64(_PAIR_CACHE_SLOTS - 1))
+
+
+@njit(nogil=True)
+def _adjacency_pairs_3d(label_vol, include_zero):
+    """
+    Find all pairs of adjacent voxels with different labels,
+    and return them as (label_a, label_b, count) arrays, with label_a < label_b.
+
+    Recently seen pairs are kept in a small cache, so most duplicates
+    are merged as the volume is scanned, but the same pair may
+    still be listed more than once.  See _sum_pair_counts().
+    """
+    Z, Y, X = label_vol.shape
+    capacity = 1024
+    label_a = np.empty(capacity, label_vol.dtype)
+    label_b = np.empty(capacity, label_vol.dtype)
+    counts = np.empty(capacity, np.int64)
+    cache = np.full(_PAIR_CACHE_SLOTS, -1, np.int64)
+    n = 0
+
+    for z in range(Z):
+        for y in range(Y):
+            for x in range(X):
+                v = label_vol[z, y, x]
+                for axis in range(3):
+                    if axis == 0:
+                        if z + 1 == Z:
+                            continue
+                        w = label_vol[z+1, y, x]
+                    elif axis == 1:
+                        if y + 1 == Y:
+                            continue
+                        w = label_vol[z, y+1, x]
+                    else:
+                        if x + 1 == X:
+                            continue
+                        w = label_vol[z, y, x+1]
+
+                    if v == w:
+                        continue
+                    if not include_zero and (v == 0 or w == 0):
+                        continue
+
+                    a = min(v, w)
+                    b = max(v, w)
+
+                    slot = _pair_cache_slot(a, b)
+                    i = cache[slot]
+                    if i >= 0 and label_a[i] == a and label_b[i] == b:
+                        counts[i] += 1
+                        continue
+
+                    if n == capacity:
+                        label_a = _grow_buffer(label_a, n)
+                        label_b = _grow_buffer(label_b, n)
+                        counts = _grow_buffer(counts, n)
+                        capacity *= 2
+
+                    label_a[n] = a
+                    label_b[n] = b
+                    counts[n] = 1
+                    cache[slot] = n
+                    n += 1
+
+    return label_a[:n], label_b[:n], counts[:n]
+
+
+def _sum_pair_counts(left, right, counts):
+    """
+    Given a list of label pairs and counts (possibly with duplicate pairs),
+    sort the pairs and sum the counts of duplicates.
+
+    Returns:
+        (left, right, counts), sorted by (left, right), without duplicates.
+    """
+    order = np.lexsort((right, left))
+    return _sum_sorted_pair_counts(left[order], right[order], counts[order])
+
+
+@njit(nogil=True)
+def _sum_sorted_pair_counts(left, right, counts):
+    n = 0
+    for i in range(len(left)):
+        if n > 0 and left[i] == left[n-1] and right[i] == right[n-1]:
+            counts[n-1] += counts[i]
+        else:
+            left[n] = left[i]
+            right[n] = right[i]
+            counts[n] = counts[i]
+            n += 1
+    return left[:n], right[:n], counts[:n]
 
 
 def contingency_table(left_vol, right_vol):
@@ -502,14 +660,216 @@ def contingency_table(left_vol, right_vol):
     
     Returns:
         pd.Series of sizes with a multi-level index (left,right),
-        named 'voxel_count'.
+        named 'voxel_count', sorted by (left,right).
     """
     assert left_vol.shape == right_vol.shape
-    df = pd.DataFrame( {"left": left_vol.reshape(-1),
-                        "right": right_vol.reshape(-1)})
-    sizes = df.groupby(['left', 'right'], sort=False).size()
-    sizes.name = 'voxel_count'
-    return sizes
+    left, right, counts = _overlap_pairs(left_vol.reshape(-1), right_vol.reshape(-1))
+    left, right, counts = _sum_pair_counts(left, right, counts)
+    index = pd.MultiIndex.from_arrays([left, right], names=['left', 'right'])
+    return pd.Series(counts, index=index, name='voxel_count')
+
+
+@njit(nogil=True)
+def _overlap_pairs(left_vol, right_vol):
+    """
+    Return (left, right, count) arrays for the label pairs in the given (flat) volumes.
+    As in _adjacency_pairs_3d(), most (but not all) duplicate pairs are merged.
+    """
+    capacity = 1024
+    left = np.empty(capacity, left_vol.dtype)
+    right = np.empty(capacity, right_vol.dtype)
+    counts = np.empty(capacity, np.int64)
+    cache = np.full(_PAIR_CACHE_SLOTS, -1, np.int64)
+    n = 0
+
+    for i in range(len(left_vol)):
+        l = left_vol[i]
+        r = right_vol[i]
+
+        # Fast path for runs of identical pairs
+        if n > 0 and left[n-1] == l and right[n-1] == r:
+            counts[n-1] += 1
+            continue
+
+        slot = _pair_cache_slot(l, r)
+        j = cache[slot]
+        if j >= 0 and left[j] == l and right[j] == r:
+            counts[j] += 1
+            continue
+
+        if n == capacity:
+            left = _grow_buffer(left, n)
+            right = _grow_buffer(right, n)
+            counts = _grow_buffer(counts, n)
+            capacity *= 2
+
+        left[n] = l
+        right[n] = r
+        counts[n] = 1
+        cache[slot] = n
+        n += 1
+
+    return left[:n], right[:n], counts[:n]
+
+
+def connected_components(label_vol, out=None, return_num=False):
+    """
+    Label the connected components of each segment in a 1D, 2D, or 3D label volume.
+
+    Adjacent voxels (sharing a face) belong to the same component if they have the
+    same (nonzero) label.  Components are numbered 1..N, in the order in which
+    they are first encountered (in C-order), and voxels of label 0 are left as 0.
+    Except for the order of the component IDs, this is equivalent to
+    ``skimage.measure.label(label_vol, background=0, connectivity=1)``.
+
+    Args:
+        label_vol:
+            Label volume, up to 3D.
+        out:
+            Optional array in which to write the result (it may be the input volume itself).
+            Its dtype must be able to hold ``label_vol.size``.
+            By default, a uint32 array is returned if possible, otherwise uint64.
+        return_num:
+            If True, also return the number of components.
+
+    Returns:
+        The component volume, or (component_vol, num_components) if return_num=True.
+    """
+    label_vol = np.asarray(label_vol)
+    assert label_vol.ndim <= 3, "Only 1D, 2D, or 3D volumes are supported"
+
+    if out is None:
+        if label_vol.size < 2**32:
+            out = np.empty(label_vol.shape, np.uint32)
+        else:
+            out = np.empty(label_vol.shape, np.uint64)
+    assert out.shape == label_vol.shape
+    assert np.issubdtype(out.dtype, np.integer) and np.iinfo(out.dtype).max >= label_vol.size, \
+        f"Output dtype {out.dtype} is too small for a volume of {label_vol.size} voxels"
+
+    num_components = _connected_components_3d(_as_3d(label_vol), _as_3d(out))
+    if return_num:
+        return out, num_components
+    return out
+
+
+@njit(nogil=True)
+def _find_root(parent, i):
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        next_i = parent[i]
+        parent[i] = root
+        i = next_i
+    return root
+
+
+@njit(nogil=True)
+def _union(parent, a, b):
+    """
+    Merge the sets containing provisional labels a and b, and return the merged set's root.
+    The root of each set is always its smallest member.
+    If a is 0, it is ignored.
+    """
+    rb = _find_root(parent, b)
+    if a == 0:
+        return rb
+    ra = _find_root(parent, a)
+    if ra < rb:
+        parent[rb] = ra
+        return ra
+    parent[ra] = rb
+    return rb
+
+
+@njit(nogil=True)
+def _connected_components_3d(label_vol, out):
+    """
+    Two-pass union-find connected components.
+    The provisional labels are written directly into ``out``.
+    Only the current and previous planes of the input are kept
+    aside, so label_vol and out may be the same array.
+    """
+    Z, Y, X = label_vol.shape
+    parent = np.empty(1024, np.int64)
+    parent[0] = 0
+    n = 0
+
+    prev_plane = np.empty((Y, X), label_vol.dtype)
+    plane = np.empty((Y, X), label_vol.dtype)
+
+    for z in range(Z):
+        prev_plane, plane = plane, prev_plane
+        plane[:] = label_vol[z]
+        for y in range(Y):
+            for x in range(X):
+                v = plane[y, x]
+                if v == 0:
+                    out[z, y, x] = 0
+                    continue
+
+                cc = np.int64(0)
+                if x > 0 and plane[y, x-1] == v:
+                    cc = np.int64(out[z, y, x-1])
+                if y > 0 and plane[y-1, x] == v:
+                    cc = _union(parent, cc, np.int64(out[z, y-1, x]))
+                if z > 0 and prev_plane[y, x] == v:
+                    cc = _union(parent, cc, np.int64(out[z-1, y, x]))
+
+                if cc == 0:
+                    n += 1
+                    if n == len(parent):
+                        parent = _grow_buffer(parent, n)
+                    parent[n] = n
+                    cc = n
+
+                out[z, y, x] = cc
+
+    # Since each set's root is its smallest (i.e. earliest) provisional
+    # label, numbering the roots in order yields the final labels in C-order.
+    final = np.zeros(n+1, np.int64)
+    num_components = 0
+    for i in range(1, n+1):
+        if parent[i] == i:
+            num_components += 1
+            final[i] = num_components
+        else:
+            final[i] = final[parent[i]]
+
+    for z in range(Z):
+        for y in range(Y):
+            for x in range(X):
+                out[z, y, x] = final[out[z, y, x]]
+
+    return num_components
+
+
+@njit(nogil=True)
+def _component_labels_and_sizes(label_vol, cc_vol, num_components):
+    """
+    For each component in cc_vol, return its label in label_vol and its size.
+    (Index 0 corresponds to the background.)
+    """
+    labels = np.zeros(num_components+1, label_vol.dtype)
+    sizes = np.zeros(num_components+1, np.int64)
+    Z, Y, X = label_vol.shape
+    for z in range(Z):
+        for y in range(Y):
+            for x in range(X):
+                c = cc_vol[z, y, x]
+                labels[c] = label_vol[z, y, x]
+                sizes[c] += 1
+    return labels, sizes
+
+
+@njit(nogil=True)
+def _relabel_inplace_3d(vol, table):
+    Z, Y, X = vol.shape
+    for z in range(Z):
+        for y in range(Y):
+            for x in range(X):
+                vol[z, y, x] = table[vol[z, y, x]]
 
 
 def split_disconnected_bodies(labels_orig):
@@ -522,10 +882,6 @@ def split_disconnected_bodies(labels_orig):
     the original body label.
 
     Special exception: Segments with label 0 are not relabeled.
-    
-    Note:
-        Requires scikit-image (which, currently, is not otherwise
-        listed as a dependency of neuclease's conda-recipe).
 
     Args:
         labels_orig (numpy.array): 3D array of labels
@@ -554,47 +910,48 @@ def split_disconnected_bodies(labels_orig):
                 new_unique_labels[new_unique_labels < min(new_to_orig.keys())]
         
     """
-    import skimage.measure as skm
-    # Compute connected components and cast back to original dtype
-    labels_cc = skm.label(labels_orig, background=0, connectivity=1)
-    assert labels_cc.dtype == np.int64
-    if labels_orig.dtype == np.uint64:
-        labels_cc = labels_cc.view(np.uint64)
+    # Compute connected components in a buffer of the original
+    # dtype if possible, so it can be relabeled in-place below.
+    if np.issubdtype(labels_orig.dtype, np.integer) and np.iinfo(labels_orig.dtype).max >= labels_orig.size:
+        labels_cc = np.empty(labels_orig.shape, labels_orig.dtype)
     else:
-        labels_cc = labels_cc.astype(labels_orig.dtype, copy=False)
+        labels_cc = np.empty(labels_orig.shape, np.uint64)
+    labels_cc, num_cc = connected_components(labels_orig, labels_cc, return_num=True)
 
-    # Find overlapping segments between orig and CC volumes
-    overlap_table_df = contingency_table(labels_orig, labels_cc).reset_index()
-    assert overlap_table_df.columns.tolist() == ['left', 'right', 'voxel_count']
-    overlap_table_df.columns = ['orig', 'cc', 'voxels']
-    overlap_table_df.sort_values('voxels', ascending=False, inplace=True)
-    
-    # If a label in 'orig' is duplicated, it has multiple components in labels_cc.
+    cc_orig, cc_sizes = _component_labels_and_sizes(_as_3d(labels_orig), _as_3d(labels_cc), num_cc)
+    has_zero = (cc_sizes[0] > 0)
+
+    # Sort the components by size (largest first)
+    order = np.argsort(-cc_sizes[1:], kind='stable')
+    cc_ids = 1 + order
+    orig = cc_orig[cc_ids]
+
+    # If a label in 'orig' is duplicated, it has multiple components.
     # The largest component gets to keep the original ID;
     # the other components must take on new values.
     # (The new values must not conflict with any of the IDs in the original, so start at orig_max+1)
-    new_cc_pos = overlap_table_df['orig'].duplicated()
-    orig_max = overlap_table_df['orig'].max()
+    new_cc_pos = pd.Series(orig).duplicated().values
+    orig_max = labels_orig.max() if labels_orig.size else 0
     new_cc_values = np.arange(orig_max+1, orig_max+1+new_cc_pos.sum(), dtype=labels_orig.dtype)
 
-    overlap_table_df['final_cc'] = overlap_table_df['orig'].copy()
-    overlap_table_df.loc[new_cc_pos, 'final_cc'] = new_cc_values
-    
+    final_cc = orig.copy()
+    final_cc[new_cc_pos] = new_cc_values
+
     # Relabel the CC volume to use the 'final_cc' labels
-    mapper = LabelMapper(overlap_table_df['cc'].values, overlap_table_df['final_cc'].values)
-    mapper.apply_inplace(labels_cc)
+    table = np.zeros(num_cc+1, labels_cc.dtype)
+    table[cc_ids] = final_cc
+    _relabel_inplace_3d(_as_3d(labels_cc), table)
+    labels_cc = labels_cc.astype(labels_orig.dtype, copy=False)
 
     # Generate the mapping that could (if desired) convert the new
     # volume into the original one, as described in the docstring above.
-    emitted_mapping_rows = overlap_table_df['orig'].duplicated(keep=False)
-    emitted_mapping_pairs = overlap_table_df.loc[emitted_mapping_rows, ['final_cc', 'orig']].values
+    emitted_mapping_rows = pd.Series(orig).duplicated(keep=False).values
+    new_to_orig = dict(zip(final_cc[emitted_mapping_rows], orig[emitted_mapping_rows]))
 
-    new_to_orig = dict(emitted_mapping_pairs)
+    new_unique_labels = np.sort(final_cc)
+    if has_zero:
+        new_unique_labels = np.concatenate((np.zeros(1, final_cc.dtype), new_unique_labels))
 
-    new_unique_labels = pd.unique(overlap_table_df['final_cc'].values)
-    new_unique_labels = new_unique_labels.astype(overlap_table_df['final_cc'].dtype)
-    new_unique_labels.sort()
-    
     return labels_cc, new_to_orig, new_unique_labels
 
 
@@ -3,7 +3,7 @@ import numpy as np
 
 from .view_as_blocks import view_as_blocks
 from .box import box_intersection, box_to_slicing, extract_subvol, round_box
-from .grid import Grid, boxes_from_grid
+from .grid import Grid
 from .segmentation import compute_nonzero_box
 from .util import downsample_mask
 
@@ -152,65 +152,61 @@ class SparseBlockMask:
         Sample a subvolume of the mask, using full-resolution
         coordinates and returning a full-resolution mask subvolume.
 
-        This means creating an array of the requested shape, and overwriting
-        the portion of it that intersects (if any) with our stored lowres_mask.
+        Only the requested region is upsampled, directly into the result array
+        (no full-size upsampled copy of the stored mask is ever created).
 
-        Any box can be requested.  If the requested box does not intersect
-        with the stored voxels, the returned mask will be zeros.
+        Any box can be requested, aligned to the lowres grid or not.
+        Regions of the requested box that don't intersect with the
+        stored voxels will be zeros in the returned mask.
         """
-        # Here's a guide to the variable names below:
-        #
-        # +-----------------------+
-        # | stored                |
-        # | (self.lowres_mask)    |
-        # |      +----------------+--------+
-        # |      |  intersecting  |        |
-        # |      |  ("clipped")   |        |
-        # +------+----------------+        |
-        #        |              requested  |
-        #        |              ("result") |
-        #        +-------------------------+
-
         req_box_fullres = np.asarray(requested_box_fullres)
-        assert (req_box_fullres % self.resolution == 0).all(), \
-            "FIXME: Currently this function requires that the requested box is aligned to the lowres grid."
-
         req_shape_fullres = req_box_fullres[1] - req_box_fullres[0]
-        result_mask_fullres = np.zeros(req_shape_fullres, bool)
 
-        # Unless otherwise noted, all boxes/masks below are in low-res coordinates/voxels.
-        req_box = req_box_fullres // self.resolution
-        stored_box = (self.box // self.resolution)
+        # Lowres voxels which cover the requested box
+        # (including any partially covered voxels at the edges).
+        req_box = round_box(req_box_fullres, self.resolution, 'out') // self.resolution
+        stored_box = self.box // self.resolution
 
         clipped_box = box_intersection(req_box, stored_box)
         if (clipped_box[1] <= clipped_box[0]).any():
             # No intersection; return zeros
-            return result_mask_fullres
-
-        # Compute relative boxes as shown in diagram above.
-        clipped_within_stored = clipped_box - stored_box[0]
-        clipped_within_req = clipped_box - req_box[0]
-
-        # Extract intersecting region from within stored voxels
-        clipped_mask = self.lowres_mask[box_to_slicing(*clipped_within_stored)]
+            return np.zeros(req_shape_fullres, bool)
 
-        # Use the view_as_blocks() trick to create a 6D view,
-        # which we will write to via broadcasting from low-res voxels
-        result_mask_view = view_as_blocks(result_mask_fullres, tuple(self.resolution))
-
-        # Overwrite within result view (broadcasting achieves upsampling here)
-        slicing = (Ellipsis,) + (None,)*self.lowres_mask.ndim
-        result_mask_view[box_to_slicing(*clipped_within_req)] = clipped_mask[slicing]
+        # Copy the intersecting lowres voxels into a (lowres) array for the requested region,
+        # zero-padded where the request extends beyond the stored voxels.
+        if (clipped_box == req_box).all():
+            req_mask = self.lowres_mask[box_to_slicing(*(clipped_box - stored_box[0]))]
+        else:
+            req_mask = np.zeros(req_box[1] - req_box[0], bool)
+            req_mask[box_to_slicing(*(clipped_box - req_box[0]))] = \
+                self.lowres_mask[box_to_slicing(*(clipped_box - stored_box[0]))]
+
+        if not (req_box_fullres % self.resolution).any():
+            # Aligned request:
+            # Write into a 2N-D view of the result, in which each lowres voxel
+            # is broadcast (via zero strides) across its full-res block.
+            result_mask_fullres = np.empty(req_shape_fullres, bool)
+            expanded_shape = np.array((req_mask.shape, self.resolution)).transpose().reshape(-1)
+            result_mask_fullres.reshape(expanded_shape)[:] = req_mask[(slice(None), None)*req_mask.ndim]
+            return result_mask_fullres
 
-        # Return the full-res voxels
-        return result_mask_fullres
+        # Unaligned request:
+        # Look up the lowres voxel for each full-res coordinate along each axis.
+        indexes = [(np.arange(start, stop) // res) - lowres_start
+                   for start, stop, res, lowres_start
+                   in zip(*req_box_fullres, self.resolution, req_box[0])]
+        return req_mask[np.ix_(*indexes)]
 
 
-    def sparse_boxes( self, brick_grid, halo=0, return_logical_boxes=False ):
+    def sparse_boxes( self, brick_grid, halo=0, return_logical_boxes=False, lazy=False ):
         """
         Overlay a coarse grid (brick_grid) on top of this SparseBlockMask
         and extract the list of non-empty boxes from the given coarse grid.
 
+        The bricks are determined directly from the lowres mask, one row of
+        bricks (along the first axis) at a time, so even for very large masks,
+        no temporary arrays larger than a single row of bricks are needed.
+
         Args:
             brick_grid:
                 The desired grid to use for the output.
@@ -227,8 +223,13 @@ class SparseBlockMask:
                 plus halo, if given.
                 Note: It is not valid to use this option if halo is nonzero.
 
+            lazy:
+                If True, return an iterable which yields the boxes one at a time,
+                computing them as needed (one row of bricks at a time).
+
         Returns:
             boxes, shape=(N,2,3) of non-empty bricks, as indicated by block_mask.
+            (Or an iterable of boxes, if lazy=True.)
         """
         if brick_grid is None:
             brick_grid = Grid(self.resolution)
@@ -244,45 +245,77 @@ class SparseBlockMask:
         assert not (halo > 0 and return_logical_boxes), \
             "The return_logical_boxes option makes no sense if halo > 0"
 
-        block_mask_box = np.asarray(self.box)
+        if lazy:
+            return _LazySparseBoxes(self, brick_grid, halo, return_logical_boxes)
 
-        lowres_brick_grid = Grid( brick_grid.block_shape // self.resolution )
-        lowres_block_mask_box = block_mask_box // self.resolution
+        row_boxes = [*self._iter_sparse_box_rows(brick_grid, halo, return_logical_boxes)]
+        if len(row_boxes) == 0:
+            return np.zeros((0,2,3), dtype=np.int32)
+        return np.concatenate(row_boxes)
 
-        lowres_logical_boxes = boxes_from_grid(lowres_block_mask_box, lowres_brick_grid)
-        lowres_clipped_boxes = boxes_from_grid(lowres_block_mask_box, lowres_brick_grid, clipped=True)
 
-        lowres_boxes = []
-        for logical_lowres_box, clipped_lowres_box in zip(lowres_logical_boxes, lowres_clipped_boxes):
-            box_within_mask = clipped_lowres_box - lowres_block_mask_box[0]
-            brick_mask = self.lowres_mask[box_to_slicing(*box_within_mask)]
-            brick_coords = np.transpose(brick_mask.nonzero()).astype(np.int32)
-            if len(brick_coords) == 0:
+    def _iter_sparse_box_rows(self, brick_grid, halo, return_logical_boxes):
+        """
+        Generator.
+        For each row of bricks (along the first axis), yield
+        an array of the non-empty boxes in that row, in C-order.
+        """
+        lowres_brick_shape = brick_grid.block_shape // self.resolution
+        stored_box = self.box // self.resolution
+        aligned_box = round_box(stored_box, lowres_brick_shape, 'out')
+
+        halo_shape = np.zeros((3,), dtype=np.int32)
+        halo_shape[:] = halo
+
+        for row_start in range(aligned_box[0, 0], aligned_box[1, 0], lowres_brick_shape[0]):
+            row_box = aligned_box.copy()
+            row_box[:, 0] = (row_start, row_start + lowres_brick_shape[0])
+
+            # Copy this row of the mask into a brick-aligned (zero-padded) array.
+            row_mask = np.zeros(row_box[1] - row_box[0], bool)
+            clipped_box = box_intersection(row_box, stored_box)
+            row_mask[box_to_slicing(*(clipped_box - row_box[0]))] = \
+                self.lowres_mask[box_to_slicing(*(clipped_box - stored_box[0]))]
+
+            # 6D view: (brick index..., voxel within brick...)
+            bricks = view_as_blocks(row_mask, tuple(lowres_brick_shape))
+            occupied = bricks.any(axis=(3,4,5))
+            brick_indexes = np.argwhere(occupied)
+            if len(brick_indexes) == 0:
                 continue
 
+            starts = row_box[0] + brick_indexes * lowres_brick_shape
             if return_logical_boxes:
-                lowres_boxes.append( logical_lowres_box )
+                boxes = np.array((starts, starts + lowres_brick_shape)).transpose(1,0,2)
             else:
-                # Find the smallest box that still encompasses the non-zero
-                # lowres voxels in this brick (denoted by brick_coords)
-                physical_lowres_box = ( brick_coords.min(axis=0),
-                                        brick_coords.max(axis=0) + 1 )
-
-                # Translate back to global coordinates.
-                # Offset by this brick's location within the overall mask volume,
-                # and by the mask volume's location in global coordinates.
-                physical_lowres_box += box_within_mask[0] + lowres_block_mask_box[0]
-
-                lowres_boxes.append( physical_lowres_box )
-
-        if len(lowres_boxes) == 0:
-            nonempty_boxes = np.zeros((0,2,3), dtype=np.int32)
-        else:
-            nonempty_boxes = np.array(lowres_boxes, dtype=np.int32) * self.resolution
-
-            halo_shape = np.zeros((3,), dtype=np.int32)
-            halo_shape[:] = halo
+                # For each occupied brick, project the mask onto each
+                # axis to find the extents of its nonzero voxels.
+                occupied_bricks = bricks[occupied]
+                lo = np.zeros_like(starts)
+                hi = np.zeros_like(starts)
+                for axis in range(3):
+                    other_axes = tuple({1,2,3} - {axis+1})
+                    projection = occupied_bricks.any(axis=other_axes)
+                    lo[:, axis] = projection.argmax(axis=1)
+                    hi[:, axis] = projection.shape[1] - projection[:, ::-1].argmax(axis=1)
+                boxes = np.array((starts + lo, starts + hi)).transpose(1,0,2)
+
+            boxes = boxes.astype(np.int32) * self.resolution
             if halo_shape.any():
-                nonempty_boxes[:] += (-halo_shape, halo_shape)
+                boxes[:] += (-halo_shape, halo_shape)
+            yield boxes
+
 
-        return nonempty_boxes
+class _LazySparseBoxes:
+    """
+    Iterable returned by ``SparseBlockMask.sparse_boxes(..., lazy=True)``.
+    """
+    def __init__(self, sbm, brick_grid, halo, return_logical_boxes):
+        self.sbm = sbm
+        self.brick_grid = brick_grid
+        self.halo = halo
+        self.return_logical_boxes = return_logical_boxes
+
+    def __iter__(self):
+        for row_boxes in self.sbm._iter_sparse_box_rows(self.brick_grid, self.halo, self.return_logical_boxes):
+            yield from row_boxes
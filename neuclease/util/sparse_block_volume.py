@@ -0,0 +1,207 @@
+import numpy as np
+import pandas as pd
+from numba import jit
+
+from .box import box_shape
+
+
+class SparseBlockVolume:
+    """
+    A volume in which only some blocks are stored (the rest are implicitly
+    filled with ``fill_value``, which is 0 unless otherwise specified).
+
+    The blocks are stored in a single contiguous array (the "pool"),
+    shape (N, *block_shape), alongside the corner of each block.
+    Indexing with slices produces a dense subvolume, allocating only the
+    requested region, and ``to_dense()`` materializes the entire volume.
+    Some common operations (``unique()``, ``==``, ``isin()``) operate on the
+    stored blocks directly, without materializing the volume.
+
+    Coordinates given to ``__getitem__`` are relative to the start of ``box``,
+    exactly as if you were indexing into the result of ``to_dense()``.
+    """
+    def __init__(self, corners, blocks, box=None, fill_value=0):
+        """
+        Args:
+            corners:
+                array (N,3), the corner of each block (in global coordinates).
+            blocks:
+                array (N, *block_shape), the block data.
+            box:
+                The extents of the volume (in global coordinates).
+                Defaults to the bounding box of the given blocks.
+            fill_value:
+                The value of all voxels which aren't covered by any stored block.
+        """
+        self.corners = np.asarray(corners, np.int64).reshape(-1, 3)
+        self.blocks = np.asarray(blocks)
+        assert self.blocks.ndim == 4 and len(self.blocks) == len(self.corners)
+        self.block_shape = np.array(self.blocks.shape[1:])
+
+        if box is None:
+            if len(self.corners) == 0:
+                box = np.zeros((2,3), np.int64)
+            else:
+                box = (self.corners.min(axis=0), self.corners.max(axis=0) + self.block_shape)
+        self.box = np.asarray(box, np.int64)
+        self.fill_value = np.asarray(fill_value, self.blocks.dtype)[()]
+        self._block_indexes = None
+
+    @property
+    def shape(self):
+        return tuple(box_shape(self.box).tolist())
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def dtype(self):
+        return self.blocks.dtype
+
+    @property
+    def nbytes(self):
+        return self.blocks.nbytes
+
+    def __len__(self):
+        return len(self.corners)
+
+    def items(self):
+        """
+        Iterate over (corner, block) pairs, as with the dict returned by
+        ``fetch_labelmap_specificblocks(..., format='blocks')``.
+        """
+        return zip(map(tuple, self.corners.tolist()), self.blocks)
+
+    def block(self, corner):
+        """
+        Return the stored block at the given corner, or None if it isn't stored.
+        """
+        if self._block_indexes is None:
+            self._block_indexes = {c: i for i, c in enumerate(map(tuple, self.corners.tolist()))}
+        i = self._block_indexes.get(tuple(corner))
+        if i is None:
+            return None
+        return self.blocks[i]
+
+    def extract_box(self, box, out=None):
+        """
+        Return a dense array for the given box (in global coordinates).
+        Regions which aren't covered by any stored block contain the fill_value.
+        The box need not be block-aligned, nor lie within the volume's box.
+        """
+        box = np.asarray(box, np.int64)
+        if out is None:
+            out = np.full(box_shape(box), self.fill_value, self.dtype)
+        else:
+            assert out.shape == tuple(box_shape(box))
+            out[:] = self.fill_value
+
+        if len(self.corners) > 0:
+            _paste_blocks(self.blocks, self.corners, box[0], out)
+        return out
+
+    def to_dense(self):
+        return self.extract_box(self.box)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.to_dense()
+        if dtype is not None:
+            dense = dense.astype(dtype, copy=False)
+        return dense
+
+    def __getitem__(self, slicing):
+        if not isinstance(slicing, tuple):
+            slicing = (slicing,)
+        assert len(slicing) <= 3, "Too many indices"
+        slicing = (*slicing, *[slice(None)]*(3 - len(slicing)))
+
+        box = self.box.copy()
+        squeeze = []
+        for axis, s in enumerate(slicing):
+            size = box[1, axis] - box[0, axis]
+            if isinstance(s, slice):
+                start, stop, step = s.indices(size)
+                assert step == 1, "Strided slicing is not supported"
+                stop = max(start, stop)
+            else:
+                start = int(s)
+                if start < 0:
+                    start += size
+                if not (0 <= start < size):
+                    raise IndexError(f"Index {s} is out of bounds for axis {axis} with size {size}")
+                stop = start + 1
+                squeeze.append(axis)
+            box[:, axis] = box[0, axis] + (start, stop)
+
+        result = self.extract_box(box)
+        if squeeze:
+            result = result.squeeze(axis=tuple(squeeze))
+        return result
+
+    def unique(self):
+        """
+        Equivalent to ``np.unique(self.to_dense())``, without materializing the volume.
+        """
+        values = pd.unique(self.blocks.reshape(-1))
+        if self._uncovered_voxels() > 0:
+            values = pd.unique(np.concatenate((values, [self.fill_value])))
+        return np.sort(values)
+
+    def isin(self, values):
+        """
+        Return a boolean SparseBlockVolume (with the same blocks)
+        indicating which voxels contain any of the given values.
+        """
+        mask = pd.Series(self.blocks.reshape(-1)).isin(values).values
+        fill = pd.Series([self.fill_value], dtype=self.dtype).isin(values).iloc[0]
+        return SparseBlockVolume(self.corners, mask.reshape(self.blocks.shape), self.box, fill)
+
+    def __eq__(self, value):
+        return SparseBlockVolume(self.corners, self.blocks == value, self.box, self.fill_value == value)
+
+    def __ne__(self, value):
+        return SparseBlockVolume(self.corners, self.blocks != value, self.box, self.fill_value != value)
+
+    # Since __eq__ is elementwise, instances can't be hashed.
+    __hash__ = None
+
+    def count_nonzero(self):
+        count = int(np.count_nonzero(self.blocks))
+        if self.fill_value != 0:
+            count += self._uncovered_voxels()
+        return count
+
+    def _uncovered_voxels(self):
+        """
+        The number of voxels in the volume's box which aren't
+        covered by any stored block (the blocks are assumed not to overlap).
+        """
+        lo = np.maximum(self.corners, self.box[0])
+        hi = np.minimum(self.corners + self.block_shape, self.box[1])
+        covered = np.prod(np.maximum(hi - lo, 0), axis=1).sum()
+        return int(np.prod(box_shape(self.box)) - covered)
+
+
+@jit(nopython=True, nogil=True)
+def _paste_blocks(blocks, corners, out_offset, out):
+    """
+    Copy each block into the output array (wherever it overlaps).
+    """
+    bz, by, bx = blocks.shape[1:]
+    oz, oy, ox = out.shape
+    for i in range(len(blocks)):
+        z0 = corners[i, 0] - out_offset[0]
+        y0 = corners[i, 1] - out_offset[1]
+        x0 = corners[i, 2] - out_offset[2]
+
+        z_start = max(0, -z0)
+        y_start = max(0, -y0)
+        x_start = max(0, -x0)
+        z_stop = min(bz, oz - z0)
+        y_stop = min(by, oy - y0)
+        x_stop = min(bx, ox - x0)
+
+        for z in range(z_start, z_stop):
+            for y in range(y_start, y_stop):
+                out[z0 + z, y0 + y, x0 + x_start:x0 + x_stop] = blocks[i, z, y, x_start:x_stop]
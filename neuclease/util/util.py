@@ -175,6 +175,23 @@ def switch_cwd(d, create=False):
     os.chdir(old_dir)
 
 
+@contextlib.contextmanager
+def file_lock(lock_path):
+    """
+    Context manager.
+    Hold an exclusive (advisory) lock on the given file,
+    e.g. to prevent multiple processes from updating a cache at once.
+    The lock file is created if necessary.
+    """
+    import fcntl
+    with open(lock_path, 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
 class ndrange:
     """
     Generator.